@@ -0,0 +1,68 @@
+"""
+Pathfinder scaling benchmark on synthetic walls: times normalize_holds,
+build_local_coach and the JSON serialization sent to Gemini for hold
+counts from 10 to 5,000.
+
+Example:
+    python benchmark_pathfinder.py --sizes 10 100 1000 5000 --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+
+from pathfinder import HoldArrays, build_local_coach, normalize_holds
+from route_search import HOLD_TYPES
+
+DEFAULT_SIZES = [10, 50, 100, 500, 1000, 2000, 5000]
+
+
+def synthetic_holds(n, img_w, img_h, seed=0):
+    rng = random.Random(seed)
+    holds = []
+    for i in range(n):
+        w = rng.uniform(15, 60)
+        h = rng.uniform(15, 60)
+        x1 = rng.uniform(0, img_w - w)
+        y1 = rng.uniform(0, img_h - h)
+        holds.append({
+            "id": i,
+            "bbox": [int(x1), int(y1), int(x1 + w), int(y1 + h)],
+            "type": rng.choice(HOLD_TYPES),
+            "confidence": rng.uniform(0.3, 1.0),
+        })
+    return {"holds": holds}
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pathfinder scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Hold counts to test")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    parser.add_argument("--width", type=int, default=4000, help="Synthetic image width")
+    parser.add_argument("--height", type=int, default=3000, help="Synthetic image height")
+    args = parser.parse_args()
+
+    print(f"{'holds':>7} | {'normalize':>10} | {'to arrays':>10} | {'coach':>10} | {'json':>10} | routes")
+    print("-" * 68)
+    for n in args.sizes:
+        hold_data = synthetic_holds(n, args.width, args.height)
+        t_norm, normalized = best_of(args.repeat, lambda: normalize_holds(hold_data, args.width, args.height))
+        t_arrays, holds = best_of(args.repeat, lambda: HoldArrays.from_hold_data(hold_data, args.width, args.height))
+        t_coach, coach = best_of(args.repeat, lambda: build_local_coach(holds))
+        t_json, _ = best_of(args.repeat, lambda: json.dumps(normalized, ensure_ascii=False))
+        route_lengths = [len(r["holds"]) for r in coach["routes"]]
+        print(f"{n:>7} | {t_norm:>8.2f}ms | {t_arrays:>8.2f}ms | {t_coach:>8.2f}ms | {t_json:>8.2f}ms | {route_lengths}")
+
+
+if __name__ == "__main__":
+    main()
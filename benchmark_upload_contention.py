@@ -0,0 +1,113 @@
+"""
+Write-contention benchmark: hammer /classifier/upload with concurrent requests
+against a running FastAPI server and report throughput, latency percentiles
+and errors (e.g. "database is locked"). Run it once per DB configuration
+(SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, DB_POOL_SIZE, CLIMB_DATABASE_URL, ...)
+and compare.
+
+Example:
+    python benchmark_upload_contention.py -i test_data_sd/altitude2_classified.jpg -c 16 -n 200
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def post_upload(url, filename, image_bytes, timeout):
+    body = json.dumps({
+        "filename": filename,
+        "content_type": "image/jpeg",
+        "data": base64.b64encode(image_bytes).decode("ascii"),
+    }).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status, detail = response.status, ""
+    except urllib.error.HTTPError as exc:
+        status, detail = exc.code, exc.read().decode("utf-8", "replace")[:200]
+    except Exception as exc:
+        status, detail = 0, str(exc)[:200]
+    return status, time.perf_counter() - start, detail
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /classifier/upload write-contention benchmark")
+    parser.add_argument("-i", "--image", required=True, help="JPEG to upload")
+    parser.add_argument("-u", "--url", default="http://127.0.0.1:9000/classifier/upload", help="Upload endpoint")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="Total requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    parser.add_argument(
+        "--same-bytes",
+        action="store_true",
+        help="Upload identical bytes every time (default appends a unique trailer so "
+             "the result cache and blob dedup do not hide write contention)",
+    )
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+
+    def payload(i):
+        if args.same_bytes:
+            return image_bytes
+        # Bytes after the JPEG end marker are ignored by decoders but change the content hash.
+        return image_bytes + f"\nbench-{os.getpid()}-{i}-{time.time_ns()}".encode("ascii")
+
+    print(f"Uploading {args.requests} x {len(image_bytes) / 1024:.0f} KiB with concurrency {args.concurrency} -> {args.url}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda i: post_upload(args.url, f"bench_{i}.jpg", payload(i), args.timeout),
+            range(args.requests),
+        ))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _, _ in results)
+    latencies = sorted(latency for status, latency, _ in results if status == 200)
+    locked = sum(1 for _, _, detail in results if "locked" in detail.lower())
+    # An unhandled OperationalError ("database is locked") comes back as a bare 500, so
+    # server errors are counted by status; 503 is the inference pool shedding load.
+    server_errors = sum(n for status, n in statuses.items() if status >= 500 and status != 503)
+    failed = sum(n for status, n in statuses.items() if not 200 <= status < 300)
+    ok = statuses.get(200, 0)
+
+    print(f"\n{'='*60}")
+    print("RESULTS")
+    print(f"{'='*60}")
+    print(f"Wall time:       {elapsed:.2f}s")
+    print(f"Throughput:      {ok / elapsed:.2f} successful uploads/s")
+    print(f"Status codes:    {dict(sorted(statuses.items()))}")
+    print(f"Failed (non-2xx): {failed}")
+    print(f"  5xx (not 503): {server_errors}")
+    print(f"  503 busy:      {statuses.get(503, 0)}")
+    print(f"  no response:   {statuses.get(0, 0)}")
+    print(f"'locked' detail: {locked}")
+    if latencies:
+        print(f"Latency p50:     {percentile(latencies, 50) * 1000:.0f} ms")
+        print(f"Latency p95:     {percentile(latencies, 95) * 1000:.0f} ms")
+        print(f"Latency p99:     {percentile(latencies, 99) * 1000:.0f} ms")
+        print(f"Latency max:     {latencies[-1] * 1000:.0f} ms")
+    errors = [detail for status, _, detail in results if status != 200 and detail]
+    if errors:
+        print(f"First error:     {errors[0]}")
+    print(f"{'='*60}\n")
+
+
+if __name__ == "__main__":
+    main()
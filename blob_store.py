@@ -0,0 +1,208 @@
+"""
+Content-addressed storage for uploaded image bytes.
+Images are keyed by their SHA-256, so identical uploads are stored once.
+The database only keeps the key (plus size/dimensions); pixels are read
+lazily, or memory-mapped, when a request actually needs them.
+
+Run this file to move image bytes still stored inline in SQLite into the
+blob store:
+    python blob_store.py --migrate [--vacuum]
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+
+# =========================
+# CONFIGURATION
+# =========================
+BLOB_STORE_BACKEND = os.environ.get("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_DIR = os.environ.get(
+    "BLOB_STORE_DIR",
+    str(Path(os.environ.get("CLIMB_DB_DIR", Path(__file__).resolve().parent / "db")) / "blobs"),
+)
+
+
+def content_key(data) -> str:
+    return hashlib.sha256(memoryview(data)).hexdigest()
+
+
+class BlobStore(ABC):
+    """Interface every blob backend implements; keys are SHA-256 hex digests of the content."""
+
+    @abstractmethod
+    def put(self, data) -> str:
+        """Store data (deduplicated) and return its key."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Return the full content for key."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """True if key is stored."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove key if present."""
+
+    def open(self, key: str):
+        """Binary file-like object for lazy readers such as PIL.Image.open."""
+        return BytesIO(self.get(key))
+
+    @contextmanager
+    def buffer(self, key: str):
+        """Yield a read-only buffer over the content (no copy where the backend allows it)."""
+        yield memoryview(self.get(key))
+
+
+class LocalBlobStore(BlobStore):
+    """Filesystem backend sharded by hash prefix: <root>/ab/cd/abcd...."""
+
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        if len(key) < 5 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return self.root / key[:2] / key[2:4] / key
+
+    def put(self, data) -> str:
+        key = content_key(data)
+        path = self.path_for(key)
+        if path.exists():
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file in the same directory, then rename: readers never
+        # see a partial blob and concurrent writers of the same content are harmless.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self.path_for(key).read_bytes()
+
+    def exists(self, key: str) -> bool:
+        return self.path_for(key).exists()
+
+    def delete(self, key: str) -> None:
+        try:
+            self.path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def open(self, key: str):
+        return open(self.path_for(key), "rb")
+
+    @contextmanager
+    def buffer(self, key: str):
+        with open(self.path_for(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # mmap cannot map empty files.
+                yield memoryview(b"")
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                view.release()
+                try:
+                    mm.close()
+                except BufferError:
+                    # A consumer still holds a slice; the map is released when it is collected.
+                    pass
+
+
+BLOB_BACKENDS = {"local": LocalBlobStore}
+
+
+def register_backend(name: str, factory) -> None:
+    """Make another backend (e.g. object storage) selectable via BLOB_STORE_BACKEND."""
+    BLOB_BACKENDS[name] = factory
+
+
+_store = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        try:
+            factory = BLOB_BACKENDS[BLOB_STORE_BACKEND]
+        except KeyError as exc:
+            raise ValueError(
+                f"Unknown BLOB_STORE_BACKEND {BLOB_STORE_BACKEND!r}; choose from {sorted(BLOB_BACKENDS)}"
+            ) from exc
+        _store = factory()
+    return _store
+
+
+def migrate_inline_images(vacuum=False, batch_size=50):
+    """Move Image.data blobs into the blob store and clear the inline column."""
+    from PIL import Image as PILImage
+    from sqlalchemy import text
+
+    import models
+    from database import SessionLocal, engine
+
+    store = get_blob_store()
+    moved = 0
+    with SessionLocal() as db:
+        while True:
+            ids = [
+                row.id
+                for row in db.query(models.Image.id)
+                .filter(models.Image.blob_key.is_(None))
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+            for image in db.query(models.Image).filter(models.Image.id.in_(ids)):
+                data = image.data or b""
+                image.blob_key = store.put(data)
+                image.size = len(data)
+                try:
+                    image.width, image.height = PILImage.open(BytesIO(data)).size
+                except Exception:
+                    pass
+                image.data = b""
+                moved += 1
+            db.commit()
+    print(f"✓ Moved {moved} image(s) into {BLOB_STORE_BACKEND} blob store")
+
+    if vacuum and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+        print("✓ SQLite database vacuumed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Blob store maintenance")
+    parser.add_argument("--migrate", action="store_true", help="Move inline Image.data into the blob store")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM SQLite after migrating")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_inline_images(vacuum=args.vacuum)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Inference-time optimizations for the eager ConvNeXt classifier.
+load_classifier applies them from env toggles:
+- CLASSIFIER_CHANNELS_LAST=1  NHWC weights and inputs (faster oneDNN convolutions on CPU)
+- CLASSIFIER_BF16=1           bfloat16 autocast, only on CPUs with native bf16 support
+- CLASSIFIER_COMPILE=1        torch.compile where available
+- CLASSIFIER_QUANT=dynamic    INT8 weights for the Linear (pointwise MLP) layers
+- CLASSIFIER_QUANT=static     FX graph-mode INT8, calibrated on generated crops
+                              (CLASSIFIER_CALIB_DIR, see generate_crops_for_finetuning.py)
+
+Run this file to measure each variant's accuracy delta and latency against
+fp32 on the val split before enabling it for a deployment:
+    python classifier_optim.py --val holds_cls/val --calib holds_cls_finetuned/train
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+
+def _env_flag(name, default="0"):
+    return os.environ.get(name, default).lower() not in ("0", "false", "no")
+
+
+# =========================
+# CONFIGURATION
+# =========================
+CLASSIFIER_CHANNELS_LAST = _env_flag("CLASSIFIER_CHANNELS_LAST")
+CLASSIFIER_BF16 = _env_flag("CLASSIFIER_BF16")
+CLASSIFIER_COMPILE = _env_flag("CLASSIFIER_COMPILE")
+CLASSIFIER_QUANT = os.environ.get("CLASSIFIER_QUANT", "none")  # none | dynamic | static
+CLASSIFIER_CALIB_DIR = os.environ.get("CLASSIFIER_CALIB_DIR", "holds_cls_finetuned/train")
+CLASSIFIER_CALIB_SAMPLES = int(os.environ.get("CLASSIFIER_CALIB_SAMPLES", "256"))
+QUANT_MODES = ("none", "dynamic", "static")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+_applied_tag = ""  # settings_tag of what the last optimize_classifier call actually applied
+VARIANTS = {
+    "fp32": {},
+    "channels_last": {"channels_last": True},
+    "bf16": {"channels_last": True, "bf16": True},
+    "compile": {"channels_last": True, "compile": True},
+    "dynamic": {"quant": "dynamic"},
+    "static": {"quant": "static"},
+}
+
+
+def bf16_supported():
+    """True if this CPU runs bfloat16 natively (AVX512-BF16 / AMX); emulated bf16 is slower than fp32."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def settings_tag(channels_last=CLASSIFIER_CHANNELS_LAST, bf16=CLASSIFIER_BF16, compile=CLASSIFIER_COMPILE,
+                 quant=CLASSIFIER_QUANT):
+    """Short description of the given options ("" for plain fp32)."""
+    parts = [name for name, on in (("cl", channels_last), ("bf16", bf16), ("compile", compile)) if on]
+    if quant != "none":
+        parts.append(f"int8-{quant}")
+    return "+".join(parts)
+
+
+class OptimizedClassifier(nn.Module):
+    """Applies the input-side options (memory format, autocast) around the wrapped model."""
+
+    def __init__(self, model, channels_last=False, bf16=False):
+        super().__init__()
+        self.model = model
+        self.channels_last = channels_last
+        self.bf16 = bf16
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.bf16:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def applied_settings_tag():
+    """Options the loaded classifier really runs with ("" for fp32 or exported backends); part of the result-cache key."""
+    return _applied_tag
+
+
+def load_crops(folder, limit, seed=0):
+    """Up to `limit` crop images (any depth) from folder, as PIL RGB images."""
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    random.Random(seed).shuffle(paths)
+    return [Image.open(p).convert("RGB") for p in paths[:limit]]
+
+
+def quantize_static(model, calib_crops, batch_size=32):
+    """FX graph-mode post-training INT8 (x86 backend), calibrated on the given crops."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    from detect_and_classify import classify_transform
+
+    if not calib_crops:
+        raise ValueError("Static quantization needs calibration crops (CLASSIFIER_CALIB_DIR is empty or missing)")
+    example = torch.stack([classify_transform(calib_crops[0])])
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping("x86"), (example,))
+    with torch.no_grad():
+        for start in range(0, len(calib_crops), batch_size):
+            prepared(torch.stack([classify_transform(c) for c in calib_crops[start:start + batch_size]]))
+    return convert_fx(prepared)
+
+
+def optimize_classifier(model, device, channels_last=CLASSIFIER_CHANNELS_LAST, bf16=CLASSIFIER_BF16,
+                        compile=CLASSIFIER_COMPILE, quant=CLASSIFIER_QUANT, calib_dir=CLASSIFIER_CALIB_DIR,
+                        calib_samples=CLASSIFIER_CALIB_SAMPLES):
+    """Return model with the requested options applied; unsupported ones are skipped with a warning."""
+    global _applied_tag
+    if quant not in QUANT_MODES:
+        raise ValueError(f"Unknown CLASSIFIER_QUANT {quant!r}; choose from {QUANT_MODES}")
+    on_cpu = str(device).startswith("cpu")
+    if quant != "none" and not on_cpu:
+        print(f"⚠ INT8 quantization runs on CPU only; skipping on {device}")
+        quant = "none"
+    if bf16 and not (on_cpu and bf16_supported()):
+        print("⚠ bfloat16 autocast needs a CPU with native bf16 support; staying in fp32")
+        bf16 = False
+
+    if quant == "dynamic":
+        # INT8 quantized ops have no channels_last/bf16 kernels; keep those off.
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        channels_last = bf16 = False
+    elif quant == "static":
+        model = quantize_static(model, load_crops(calib_dir, calib_samples))
+        channels_last = bf16 = False
+    elif channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    if channels_last or bf16:
+        model = OptimizedClassifier(model, channels_last=channels_last, bf16=bf16).eval()
+    if compile:
+        if hasattr(torch, "compile"):
+            model = torch.compile(model)
+        else:
+            print("⚠ torch.compile is not available in this PyTorch version; skipping")
+
+    tag = settings_tag(channels_last, bf16, compile, quant)
+    _applied_tag = tag
+    if tag:
+        print(f"✓ Classifier optimizations: {tag}")
+    return model
+
+
+# =========================
+# ACCURACY / LATENCY REPORT
+# =========================
+def evaluate(model, loader):
+    """(accuracy, predictions, seconds per image) over a DataLoader of (images, labels)."""
+    correct, total, seconds, preds = 0, 0, 0.0, []
+    with torch.no_grad():
+        for x, y in loader:
+            start = time.perf_counter()
+            pred = model(x).argmax(1)
+            seconds += time.perf_counter() - start
+            preds.append(pred)
+            correct += (pred == y).sum().item()
+            total += y.size(0)
+    return correct / max(total, 1), torch.cat(preds) if preds else torch.zeros(0), seconds / max(total, 1)
+
+
+def main():
+    from torch.utils.data import DataLoader
+    from torchvision import datasets
+
+    from detect_and_classify import CONVNEXT_MODEL, classify_transform, load_classifier
+
+    parser = argparse.ArgumentParser(description="Accuracy delta and latency of classifier optimizations vs fp32")
+    parser.add_argument('-c', '--classifier', default=CONVNEXT_MODEL, help='Path to ConvNeXt checkpoint')
+    parser.add_argument('--val', default="holds_cls/val", help='Val split (ImageFolder layout)')
+    parser.add_argument('--calib', default=CLASSIFIER_CALIB_DIR, help='Calibration crops for static INT8')
+    parser.add_argument('--calib-samples', type=int, default=CLASSIFIER_CALIB_SAMPLES, help='Calibration crops to use')
+    parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS), help='Variants to compare')
+    parser.add_argument('--batch-size', type=int, default=32, help='Evaluation batch size')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.val):
+        sys.exit(f"Val split not found: {args.val}")
+    loader = DataLoader(datasets.ImageFolder(args.val, transform=classify_transform), batch_size=args.batch_size)
+    # Optimizations are applied below per variant, not from the environment.
+    base = load_classifier(args.classifier, "cpu", optimize=False)
+
+    results = {}
+    print(f"\n{'variant (applied)':<28} {'accuracy':>9} {'Δ vs fp32':>10} {'agree':>7} {'ms/img':>8}")
+    print("-" * 66)
+    for name in ["fp32"] + [v for v in args.variants if v != "fp32"]:
+        options = {"channels_last": False, "bf16": False, "compile": False, "quant": "none", **VARIANTS[name]}
+        try:
+            model = optimize_classifier(copy.deepcopy(base), "cpu", calib_dir=args.calib,
+                                        calib_samples=args.calib_samples, **options)
+            # Label by what was applied, e.g. bf16 falls back to fp32 on CPUs without native support.
+            applied = applied_settings_tag()
+            label = name if applied == settings_tag(**options) else f"{name} ({applied or 'fp32'})"
+            if name == "compile":
+                evaluate(model, [next(iter(loader))])  # compilation happens on the first call
+            acc, preds, per_img = evaluate(model, loader)
+        except Exception as exc:
+            print(f"{name:<28} failed: {exc}")
+            continue
+        results[name] = (acc, preds)
+        if "fp32" not in results:
+            # Without the baseline only the absolute columns can be reported.
+            print(f"{label:<28} {acc:>9.2%} {'n/a':>11} {'n/a':>7} {per_img * 1000:>8.2f}")
+            continue
+        ref_acc, ref_preds = results["fp32"]
+        agree = (preds == ref_preds).float().mean().item() if len(preds) else 1.0
+        print(f"{label:<28} {acc:>9.2%} {(acc - ref_acc) * 100:>+9.2f}pp {agree:>7.1%} {per_img * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
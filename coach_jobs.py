@@ -0,0 +1,134 @@
+"""
+Background LLM refinement for /classifier/pathfinder.
+The local coach is returned right away together with a job id; the Gemini
+answer is computed by coach_service in the background, written to
+Image.path_found when it arrives, and can be fetched by long-polling or
+over server-sent events. Jobs live in memory only: Image.path_found is the
+durable result. The job table is per process, so job status and events need a
+single uvicorn worker (with more, a status request can land on a worker that
+never saw the job and get 404).
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import models
+from coach_service import coach_service
+from database import SessionLocal
+
+# =========================
+# CONFIGURATION
+# =========================
+COACH_JOB_TTL_S = float(os.environ.get("COACH_JOB_TTL_S", "900"))  # how long finished jobs stay queryable
+
+PENDING = "pending"
+DONE = "done"          # LLM coach stored in Image.path_found
+FALLBACK = "fallback"  # LLM unavailable or failed; the local coach stands
+SUPERSEDED = "superseded"  # LLM coach arrived after path_found was rewritten for newer holds; not stored
+
+
+class CoachJob:
+    def __init__(self, image_id):
+        self.id = uuid.uuid4().hex
+        self.image_id = image_id
+        self.status = PENDING
+        self.coach = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.finished = Future()  # resolves to the job itself once its result is stored
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "image_id": self.image_id,
+            "status": self.status,
+            "coach": self.coach,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class CoachJobs:
+    """In-memory job table; results are written back on a dedicated DB thread."""
+
+    def __init__(self, service=coach_service, session_factory=SessionLocal, ttl=COACH_JOB_TTL_S):
+        self.service = service
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._jobs = {}
+        self._latest_by_image = {}
+        self._lock = threading.Lock()
+        # Held while a result is written, so invalidate() can wait out a write in progress.
+        self._write_lock = threading.Lock()
+        # The LLM future completes on the coach event loop; DB writes must not block it.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coach-writer")
+
+    def start(self, image_id, image_key, load_image, normalized, model, local_coach):
+        """Register a job for image_id and start the LLM call; returns the job."""
+        job = CoachJob(image_id)
+        job.coach = local_coach
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._latest_by_image[image_id] = job.id
+        future = self.service.submit(image_key, load_image, normalized, model)
+        future.add_done_callback(lambda f: self._writer.submit(self._complete, job, f))
+        return job
+
+    def invalidate(self, image_id):
+        """
+        Stop pending jobs of image_id from writing Image.path_found. Call before
+        committing a newer path_found; returns once any write in progress is done.
+        """
+        with self._write_lock, self._lock:
+            self._latest_by_image.pop(image_id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _complete(self, job, future):
+        try:
+            coach = future.result()
+        except Exception:
+            coach = None  # coach_service already logged it
+
+        if coach is not None:
+            with self._write_lock:
+                with self._lock:
+                    # A newer job, /pathfinder call or hold edit owns path_found now.
+                    is_latest = self._latest_by_image.get(job.image_id) == job.id
+                if is_latest:
+                    try:
+                        with self.session_factory() as db:
+                            image = db.get(models.Image, job.image_id)
+                            if image is not None:
+                                image.path_found = coach
+                                db.commit()
+                    except Exception as exc:
+                        sys.stderr.write(f"Storing coach result for image {job.image_id} failed: {exc}\n")
+            job.coach = coach
+            job.status = DONE if is_latest else SUPERSEDED
+        else:
+            job.status = FALLBACK
+        job.finished_at = time.time()
+        job.finished.set_result(job)
+
+    def _prune(self):
+        """Drop finished jobs older than the TTL (caller holds the lock)."""
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            job = self._jobs.pop(job_id)
+            if self._latest_by_image.get(job.image_id) == job_id:
+                del self._latest_by_image[job.image_id]
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j.status == PENDING)
+            return {"jobs": len(self._jobs), "pending": pending}
+
+
+jobs = CoachJobs()
@@ -0,0 +1,355 @@
+"""
+LLM coach calls with a latency budget.
+One shared async client runs on a background event loop; callers wait at
+most COACH_TIMEOUT_S and otherwise fall back to the local route search.
+Identical requests (image hash + normalized holds + model + prompt version)
+share one in-flight call, and answers are kept in a TTL/LRU cache. A late
+answer still lands in the cache for the next request.
+
+COACH_BACKEND=stub swaps Gemini for an offline backend with a configurable
+delay, so timeouts, deduplication and caching can be exercised without a key.
+"""
+import argparse
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from io import BytesIO
+
+from pathfinder import (
+    PROMPT_VERSION,
+    HoldArrays,
+    build_local_coach,
+    get_genai_client,
+    gemini_request,
+    parse_coach_response,
+)
+
+# =========================
+# CONFIGURATION
+# =========================
+COACH_BACKEND = os.environ.get("COACH_BACKEND", "gemini")
+COACH_TIMEOUT_S = float(os.environ.get("COACH_TIMEOUT_S", "20"))          # caller's wait before local fallback
+COACH_CALL_TIMEOUT_S = float(os.environ.get("COACH_CALL_TIMEOUT_S", "90"))  # hard cap on the backend call itself
+COACH_MAX_CONCURRENCY = int(os.environ.get("COACH_MAX_CONCURRENCY", "4"))  # simultaneous LLM calls, rest queue
+COACH_CACHE_SIZE = int(os.environ.get("COACH_CACHE_SIZE", "256"))         # 0 disables
+COACH_CACHE_TTL_S = float(os.environ.get("COACH_CACHE_TTL_S", "3600"))
+COACH_STUB_DELAY_MS = float(os.environ.get("COACH_STUB_DELAY_MS", "200"))
+DEFAULT_MODEL = "models/gemini-2.5-flash"
+
+
+class GeminiBackend:
+    """google-genai through the shared client's async API."""
+
+    name = "gemini"
+
+    def available(self):
+        return get_genai_client()[0] is not None
+
+    async def generate(self, img, normalized, model):
+        genai_client, types = get_genai_client()
+        if genai_client is None:
+            return None
+        response = await genai_client.aio.models.generate_content(
+            model=model, **gemini_request(img, normalized, types)
+        )
+        return parse_coach_response(response)
+
+
+class StubBackend:
+    """Offline stand-in: answers with the local coach after COACH_STUB_DELAY_MS."""
+
+    name = "stub"
+
+    def __init__(self, delay_ms=COACH_STUB_DELAY_MS):
+        self.delay_ms = delay_ms
+        self.calls = 0
+
+    def available(self):
+        return True
+
+    async def generate(self, img, normalized, model):
+        self.calls += 1
+        await asyncio.sleep(self.delay_ms / 1000.0)
+        coach = build_local_coach(normalized)
+        coach["notes"] = f"[stub coach for {model}] " + coach["notes"]
+        return coach
+
+
+COACH_BACKENDS = {"gemini": GeminiBackend, "stub": StubBackend}
+
+
+def _done_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class CoachService:
+    """Deduplicating, caching front for an async coach backend."""
+
+    def __init__(self, backend=COACH_BACKEND, timeout=COACH_TIMEOUT_S, call_timeout=COACH_CALL_TIMEOUT_S,
+                 cache_size=COACH_CACHE_SIZE, ttl=COACH_CACHE_TTL_S, max_concurrency=COACH_MAX_CONCURRENCY):
+        if isinstance(backend, str):
+            try:
+                backend = COACH_BACKENDS[backend]()
+            except KeyError as exc:
+                raise ValueError(f"Unknown COACH_BACKEND {backend!r}; choose from {sorted(COACH_BACKENDS)}") from exc
+        self.backend = backend
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = None  # created on the loop thread
+        self._entries = OrderedDict()  # key -> (expires_at, coach)
+        self._in_flight = {}           # key -> concurrent Future
+        self._lock = threading.Lock()
+        self._loop = None
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    # ---- event loop -------------------------------------------------
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="coach-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    # ---- cache ------------------------------------------------------
+
+    @staticmethod
+    def make_key(image_key, normalized, model):
+        digest = hashlib.sha256()
+        digest.update(f"{image_key}|{model}|{PROMPT_VERSION}|".encode("utf-8"))
+        digest.update(json.dumps(normalized, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, coach = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return coach
+
+    def _remember(self, key, coach):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, coach)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+
+    # ---- requests ---------------------------------------------------
+
+    async def _generate(self, load_image, normalized, model):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Limits the LLM tier independently of the inference pool; excess calls queue here.
+        async with self._semaphore:
+            # Decoding the photo is blocking; keep it off the loop thread.
+            img = await asyncio.get_running_loop().run_in_executor(None, load_image)
+            return await asyncio.wait_for(self.backend.generate(img, normalized, model), self.call_timeout)
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        try:
+            coach = future.result()
+        except Exception as exc:
+            with self._lock:
+                self.failures += 1
+            sys.stderr.write(f"{self.backend.name} coach request failed; falling back to local coach. Error: {exc!r}\n")
+            return
+        if coach is not None:
+            self._remember(key, coach)
+
+    def submit(self, image_key, load_image, normalized, model=DEFAULT_MODEL):
+        """
+        Future resolving to the backend's coach dict (or None / an exception on failure).
+        The dict may be shared with the cache and other callers: treat it as read-only.
+        load_image() returns the PIL image and is only called on a cache miss.
+        """
+        if not self.backend.available():
+            return _done_future(None)
+        key = self.make_key(image_key, normalized, model)
+        coach = self._cached(key)
+        if coach is not None:
+            with self._lock:
+                self.hits += 1
+            return _done_future(coach)
+
+        loop = self._get_loop()
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future
+            self.misses += 1
+            future = asyncio.run_coroutine_threadsafe(self._generate(load_image, normalized, model), loop)
+            self._in_flight[key] = future
+        # Outside the lock: the callback runs inline if the call already finished.
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def coach(self, image_key, load_image, holds, model=DEFAULT_MODEL, timeout=None):
+        """
+        Coach for holds (HoldArrays or normalized dict) within the deadline,
+        falling back to build_local_coach on timeout, failure or no backend.
+        """
+        normalized = holds.to_normalized() if isinstance(holds, HoldArrays) else holds
+        future = self.submit(image_key, load_image, normalized, model or DEFAULT_MODEL)
+        try:
+            coach = future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            coach = None
+        except Exception:
+            coach = None
+        if coach is None:
+            return build_local_coach(holds)
+        return copy.deepcopy(coach)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "timeout_s": self.timeout,
+                "max_concurrency": self.max_concurrency,
+                "entries": len(self._entries),
+                "max_entries": self.cache_size,
+                "in_flight": len(self._in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+
+
+coach_service = CoachService()
+
+
+# =========================
+# SELF-TEST (offline, stub backend)
+# =========================
+def _sample_holds(offset=0):
+    holds = [{"id": i, "type": "Jug", "bbox": [100 + 40 * i + offset, 900 - 80 * i, 140 + 40 * i + offset, 940 - 80 * i]}
+             for i in range(10)]
+    return HoldArrays.from_hold_data({"holds": holds}, 1000, 1000).to_normalized()
+
+
+async def _selftest():
+    no_image = lambda: None  # noqa: E731 - the stub backend ignores the image
+
+    def is_stub(coach):
+        return coach["notes"].startswith("[stub coach")
+
+    # Concurrent identical requests share one backend call.
+    service = CoachService(StubBackend(delay_ms=200), timeout=5)
+    holds = _sample_holds()
+    results = await asyncio.gather(*(asyncio.wrap_future(service.submit("img", no_image, holds)) for _ in range(8)))
+    assert service.backend.calls == 1, service.stats()
+    assert service.deduplicated == 7 and service.misses == 1, service.stats()
+    assert all(is_stub(r) and r == results[0] for r in results)
+    print("✓ dedup: 8 concurrent requests, 1 backend call")
+
+    # A repeat is answered from the cache.
+    assert is_stub(await asyncio.to_thread(service.coach, "img", no_image, holds))
+    assert service.hits == 1 and service.backend.calls == 1, service.stats()
+    print("✓ cache: repeat request served without a backend call")
+
+    # Past the deadline the local coach answers; the late result still fills the cache.
+    service = CoachService(StubBackend(delay_ms=300), timeout=0.05)
+    coach = await asyncio.to_thread(service.coach, "img", no_image, holds)
+    assert not is_stub(coach) and service.timeouts == 1, service.stats()
+    await asyncio.sleep(0.5)
+    assert is_stub(await asyncio.to_thread(service.coach, "img", no_image, holds)), service.stats()
+    assert service.backend.calls == 1 and service.hits == 1, service.stats()
+    print("✓ deadline: local fallback after 50 ms, late answer cached")
+
+    # Entries expire after the TTL.
+    service = CoachService(StubBackend(delay_ms=0), timeout=5, ttl=0.1)
+    await asyncio.to_thread(service.coach, "img", no_image, holds)
+    await asyncio.sleep(0.2)
+    await asyncio.to_thread(service.coach, "img", no_image, holds)
+    assert service.backend.calls == 2 and service.hits == 0, service.stats()
+    print("✓ ttl: expired entry refetched")
+
+    # The least recently used entry is evicted beyond cache_size.
+    service = CoachService(StubBackend(delay_ms=0), timeout=5, cache_size=2)
+    for key in ("a", "b", "a", "c"):
+        await asyncio.to_thread(service.coach, key, no_image, holds)
+    assert service.stats()["entries"] == 2 and service.hits == 1, service.stats()
+    await asyncio.to_thread(service.coach, "a", no_image, holds)  # kept: used after "b"
+    await asyncio.to_thread(service.coach, "b", no_image, holds)  # evicted by "c"
+    assert service.hits == 2 and service.backend.calls == 4, service.stats()
+    print("✓ lru: least recently used entry evicted")
+
+    # Different holds or models are different keys.
+    assert CoachService.make_key("img", holds, DEFAULT_MODEL) != CoachService.make_key("img", _sample_holds(5), DEFAULT_MODEL)
+    assert CoachService.make_key("img", holds, DEFAULT_MODEL) != CoachService.make_key("img", holds, "other")
+
+
+def _selftest_serve():
+    """Drive `pathfinder.py --serve` (as the Node pool runs it) through the stub backend and the local coach."""
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", (1000, 1000)).save(buf, format="PNG")
+    image = base64.b64encode(buf.getvalue()).decode("ascii")
+    holds = [{"id": i, "type": "Jug", "bbox": [100 + 40 * i, 900 - 80 * i, 140 + 40 * i, 940 - 80 * i]}
+             for i in range(10)]
+    requests = [{"id": 1, "image_base64": image, "holds": holds},
+                {"id": 2, "image_base64": f"data:image/png;base64,{image}", "holds": holds, "local": True}]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pathfinder.py")
+    proc = subprocess.run(
+        [sys.executable, script, "--serve"], input="".join(json.dumps(r) + "\n" for r in requests),
+        capture_output=True, text=True, timeout=60,
+        env={**os.environ, "COACH_BACKEND": "stub", "COACH_STUB_DELAY_MS": "0"},
+    )
+    responses = {m["id"]: m for m in map(json.loads, proc.stdout.splitlines()) if m["id"] is not None}
+    assert proc.returncode == 0 and set(responses) == {1, 2}, proc.stdout + proc.stderr
+    assert all(m["ok"] for m in responses.values()), responses
+    assert responses[1]["coach"]["notes"].startswith("[stub coach"), responses[1]
+    assert not responses[2]["coach"]["notes"].startswith("[stub coach"), responses[2]
+    print("✓ serve: pathfinder.py --serve answers backend and local requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coach service utilities")
+    parser.add_argument("--selftest", action="store_true",
+                        help="Check dedup, deadline fallback, TTL/LRU caching and pathfinder.py --serve "
+                             "offline with the stub backend")
+    args = parser.parse_args()
+    if not args.selftest:
+        parser.print_help()
+        return
+    asyncio.run(_selftest())
+    _selftest_serve()
+    print("✓ Coach service self-test passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
+import argparse
+import hashlib
+import io
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PIL import Image
 
-SRC = Path(r"C:\Users\sunna\Code\uottahacks\indoor-climbing-gym-hold-classification-dataset\Final_Dataset")   #C:\Users\Admin\Desktop\climBright\cr_data\Final_Dataset       # has train/valid/test
 DST = Path("holds_cls")              # output classification dataset
 SPLIT_MAP = {"train": "train", "valid": "val", "test": "test"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+MANIFEST_NAME = "convert_manifest.json"  # per-image signature, hash and written crops (in DST)
+MANIFEST_SAVE_EVERY = 500                # images between manifest checkpoints
 
 # Safety: skip tiny boxes (often junk/noise)
 MIN_PIXELS = 24  # minimum width/height of crop in pixels
+JPEG_QUALITY = 95
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale (PIL draft mode) while every kept crop
+# still has at least this many pixels on its shorter side; training's
+# RandomResizedCrop(224, scale=(0.7, 1.0)) then never upsamples. 0 = full-size decode.
+DRAFT_MIN_SIDE = 320
 
 def yolo_to_xyxy(xc, yc, w, h, W, H):
     x1 = (xc - w / 2) * W
@@ -19,55 +31,179 @@ def yolo_to_xyxy(xc, yc, w, h, W, H):
 def clamp(v, lo, hi):
     return max(lo, min(hi, v))
 
-def process_split(split):
-    img_dir = SRC / split / "images"
-    lbl_dir = SRC / split / "labels"
-    out_split = SPLIT_MAP[split]
+def parse_labels(text):
+    """(line index, class, xc, yc, w, h) for every well-formed YOLO label line."""
+    boxes = []
+    for i, line in enumerate(text.strip().splitlines()):
+        parts = line.strip().split()
+        if len(parts) != 5:
+            continue
+        try:
+            cls = int(float(parts[0]))
+            xc, yc, w, h = map(float, parts[1:])
+        except ValueError:
+            continue
+        boxes.append((i, cls, xc, yc, w, h))
+    return boxes
+
+def pixel_boxes(boxes, W, H, min_pixels):
+    """Clamped pixel boxes of at least min_pixels per side, in full-image coordinates."""
+    kept = []
+    for i, cls, xc, yc, w, h in boxes:
+        x1, y1, x2, y2 = yolo_to_xyxy(xc, yc, w, h, W, H)
+        x1 = clamp(x1, 0, W - 1)
+        y1 = clamp(y1, 0, H - 1)
+        x2 = clamp(x2, 0, W - 1)
+        y2 = clamp(y2, 0, H - 1)
+
+        if x2 <= x1 or y2 <= y1:
+            continue
 
-    for img_path in img_dir.glob("*.*"):
-        if img_path.suffix.lower() not in [".jpg", ".jpeg", ".png", ".webp"]:
+        crop_w, crop_h = (x2 - x1), (y2 - y1)
+        if crop_w < min_pixels or crop_h < min_pixels:
+            continue
+        kept.append((i, cls, (x1, y1, x2, y2)))
+    return kept
+
+def draft_scale(kept, min_side):
+    """Largest JPEG draft reduction (1, 2, 4 or 8) keeping every crop's shorter side >= min_side."""
+    if min_side <= 0:
+        return 1
+    shortest = min(min(x2 - x1, y2 - y1) for _, _, (x1, y1, x2, y2) in kept)
+    scale = 1
+    while scale < 8 and shortest / (scale * 2) >= min_side:
+        scale *= 2
+    return scale
+
+def convert_image(task):
+    """
+    Worker: write the crops of one image. Labels are parsed before the image is
+    decoded, so images without usable boxes are never decoded. Returns None when
+    the content hash equals known_hash, else {"hash", "outputs"} (paths relative to dst).
+    """
+    img_path, label_path, dst, out_split, known_hash, settings = task
+    data = Path(img_path).read_bytes()
+    label_text = Path(label_path).read_bytes()
+    digest = hashlib.sha256(data + b"\0" + label_text).hexdigest()
+    if digest == known_hash:
+        return None
+
+    outputs = []
+    boxes = parse_labels(label_text.decode("utf-8", errors="replace"))
+    if boxes:
+        img = Image.open(io.BytesIO(data))
+        W, H = img.size
+        kept = pixel_boxes(boxes, W, H, settings["min_pixels"])
+        if kept:
+            scale = draft_scale(kept, settings["draft_min_side"])
+            if scale > 1 and img.format == "JPEG":
+                img.draft("RGB", (W // scale, H // scale))
+            img = img.convert("RGB")
+            sx, sy = img.size[0] / W, img.size[1] / H
+
+            stem = Path(img_path).stem
+            for i, cls, (x1, y1, x2, y2) in kept:
+                crop = img.crop((round(x1 * sx), round(y1 * sy), round(x2 * sx), round(y2 * sy)))
+
+                out_name = f"{out_split}/{cls}/{stem}_box{i}.jpg"
+                out_path = Path(dst) / out_name
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+                crop.save(out_path, quality=settings["quality"])
+                outputs.append(out_name)
+    return {"hash": digest, "outputs": outputs}
+
+def file_signature(img_path, label_path):
+    img_stat, label_stat = img_path.stat(), label_path.stat()
+    return [img_stat.st_mtime_ns, img_stat.st_size, label_stat.st_mtime_ns, label_stat.st_size]
+
+def load_manifest(dst, settings):
+    try:
+        data = json.loads((dst / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if data.get("settings") != settings:
+        print("Conversion settings changed since the last run; converting every image.")
+        return {}
+    return data.get("images", {})
+
+def save_manifest(dst, settings, images):
+    dst.mkdir(parents=True, exist_ok=True)
+    tmp = dst / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps({"settings": settings, "images": images}))
+    os.replace(tmp, dst / MANIFEST_NAME)
+
+def process_split(src, dst, split, pool, manifest, settings, incremental=True):
+    img_dir = src / split / "images"
+    lbl_dir = src / split / "labels"
+    out_split = SPLIT_MAP[split]
+    if not img_dir.exists():
+        print(f"{split}: {img_dir} not found, skipping")
+        return 0
+
+    jobs = []
+    unchanged = 0
+    for img_path in sorted(img_dir.glob("*.*")):
+        if img_path.suffix.lower() not in IMAGE_EXTENSIONS:
             continue
 
         label_path = lbl_dir / (img_path.stem + ".txt")
         if not label_path.exists():
             continue
 
-        img = Image.open(img_path).convert("RGB")
-        W, H = img.size
-
-        lines = label_path.read_text().strip().splitlines()
-        for i, line in enumerate(lines):
-            parts = line.strip().split()
-            if len(parts) != 5:
-                continue
-
-            cls = int(float(parts[0]))
-            xc, yc, w, h = map(float, parts[1:])
-
-            x1, y1, x2, y2 = yolo_to_xyxy(xc, yc, w, h, W, H)
-            x1 = clamp(x1, 0, W - 1)
-            y1 = clamp(y1, 0, H - 1)
-            x2 = clamp(x2, 0, W - 1)
-            y2 = clamp(y2, 0, H - 1)
-
-            if x2 <= x1 or y2 <= y1:
-                continue
-
-            crop_w, crop_h = (x2 - x1), (y2 - y1)
-            if crop_w < MIN_PIXELS or crop_h < MIN_PIXELS:
-                continue
-
-            crop = img.crop((x1, y1, x2, y2))
-
-            out_dir = DST / out_split / str(cls)
-            out_dir.mkdir(parents=True, exist_ok=True)
-            out_name = f"{img_path.stem}_box{i}.jpg"
-            crop.save(out_dir / out_name, quality=95)
+        key = f"{split}/{img_path.name}"
+        signature = file_signature(img_path, label_path)
+        entry = manifest.get(key) if incremental else None
+        if entry and entry["signature"] == signature:
+            unchanged += 1
+            continue
+        # mtime/size changed: the worker compares content hashes before decoding anything.
+        known_hash = entry["hash"] if entry else None
+        jobs.append((key, signature, (str(img_path), str(label_path), str(dst), out_split, known_hash, settings)))
+
+    converted = crops = 0
+    results = pool.map(convert_image, [task for _, _, task in jobs], chunksize=8)
+    for n, ((key, signature, _), result) in enumerate(zip(jobs, results), 1):
+        entry = manifest.get(key)
+        if result is None:
+            entry["signature"] = signature
+            unchanged += 1
+        else:
+            if entry:
+                # Boxes that were dropped or changed class leave stale crops behind.
+                for stale in set(entry["outputs"]) - set(result["outputs"]):
+                    (dst / stale).unlink(missing_ok=True)
+            manifest[key] = {"signature": signature, **result}
+            converted += 1
+            crops += len(result["outputs"])
+        if n % MANIFEST_SAVE_EVERY == 0:
+            save_manifest(dst, settings, manifest)
+    save_manifest(dst, settings, manifest)
+
+    print(f"{split}: {converted} images converted ({crops} crops), {unchanged} unchanged")
+    return crops
 
 def main():
-    for split in ["train", "valid", "test"]:
-        process_split(split)
-    print("Done. Classification crops saved to:", DST)
+    parser = argparse.ArgumentParser(description="Crop YOLO-labeled holds into a class-per-folder dataset")
+    parser.add_argument("--src", type=Path, required=True,
+                        help="YOLO dataset root with train/valid/test, each holding images/ and labels/")
+    parser.add_argument("--dst", type=Path, default=DST, help="Output classification dataset")
+    parser.add_argument("--splits", nargs="+", choices=list(SPLIT_MAP), default=list(SPLIT_MAP),
+                        help="Splits to convert")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--min-pixels", type=int, default=MIN_PIXELS, help="Minimum crop width/height")
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY, help="JPEG quality of saved crops")
+    parser.add_argument("--draft-min-side", type=int, default=DRAFT_MIN_SIDE,
+                        help="Shortest crop side to keep when decoding JPEGs at reduced size (0 = full size)")
+    parser.add_argument("--full", action="store_true",
+                        help=f"Convert every image, ignoring {MANIFEST_NAME}")
+    args = parser.parse_args()
+
+    settings = {"min_pixels": args.min_pixels, "quality": args.quality, "draft_min_side": args.draft_min_side}
+    manifest = load_manifest(args.dst, settings)
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for split in args.splits:
+            process_split(args.src, args.dst, split, pool, manifest, settings, incremental=not args.full)
+    print("Done. Classification crops saved to:", args.dst)
 
 if __name__ == "__main__":
     main()
@@ -7,8 +7,10 @@ import argparse
 import torch
 import cv2
 import numpy as np
-from torchvision import transforms
 from PIL import Image
+from torchvision import transforms
+from torchvision.transforms import functional as TF
+from torchvision.ops import nms
 import timm
 from ultralytics import YOLO
 
@@ -21,27 +23,102 @@ NUM_CLASSES = 6
 CLASS_NAMES = ["Jug", "Crimp", "Pinch", "Pocket", "Sloper", "Volume"]
 YOLO_CONF_THRESHOLD = 0.25  # Lower threshold since we're re-classifying
 BOX_PADDING = 0.15  # 15% padding around detected boxes
+CLASSIFY_BATCH_SIZE = int(os.environ.get("CLASSIFY_BATCH_SIZE", "32"))  # max crops per ConvNeXt forward pass
+# Tiled detection for large panoramas: images whose longer side exceeds TILE_SIZE are
+# split into overlapping TILE_SIZE windows that YOLO sees at full resolution (0 = off).
+TILE_SIZE = int(os.environ.get("DETECT_TILE_SIZE", "0"))
+TILE_OVERLAP = float(os.environ.get("DETECT_TILE_OVERLAP", "0.2"))  # fraction shared by neighbouring tiles
+MIN_TILE_SIZE = 320          # smaller tiles are raised to this (the tile count grows quadratically)
+MAX_TILE_OVERLAP = 0.5
+TILE_NMS_IOU = 0.5           # cross-tile NMS threshold
+TILE_CONTAINMENT = 0.7       # box cut by a tile edge is dropped if this much of it lies inside another box
+TILE_BATCH_SIZE = int(os.environ.get("DETECT_TILE_BATCH_SIZE", "8"))  # tiles per YOLO call
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Backend for both models: "torch" (eager checkpoints above), or "onnx" / "torchscript"
+# artifacts written by export_models.py into EXPORT_DIR (INT8 variants with INFERENCE_INT8=1).
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+INFERENCE_INT8 = os.environ.get("INFERENCE_INT8", "0").lower() not in ("0", "false", "no")
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exported")
+ORT_THREADS = int(os.environ.get("ORT_THREADS", "0"))  # onnxruntime intra-op threads per session, 0 = auto
+BACKENDS = ("torch", "onnx", "torchscript")
 
 # ConvNeXt preprocessing (matches training)
 NORM_MEAN = [0.485, 0.456, 0.406]
 NORM_STD = [0.229, 0.224, 0.225]
+RESIZE_SIZE = 256  # shorter side before the center crop
+CROP_SIZE = 224
+PREPROCESS_MAX_LEVELS = 1.0  # tensor vs PIL crops may differ by this many 0-255 levels (rounding)
+PREPROCESS_TOP1_MIN = 0.99   # fraction of crops whose predicted class must agree
 
 classify_transform = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
+    transforms.Resize(RESIZE_SIZE),
+    transforms.CenterCrop(CROP_SIZE),
     transforms.ToTensor(),
     transforms.Normalize(mean=NORM_MEAN, std=NORM_STD),
 ])
 
 
-def load_classifier(checkpoint_path, device):
-    """Load the ConvNeXt classifier."""
+def exported_model_paths(backend, int8=False, export_dir=EXPORT_DIR):
+    """(yolo, convnext) artifact paths written by export_models.py for a backend."""
+    suffix = ".int8" if int8 else ""
+    if backend == "onnx":
+        return (os.path.join(export_dir, f"yolo{suffix}.onnx"), os.path.join(export_dir, f"convnext{suffix}.onnx"))
+    if backend == "torchscript":
+        # ultralytics has no INT8 TorchScript export; only the classifier has a quantized variant.
+        return (os.path.join(export_dir, "yolo.torchscript"), os.path.join(export_dir, f"convnext{suffix}.ts"))
+    raise ValueError(f"Unknown export backend {backend!r}; choose from {BACKENDS[1:]}")
+
+
+def backend_model_paths(backend=INFERENCE_BACKEND, int8=INFERENCE_INT8):
+    """(yolo, convnext) paths to load for the selected inference backend."""
+    if backend == "torch":
+        return YOLO_MODEL, CONVNEXT_MODEL
+    return exported_model_paths(backend, int8)
+
+
+class OnnxClassifier:
+    """onnxruntime session with the eager model's call signature: image batch tensor in, logits tensor out."""
+
+    def __init__(self, path, threads=ORT_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def load_classifier(checkpoint_path, device, optimize=True):
+    """
+    Load the ConvNeXt classifier (eager checkpoint, or an exported .onnx / .ts artifact).
+    Eager models get the CLASSIFIER_* optimizations from classifier_optim unless optimize=False.
+    """
     if not os.path.exists(checkpoint_path):
         raise FileNotFoundError(
             f"ConvNeXt checkpoint not found: {checkpoint_path}. "
-            "Place best_convnext_two_phase.pt in the climBright folder or set CONVNEXT_MODEL_PATH."
+            "Place best_convnext_two_phase.pt in the climBright folder or set CONVNEXT_MODEL_PATH "
+            "(exported backends: run export_models.py)."
         )
+    if checkpoint_path.endswith(".onnx"):
+        print(f"Loading ONNX classifier from {checkpoint_path}...")
+        model = OnnxClassifier(checkpoint_path)
+        print("✓ Classifier loaded (onnxruntime)")
+        return model
+    if checkpoint_path.endswith(".ts"):
+        print(f"Loading TorchScript classifier from {checkpoint_path}...")
+        model = torch.jit.load(checkpoint_path, map_location=device)
+        model.eval()
+        print("✓ Classifier loaded (TorchScript)")
+        return model
     print(f"Loading classifier from {checkpoint_path}...")
     model = timm.create_model(
         "convnext_tiny.in12k_ft_in1k",
@@ -53,33 +130,39 @@ def load_classifier(checkpoint_path, device):
     model.to(device)
     model.eval()
     print("✓ Classifier loaded")
+    if optimize:
+        from classifier_optim import optimize_classifier
+
+        model = optimize_classifier(model, device)
     return model
 
 
 def load_detector(model_path):
-    """Load the YOLO detector."""
+    """Load the YOLO detector (best.pt, or an exported .onnx / .torchscript artifact)."""
     if not os.path.exists(model_path):
         raise FileNotFoundError(
             f"YOLO weights not found: {model_path}. "
             "Train/export weights or set YOLO_MODEL_PATH to a valid best.pt."
         )
     print(f"Loading YOLO detector from {model_path}...")
-    detector = YOLO(model_path)
+    # ultralytics picks the runtime from the file suffix.
+    detector = YOLO(model_path, task="detect")
     print("✓ Detector loaded")
     return detector
 
 
 def pad_box(x1, y1, x2, y2, img_w, img_h, padding=0.15):
-    """Add padding around a bounding box (percentage of box size)."""
+    """Add padding around a bounding box (percentage of box size); the result is at least 1 px inside the image."""
     box_w = x2 - x1
     box_h = y2 - y1
     pad_x = box_w * padding
     pad_y = box_h * padding
     
-    x1_new = max(0, int(x1 - pad_x))
-    y1_new = max(0, int(y1 - pad_y))
-    x2_new = min(img_w, int(x2 + pad_x))
-    y2_new = min(img_h, int(y2 + pad_y))
+    x1_new = min(max(0, int(x1 - pad_x)), img_w - 1)
+    y1_new = min(max(0, int(y1 - pad_y)), img_h - 1)
+    # A degenerate box or one on the image edge would otherwise give an empty crop.
+    x2_new = max(min(img_w, int(x2 + pad_x)), x1_new + 1)
+    y2_new = max(min(img_h, int(y2 + pad_y)), y1_new + 1)
     
     return x1_new, y1_new, x2_new, y2_new
 
@@ -95,77 +178,333 @@ def classify_crop(classifier, crop_pil, device):
     return class_id, confidence, probs
 
 
-def detect_and_classify(detector, classifier, image_path, device, save_output=True):
+def normalize_batch(batch):
+    """uint8 [N,3,H,W] → normalized float batch; the ToTensor + Normalize steps of classify_transform."""
+    mean = torch.tensor(NORM_MEAN, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(NORM_STD, device=batch.device).view(1, 3, 1, 1)
+    return batch.float().div_(255.0).sub_(mean).div_(std)
+
+
+def preprocess_crops(img, padded_boxes, bgr=False):
+    """
+    Resize(RESIZE_SIZE) + CenterCrop(CROP_SIZE) of every padded box of an HWC uint8
+    image, as one uint8 [N,3,CROP_SIZE,CROP_SIZE] batch. Boxes are views into a
+    single tensor sharing img's memory; only the antialiased resize allocates, and
+    with bgr=True just the cropped output is flipped to RGB. Same geometry and
+    bilinear antialiasing as classify_transform on a PIL crop (pixels agree to
+    within one intensity level of PIL's fixed-point rounding). Boxes differ in size,
+    so each gets its own resize; roi_align would not reproduce that antialiasing.
+    """
+    image = torch.from_numpy(np.ascontiguousarray(img)).permute(2, 0, 1)
+    batch = torch.empty((len(padded_boxes), 3, CROP_SIZE, CROP_SIZE), dtype=torch.uint8)
+    for k, (x1, y1, x2, y2) in enumerate(padded_boxes):
+        crop = TF.resize(image[:, y1:y2, x1:x2], RESIZE_SIZE, antialias=True)
+        crop = TF.center_crop(crop, CROP_SIZE)
+        batch[k] = crop.flip(0) if bgr else crop
+    return batch
+
+
+def classify_crops(classifier, crops, device, batch_size=CLASSIFY_BATCH_SIZE):
+    """
+    Run classifier on many cropped regions at once.
+    crops is either a uint8 batch from preprocess_crops / collect_crops (normalized
+    per chunk on the device) or a list of PIL crops (run through classify_transform).
+    Chunks of at most batch_size bound peak memory. Returns a list of
+    (class_id, confidence, probs) tuples in the same order as crops, matching classify_crop.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be >= 1, got {batch_size}")
+
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(crops), batch_size):
+            chunk = crops[start:start + batch_size]
+            if torch.is_tensor(chunk):
+                batch = normalize_batch(chunk.to(device))
+            else:
+                batch = torch.stack([classify_transform(crop) for crop in chunk]).to(device)
+            probs = torch.softmax(classifier(batch), dim=1).cpu()
+            class_ids = probs.argmax(dim=1)
+            for row, class_id in zip(probs, class_ids.tolist()):
+                outputs.append((class_id, row[class_id].item(), row))
+    return outputs
+
+
+def check_preprocess(classifier, img_bgr, padded_boxes, device, batch_size=CLASSIFY_BATCH_SIZE):
+    """
+    Compare preprocess_crops against classify_transform on PIL crops of the same boxes.
+    Returns (max |Δ| in 0-255 levels, top-1 agreement, max |Δp|); the BGR and RGB
+    tensor paths must agree exactly.
+    """
+    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    pil_crops = [Image.fromarray(img_rgb[y1:y2, x1:x2]) for x1, y1, x2, y2 in padded_boxes]
+    reference = torch.stack([classify_transform(crop) for crop in pil_crops])
+    crops = preprocess_crops(img_bgr, padded_boxes, bgr=True)
+    if not torch.equal(crops, preprocess_crops(img_rgb, padded_boxes)):
+        raise AssertionError("BGR and RGB crop paths disagree")
+
+    std = torch.tensor(NORM_STD).view(1, 3, 1, 1)
+    max_levels = float(((normalize_batch(crops) - reference).abs() * std * 255).max())
+    with torch.no_grad():
+        ref_probs = torch.cat([
+            torch.softmax(classifier(reference[i:i + batch_size].to(device)), dim=1).cpu()
+            for i in range(0, len(reference), batch_size)
+        ])
+    probs = torch.stack([row for _, _, row in classify_crops(classifier, crops, device, batch_size)])
+    top1 = float((probs.argmax(1) == ref_probs.argmax(1)).float().mean())
+    return max_levels, top1, float((probs - ref_probs).abs().max())
+
+
+def decode_image(source):
+    """
+    Decode an image into a BGR ndarray.
+    Accepts a file path, an already-decoded BGR ndarray, or an encoded buffer
+    (bytes/bytearray/memoryview), which is decoded in memory via cv2.imdecode.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(memoryview(source), dtype=np.uint8)
+        img_bgr = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        if img_bgr is None:
+            raise ValueError("Cannot decode image buffer")
+        return img_bgr
+    img_bgr = cv2.imread(str(source))
+    if img_bgr is None:
+        raise ValueError(f"Cannot read image: {source}")
+    return img_bgr
+
+
+def detection_arrays(boxes):
+    """(xyxy [N,4], conf [N], cls [N]) NumPy arrays from an ultralytics Boxes object."""
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()
+
+
+def collect_crops(img, xyxy, confs, classes, bgr=False):
+    """
+    Pad each detected box and crop it from img. Returns (box metadata, uint8 crop
+    batch from preprocess_crops). With bgr=True img is the decoded BGR original and
+    only the resized crops are converted, so a large panorama is never copied as a whole.
+    """
+    img_h, img_w = img.shape[:2]
+    boxes = []
+    for (x1, y1, x2, y2), yolo_conf, yolo_class in zip(np.asarray(xyxy).astype(int).tolist(), confs, classes):
+        # Pad box
+        x1_pad, y1_pad, x2_pad, y2_pad = pad_box(x1, y1, x2, y2, img_w, img_h, BOX_PADDING)
+        boxes.append(((x1, y1, x2, y2), (x1_pad, y1_pad, x2_pad, y2_pad), float(yolo_conf), int(yolo_class)))
+    return boxes, preprocess_crops(img, [padded for _, padded, _, _ in boxes], bgr=bgr)
+
+
+def use_tiling(img_w, img_h, tile_size):
+    return bool(tile_size) and tile_size > 0 and max(img_w, img_h) > tile_size
+
+
+def tile_starts(length, tile_size, overlap):
+    """Start offsets of windows covering [0, length) that share at least `overlap` of a tile."""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_windows(img_w, img_h, tile_size, overlap=TILE_OVERLAP):
+    """(x0, y0, x1, y1) windows tiling the image."""
+    return [
+        (x0, y0, min(x0 + tile_size, img_w), min(y0 + tile_size, img_h))
+        for y0 in tile_starts(img_h, tile_size, overlap)
+        for x0 in tile_starts(img_w, tile_size, overlap)
+    ]
+
+
+def _drop_cut_boxes(xyxy, cut):
+    """Drop boxes cut by a tile edge that mostly lie inside another, at least as large, kept box."""
+    areas = np.prod(np.maximum(0.0, xyxy[:, 2:] - xyxy[:, :2]), axis=1)
+    keep = np.ones(len(xyxy), dtype=bool)
+    for i in np.flatnonzero(cut):
+        wh = np.maximum(0.0, np.minimum(xyxy[i, 2:], xyxy[:, 2:]) - np.maximum(xyxy[i, :2], xyxy[:, :2]))
+        inside = wh.prod(axis=1) / max(areas[i], 1e-6)
+        inside[i] = 0.0
+        if np.any(keep & (inside >= TILE_CONTAINMENT) & (areas >= areas[i])):
+            keep[i] = False
+    return keep
+
+
+def detect_tiled(detector, img_bgr, tile_size, overlap=TILE_OVERLAP, tile_batch=TILE_BATCH_SIZE):
+    """
+    Sliding-window YOLO over a large BGR image. Tiles are views into the original,
+    converted to RGB one batch at a time; boxes are shifted to full-image coordinates
+    and merged with cross-tile NMS. Returns (xyxy, conf, cls) arrays.
+    """
+    img_h, img_w = img_bgr.shape[:2]
+    tile_size = max(int(tile_size), MIN_TILE_SIZE)
+    overlap = min(max(float(overlap), 0.0), MAX_TILE_OVERLAP)
+    windows = tile_windows(img_w, img_h, tile_size, overlap)
+    xyxy_parts, conf_parts, cls_parts, cut_parts = [], [], [], []
+    for start in range(0, len(windows), tile_batch):
+        chunk = windows[start:start + tile_batch]
+        tiles = [np.ascontiguousarray(img_bgr[y0:y1, x0:x1, ::-1]) for x0, y0, x1, y1 in chunk]
+        results = detector.predict(
+            source=tiles,
+            conf=YOLO_CONF_THRESHOLD,
+            imgsz=-(-tile_size // 32) * 32,  # no downscaling inside a tile
+            verbose=False,
+            device=DEVICE
+        )
+        for (x0, y0, x1, y1), result in zip(chunk, results):
+            xyxy, conf, cls = detection_arrays(result.boxes)
+            # Touching an inner tile edge means the hold may continue in the next tile.
+            cut = (
+                ((xyxy[:, 0] <= 1) & (x0 > 0)) | ((xyxy[:, 1] <= 1) & (y0 > 0))
+                | ((xyxy[:, 2] >= x1 - x0 - 1) & (x1 < img_w)) | ((xyxy[:, 3] >= y1 - y0 - 1) & (y1 < img_h))
+            )
+            xyxy_parts.append(xyxy + np.array([x0, y0, x0, y0], dtype=xyxy.dtype))
+            conf_parts.append(conf)
+            cls_parts.append(cls)
+            cut_parts.append(cut)
+
+    xyxy = np.concatenate(xyxy_parts).reshape(-1, 4)
+    conf, cls, cut = np.concatenate(conf_parts), np.concatenate(cls_parts), np.concatenate(cut_parts)
+    if not len(xyxy):
+        return xyxy, conf, cls
+
+    keep = nms(torch.from_numpy(xyxy).float(), torch.from_numpy(conf).float(), TILE_NMS_IOU).numpy()
+    xyxy, conf, cls, cut = xyxy[keep], conf[keep], cls[keep], cut[keep]
+    keep = _drop_cut_boxes(xyxy, cut)
+    return xyxy[keep], conf[keep], cls[keep]
+
+
+def build_results(boxes, predictions):
+    """Zip box metadata with classifier outputs into the per-detection result dicts."""
+    classified_results = []
+    for (box, padded_box, yolo_conf, yolo_class), (class_id, confidence, probs) in zip(boxes, predictions):
+        classified_results.append({
+            'box': box,
+            'padded_box': padded_box,
+            'yolo_conf': yolo_conf,
+            'yolo_class': yolo_class,
+            'class_id': class_id,
+            'class_name': CLASS_NAMES[class_id],
+            'confidence': confidence,
+            'probs': probs.numpy(),
+        })
+    return classified_results
+
+
+def detect_and_classify_many(detector, classifier, images, device, batch_size=CLASSIFY_BATCH_SIZE,
+                             tile_size=None):
+    """
+    Batched variant of detect_and_classify for several images at once (no
+    printing, no visualization). YOLO runs once over all images below the
+    tiling size (large ones are tiled), then the crops of every image go
+    through ConvNeXt together. Returns one result list per input image, in order.
+    """
+    tile_size = TILE_SIZE if tile_size is None else tile_size
+    imgs_bgr = [decode_image(image) for image in images]
+    if not imgs_bgr:
+        return []
+
+    detections = [None] * len(imgs_bgr)
+    crop_sources = [None] * len(imgs_bgr)
+    whole = []
+    for i, img_bgr in enumerate(imgs_bgr):
+        img_h, img_w = img_bgr.shape[:2]
+        if use_tiling(img_w, img_h, tile_size):
+            detections[i] = detect_tiled(detector, img_bgr, tile_size, TILE_OVERLAP)
+            crop_sources[i] = (img_bgr, True)
+        else:
+            crop_sources[i] = (cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB), False)
+            whole.append(i)
+
+    if whole:
+        results = detector.predict(
+            source=[crop_sources[i][0] for i in whole],
+            conf=YOLO_CONF_THRESHOLD,
+            verbose=False,
+            device=DEVICE
+        )
+        for i, result in zip(whole, results):
+            detections[i] = detection_arrays(result.boxes)
+
+    per_image_boxes = []
+    all_crops = []
+    for (img, bgr), arrays in zip(crop_sources, detections):
+        boxes, crops = collect_crops(img, *arrays, bgr=bgr)
+        per_image_boxes.append(boxes)
+        all_crops.append(crops)
+
+    all_crops = torch.cat(all_crops)
+    predictions = classify_crops(classifier, all_crops, device, batch_size) if len(all_crops) else []
+
+    outputs = []
+    offset = 0
+    for boxes in per_image_boxes:
+        outputs.append(build_results(boxes, predictions[offset:offset + len(boxes)]))
+        offset += len(boxes)
+    return outputs
+
+
+def detect_and_classify(detector, classifier, image, device, save_output=True,
+                        batch_size=CLASSIFY_BATCH_SIZE, tile_size=None, tile_overlap=None):
     """
     Run YOLO detection, then classify each detected box with ConvNeXt.
+    image may be a file path, a BGR ndarray, or encoded image bytes; the
+    visualization is only saved when a path is given. Images larger than
+    tile_size (default TILE_SIZE, 0 = never) are detected tile by tile.
     """
+    tile_size = TILE_SIZE if tile_size is None else tile_size
+    tile_overlap = TILE_OVERLAP if tile_overlap is None else tile_overlap
+    is_path = isinstance(image, (str, os.PathLike))
     print(f"\n{'='*60}")
-    print(f"Processing: {image_path}")
+    print(f"Processing: {image if is_path else 'in-memory image'}")
     print(f"{'='*60}")
     
     # Read image
-    img_bgr = cv2.imread(image_path)
-    if img_bgr is None:
-        raise ValueError(f"Cannot read image: {image_path}")
+    img_bgr = decode_image(image)
     
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
     img_h, img_w = img_bgr.shape[:2]
     print(f"Image size: {img_w}x{img_h}")
     
     # Run YOLO detection
-    print("\n[1] Running YOLO detection...")
-    results = detector.predict(
-        source=img_rgb,
-        conf=YOLO_CONF_THRESHOLD,
-        verbose=False,
-        device=DEVICE
-    )
+    if use_tiling(img_w, img_h, tile_size):
+        print(f"\n[1] Running tiled YOLO detection ({tile_size}px tiles, {tile_overlap:.0%} overlap)...")
+        # Tiles and crops are taken from the BGR original: no full-size RGB copy.
+        xyxy, confs, classes = detect_tiled(detector, img_bgr, tile_size, tile_overlap)
+        crop_source, bgr = img_bgr, True
+    else:
+        print("\n[1] Running YOLO detection...")
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        results = detector.predict(
+            source=img_rgb,
+            conf=YOLO_CONF_THRESHOLD,
+            verbose=False,
+            device=DEVICE
+        )
+        xyxy, confs, classes = detection_arrays(results[0].boxes)
+        crop_source, bgr = img_rgb, False
     
-    detections = results[0].boxes
-    num_detections = len(detections)
+    num_detections = len(xyxy)
     print(f"✓ Found {num_detections} detections")
     
     if num_detections == 0:
         print("⚠ No holds detected!")
         return []
     
-    # Classify each detection
+    # Collect padded crops for every detection
     print(f"\n[2] Classifying {num_detections} detected boxes with ConvNeXt...")
-    classified_results = []
-    
-    for i, box in enumerate(detections):
-        # Get box coordinates
-        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-        yolo_conf = box.conf[0].item()
-        yolo_class = int(box.cls[0].item()) if hasattr(box, 'cls') else None
-        
-        # Pad box
-        x1_pad, y1_pad, x2_pad, y2_pad = pad_box(x1, y1, x2, y2, img_w, img_h, BOX_PADDING)
-        
-        # Crop and classify
-        crop_bgr = img_bgr[y1_pad:y2_pad, x1_pad:x2_pad]
-        crop_rgb = cv2.cvtColor(crop_bgr, cv2.COLOR_BGR2RGB)
-        crop_pil = Image.fromarray(crop_rgb)
-        
-        class_id, confidence, probs = classify_crop(classifier, crop_pil, device)
-        class_name = CLASS_NAMES[class_id]
-        
-        classified_results.append({
-            'box': (x1, y1, x2, y2),
-            'padded_box': (x1_pad, y1_pad, x2_pad, y2_pad),
-            'yolo_conf': yolo_conf,
-            'yolo_class': yolo_class,
-            'class_id': class_id,
-            'class_name': class_name,
-            'confidence': confidence,
-            'probs': probs.cpu().numpy(),
-        })
-        
-        print(f"  Box {i+1}: {class_name} ({confidence:.2%}) | YOLO conf: {yolo_conf:.2%}")
+    boxes, crops = collect_crops(crop_source, xyxy, confs, classes, bgr=bgr)
+
+    # Classify all crops in batched forward passes
+    predictions = classify_crops(classifier, crops, device, batch_size)
+
+    classified_results = build_results(boxes, predictions)
+    for i, det in enumerate(classified_results):
+        print(f"  Box {i+1}: {det['class_name']} ({det['confidence']:.2%}) | YOLO conf: {det['yolo_conf']:.2%}")
     
     # Visualize results
-    if save_output:
-        output_path = image_path.rsplit('.', 1)[0] + '_classified.jpg'
+    if save_output and is_path:
+        output_path = str(image).rsplit('.', 1)[0] + '_classified.jpg'
         vis_img = img_bgr.copy()
         
         for i, det in enumerate(classified_results):
@@ -197,7 +536,7 @@ def detect_and_classify(detector, classifier, image_path, device, save_output=Tr
 
 
 def main():
-    global YOLO_CONF_THRESHOLD, BOX_PADDING
+    global YOLO_CONF_THRESHOLD, BOX_PADDING, TILE_SIZE, TILE_OVERLAP
     parser = argparse.ArgumentParser(
         description="Two-stage detection + classification for climbing holds"
     )
@@ -236,17 +575,58 @@ def main():
         default=BOX_PADDING,
         help='Box padding fraction (0.15 = 15%%)'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=CLASSIFY_BATCH_SIZE,
+        help='Max crops per ConvNeXt forward pass (lower to bound CPU memory)'
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=int,
+        default=TILE_SIZE,
+        help='Detect images larger than this in overlapping tiles of this size (0 = whole image)'
+    )
+    parser.add_argument(
+        '--tile-overlap',
+        type=float,
+        default=TILE_OVERLAP,
+        help='Fraction of a tile shared with its neighbour (0.2 = 20%%)'
+    )
+    parser.add_argument(
+        '--check-preprocess',
+        action='store_true',
+        help='Check the batched tensor crop path against the PIL classify_transform on this image and exit'
+    )
     
     args = parser.parse_args()
     
     # Update globals after parsing arguments
     YOLO_CONF_THRESHOLD = args.conf
     BOX_PADDING = args.padding
+    TILE_SIZE = args.tile_size
+    TILE_OVERLAP = args.tile_overlap
     
    
     # Load models
     detector = load_detector(args.yolo)
     classifier = load_classifier(args.classifier, DEVICE)
+
+    if args.check_preprocess:
+        img_bgr = decode_image(args.image)
+        img_h, img_w = img_bgr.shape[:2]
+        results = detector.predict(source=img_bgr[:, :, ::-1].copy(), conf=YOLO_CONF_THRESHOLD, verbose=False,
+                                   device=DEVICE)
+        boxes, _ = collect_crops(img_bgr, *detection_arrays(results[0].boxes), bgr=True)
+        # Whole image, an upsampled corner and a thin strip cover both resize directions.
+        padded = [padded for _, padded, _, _ in boxes] + [
+            (0, 0, img_w, img_h), (0, 0, min(img_w, 100), min(img_h, 60)), (0, 0, img_w, min(img_h, 40)),
+        ]
+        max_levels, top1, max_diff = check_preprocess(classifier, img_bgr, padded, DEVICE, args.batch_size)
+        ok = max_levels <= PREPROCESS_MAX_LEVELS and top1 >= PREPROCESS_TOP1_MIN
+        print(f"{len(padded)} crops: max |Δ| {max_levels:.2f} levels, top-1 agreement {top1:.1%}, "
+              f"max |Δp| {max_diff:.4f} {'✓' if ok else '✗'}")
+        raise SystemExit(0 if ok else 1)
     
     # Run inference
     results = detect_and_classify(
@@ -254,7 +634,8 @@ def main():
         classifier,
         args.image,
         DEVICE,
-        save_output=not args.no_save
+        save_output=not args.no_save,
+        batch_size=args.batch_size,
     )
     
     # Summary
@@ -0,0 +1,148 @@
+"""
+Pre-decoded evaluation sets for two_phase_train.
+The eval transform (Resize, CenterCrop, ToTensor, Normalize) is deterministic,
+so each val / real_val image goes through the resize and crop only once. The
+uint8 [N,3,H,W] result is stored in a .npy file named after a hash of the
+source files and the transform. Later epochs and runs only normalize batches,
+which gives bit-identical inputs. Caches up to EVAL_CACHE_RAM_MB are loaded
+into RAM, larger ones are memory-mapped, and sets above EVAL_CACHE_MAX_MB are
+not cached.
+"""
+import glob
+import hashlib
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+from pack_shards import INDEX_NAME, META_NAME, ShardDataset, image_dataset
+
+# =========================
+# CONFIGURATION
+# =========================
+EVAL_CACHE_RAM_MB = 2048   # load caches up to this size into RAM, memory-map larger ones
+EVAL_CACHE_MAX_MB = 8192   # do not cache sets whose pixels exceed this
+
+
+def split_normalize(eval_tf):
+    """(geometry transform, mean, std) of a Compose ending in ToTensor(), Normalize(mean, std)."""
+    steps = list(eval_tf.transforms)
+    if len(steps) < 2 or not isinstance(steps[-2], transforms.ToTensor) \
+            or not isinstance(steps[-1], transforms.Normalize):
+        raise ValueError("Only eval transforms ending in ToTensor() and Normalize() can be cached")
+    return transforms.Compose(steps[:-2]), steps[-1].mean, steps[-1].std
+
+
+def source_files(dataset):
+    """Files whose contents determine the dataset's images."""
+    if isinstance(dataset, ShardDataset):
+        shards = sorted(glob.glob(os.path.join(dataset.root, "shard-*.npy")))
+        return [os.path.join(dataset.root, META_NAME), os.path.join(dataset.root, INDEX_NAME)] + shards
+    return [path for path, _ in dataset.samples]
+
+
+def fingerprint(dataset, root, geometry):
+    """Hash of the source file contents, their labels and the resize/crop steps."""
+    digest = hashlib.sha256(repr(geometry).encode("utf-8"))
+    digest.update(repr(sorted(dataset.class_to_idx.items())).encode("utf-8"))
+    for path in source_files(dataset):
+        digest.update(os.path.relpath(path, root).encode("utf-8"))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def normalize(images, mean, std):
+    """uint8 [N,3,H,W] → what ToTensor() + Normalize() produce for the same pixels."""
+    x = images.float().div_(255)
+    return x.sub_(torch.tensor(mean).view(1, -1, 1, 1)).div_(torch.tensor(std).view(1, -1, 1, 1))
+
+
+class CachedEvalDataset:
+    """(normalized image, label) items over cached uint8 pixels."""
+
+    def __init__(self, images, labels, mean, std):
+        self.images = images
+        self.labels = labels
+        self.mean = mean
+        self.std = std
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        image = torch.from_numpy(np.array(self.images[i]))
+        return normalize(image[None], self.mean, self.std)[0], int(self.labels[i])
+
+
+class CachedEvalLoader:
+    """Re-iterable stand-in for an eval DataLoader: yields (x, y) batches by slicing the cache."""
+
+    def __init__(self, dataset: CachedEvalDataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return -(-len(self.dataset) // self.batch_size)
+
+    def __iter__(self):
+        ds = self.dataset
+        for start in range(0, len(ds), self.batch_size):
+            end = start + self.batch_size
+            x = torch.from_numpy(np.ascontiguousarray(ds.images[start:end]))
+            yield normalize(x, ds.mean, ds.std), torch.from_numpy(np.asarray(ds.labels[start:end]))
+
+
+def build_cache(dataset, images_path, labels_path, shape, batch_size, num_workers):
+    """Write the uint8 pixels of dataset (transform ends in PILToTensor) to images_path."""
+    tmp_path = images_path[:-len(".npy")] + ".tmp.npy"
+    images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=shape)
+    labels = np.empty(shape[0], dtype=np.int64)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    i = 0
+    for x, y in loader:
+        images[i:i + len(y)] = x.numpy()
+        labels[i:i + len(y)] = y.numpy()
+        i += len(y)
+    images.flush()
+    del images
+    np.save(labels_path, labels)
+    # The images file appears last and marks the cache as complete.
+    os.replace(tmp_path, images_path)
+
+
+def cached_eval_loader(root, eval_tf, batch_size, cache_dir, ram_mb=EVAL_CACHE_RAM_MB, max_mb=EVAL_CACHE_MAX_MB,
+                       num_workers=0):
+    """
+    CachedEvalLoader for the split at root (ImageFolder or packed), building the
+    cache on first use; None if the set is larger than max_mb.
+    """
+    geometry, mean, std = split_normalize(eval_tf)
+    source = image_dataset(root, transform=transforms.Compose([geometry, transforms.PILToTensor()]))
+    if not len(source):
+        return None
+    shape = (len(source),) + tuple(source[0][0].shape)
+    size_mb = np.prod(shape) / (1024 * 1024)
+    if size_mb > max_mb:
+        print(f"⚠ {root}: eval cache would take {size_mb:.0f} MB (> {max_mb} MB); evaluating from files")
+        return None
+
+    name = os.path.basename(os.path.normpath(root))
+    key = fingerprint(source, root, geometry)
+    images_path = os.path.join(cache_dir, f"{name}-{key}.npy")
+    labels_path = os.path.join(cache_dir, f"{name}-{key}.labels.npy")
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}-*.npy")):
+        if not os.path.basename(stale).startswith(f"{name}-{key}."):
+            os.remove(stale)
+
+    if not os.path.exists(images_path):
+        print(f"Caching {len(source)} {name} images ({size_mb:.0f} MB) in {images_path}...")
+        build_cache(source, images_path, labels_path, shape, batch_size, num_workers)
+    images = np.load(images_path, mmap_mode=None if size_mb <= ram_mb else "r")
+    labels = np.load(labels_path)
+    print(f"✓ {name}: {len(labels)} cached eval images ({'RAM' if size_mb <= ram_mb else 'memory-mapped'})")
+    return CachedEvalLoader(CachedEvalDataset(images, labels, mean, std), batch_size)
@@ -0,0 +1,227 @@
+"""
+Export the ConvNeXt classifier and YOLO detector for CPU inference.
+Writes ONNX or TorchScript artifacts (optionally dynamic-quantized INT8)
+into EXPORT_DIR, where detect_and_classify picks them up with
+INFERENCE_BACKEND=onnx|torchscript (and INFERENCE_INT8=1).
+
+Examples:
+    python export_models.py --format onnx --int8
+    python export_models.py --format torchscript
+    python export_models.py --check --format onnx --int8 --images test_data_sd
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import torch
+
+from detect_and_classify import (
+    BACKENDS,
+    CONVNEXT_MODEL,
+    DEVICE,
+    EXPORT_DIR,
+    YOLO_CONF_THRESHOLD,
+    YOLO_MODEL,
+    classify_crops,
+    collect_crops,
+    decode_image,
+    detect_and_classify,
+    detection_arrays,
+    exported_model_paths,
+    load_classifier,
+    load_detector,
+)
+
+# =========================
+# CONFIGURATION
+# =========================
+CLASSIFIER_INPUT = (1, 3, 224, 224)
+YOLO_IMGSZ = 640
+ONNX_OPSET = 17
+PARITY_TOP1_MIN = 0.95     # fraction of crops whose predicted class must agree
+PARITY_BOX_MATCH_MIN = 0.9  # fraction of eager boxes that must have an IoU >= 0.5 partner
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# =========================
+# EXPORT
+# =========================
+def export_classifier(checkpoint_path, fmt, out_dir, int8=False):
+    """Export ConvNeXt to ONNX (dynamic batch) or frozen TorchScript; returns the written paths."""
+    model = load_classifier(checkpoint_path, "cpu", optimize=False)
+    dummy = torch.randn(*CLASSIFIER_INPUT)
+    written = []
+
+    if fmt == "onnx":
+        fp32_path = exported_model_paths("onnx", False, out_dir)[1]
+        torch.onnx.export(
+            model,
+            dummy,
+            fp32_path,
+            input_names=["images"],
+            output_names=["logits"],
+            dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+        written.append(fp32_path)
+        if int8:
+            written.append(quantize_onnx(fp32_path, exported_model_paths("onnx", True, out_dir)[1]))
+        return written
+
+    variants = [(False, model)]
+    if int8:
+        # Dynamic INT8 covers the Linear layers, i.e. the pointwise MLPs that dominate ConvNeXt.
+        variants.append((True, torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)))
+    for quantized, variant in variants:
+        path = exported_model_paths("torchscript", quantized, out_dir)[1]
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(variant, dummy).eval())
+            if not quantized:
+                # Conv/BN folding and MKLDNN layout passes; they do not apply to quantized ops.
+                traced = torch.jit.optimize_for_inference(traced)
+        torch.jit.save(traced, path)
+        written.append(path)
+    return written
+
+
+def export_detector(weights_path, fmt, out_dir, int8=False, imgsz=YOLO_IMGSZ):
+    """Export YOLO with ultralytics and move the artifact into out_dir; returns the written paths."""
+    detector = load_detector(weights_path)
+    if fmt == "onnx":
+        # Dynamic input size so tiled detection can run tiles at their own resolution.
+        exported = detector.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True, opset=ONNX_OPSET)
+    else:
+        exported = detector.export(format="torchscript", imgsz=imgsz, optimize=True)
+
+    target = exported_model_paths(fmt, False, out_dir)[0]
+    shutil.move(str(exported), target)
+    written = [target]
+    if int8:
+        if fmt == "onnx":
+            written.append(quantize_onnx(target, exported_model_paths("onnx", True, out_dir)[0]))
+        else:
+            print("⚠ ultralytics has no INT8 TorchScript export; the detector stays fp32")
+    return written
+
+
+def quantize_onnx(fp32_path, int8_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+# =========================
+# PARITY CHECK
+# =========================
+def box_iou(a, b):
+    """IoU matrix between [N,4] and [M,4] xyxy boxes."""
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)))
+    wh = np.clip(np.minimum(a[:, None, 2:], b[None, :, 2:]) - np.maximum(a[:, None, :2], b[None, :, :2]), 0, None)
+    inter = wh.prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def check_parity(backend, int8, image_dir, yolo_path, convnext_path, export_dir):
+    """
+    Compare exported models against the eager ones on every image in image_dir.
+    Classifiers see the same crops (from the eager detector) so their outputs are
+    comparable one to one. Returns True when all images meet the PARITY_* thresholds.
+    """
+    images = sorted(p for p in glob.glob(os.path.join(image_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not images:
+        print(f"✗ No images found in {image_dir}")
+        return False
+
+    exported_yolo, exported_convnext = exported_model_paths(backend, int8, export_dir)
+    eager_detector, eager_classifier = load_detector(yolo_path), load_classifier(convnext_path, DEVICE, optimize=False)
+    detector, classifier = load_detector(exported_yolo), load_classifier(exported_convnext, DEVICE)
+
+    # One warm-up pass each so timings compare steady-state latency.
+    for d, c in ((eager_detector, eager_classifier), (detector, classifier)):
+        detect_and_classify(d, c, np.zeros((YOLO_IMGSZ, YOLO_IMGSZ, 3), dtype=np.uint8), DEVICE, save_output=False)
+
+    print(f"\n{'image':<36} {'boxes':>11} {'box match':>10} {'top-1':>7} {'max |Δp|':>9} {'eager':>8} {'export':>8}")
+    print("-" * 95)
+    ok = True
+    for path in images:
+        img_rgb = decode_image(path)[:, :, ::-1].copy()
+
+        eager_res, eager_det_s = timed(
+            eager_detector.predict, source=img_rgb, conf=YOLO_CONF_THRESHOLD, verbose=False, device=DEVICE
+        )
+        export_res, export_det_s = timed(
+            detector.predict, source=img_rgb, conf=YOLO_CONF_THRESHOLD, verbose=False, device=DEVICE
+        )
+        eager_xyxy, eager_conf, eager_cls = detection_arrays(eager_res[0].boxes)
+        export_xyxy = detection_arrays(export_res[0].boxes)[0]
+        iou = box_iou(eager_xyxy, export_xyxy)
+        box_match = float((iou.max(axis=1) >= 0.5).mean()) if iou.size else float(len(eager_xyxy) == len(export_xyxy))
+
+        _, crops = collect_crops(img_rgb, eager_xyxy, eager_conf, eager_cls)
+        if len(crops):
+            eager_pred, eager_cls_s = timed(classify_crops, eager_classifier, crops, DEVICE)
+            export_pred, export_cls_s = timed(classify_crops, classifier, crops, DEVICE)
+            top1 = float(np.mean([a[0] == b[0] for a, b in zip(eager_pred, export_pred)]))
+            max_diff = max(float((a[2] - b[2]).abs().max()) for a, b in zip(eager_pred, export_pred))
+        else:
+            eager_cls_s = export_cls_s = 0.0
+            top1, max_diff = 1.0, 0.0
+
+        passed = box_match >= PARITY_BOX_MATCH_MIN and top1 >= PARITY_TOP1_MIN
+        ok = ok and passed
+        print(
+            f"{os.path.basename(path)[:36]:<36} {len(eager_xyxy):>5}/{len(export_xyxy):<5} {box_match:>10.1%} "
+            f"{top1:>7.1%} {max_diff:>9.4f} {(eager_det_s + eager_cls_s) * 1000:>6.0f}ms "
+            f"{(export_det_s + export_cls_s) * 1000:>6.0f}ms {'✓' if passed else '✗'}"
+        )
+    print(f"\n{'✓ Parity OK' if ok else '✗ Parity check failed'} ({backend}{' int8' if int8 else ''})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export detector/classifier for CPU inference backends")
+    parser.add_argument('--format', choices=BACKENDS[1:], default="onnx", help='Export format')
+    parser.add_argument('--int8', action='store_true', help='Also write dynamic-quantized INT8 artifacts')
+    parser.add_argument('-y', '--yolo', default=YOLO_MODEL, help='Path to YOLO best.pt')
+    parser.add_argument('-c', '--classifier', default=CONVNEXT_MODEL, help='Path to ConvNeXt checkpoint')
+    parser.add_argument('-o', '--out-dir', default=EXPORT_DIR, help='Output directory (EXPORT_DIR)')
+    parser.add_argument('--imgsz', type=int, default=YOLO_IMGSZ, help='YOLO export input size')
+    parser.add_argument('--skip-yolo', action='store_true', help='Only export the classifier')
+    parser.add_argument('--skip-classifier', action='store_true', help='Only export the detector')
+    parser.add_argument('--check', action='store_true', help='Compare existing exports against the eager models')
+    parser.add_argument('--images', default="test_data_sd", help='Image folder for --check')
+    args = parser.parse_args()
+
+    if args.check:
+        ok = check_parity(args.format, args.int8, args.images, args.yolo, args.classifier, args.out_dir)
+        sys.exit(0 if ok else 1)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    written = []
+    if not args.skip_classifier:
+        written += export_classifier(args.classifier, args.format, args.out_dir, args.int8)
+    if not args.skip_yolo:
+        written += export_detector(args.yolo, args.format, args.out_dir, args.int8, args.imgsz)
+
+    for path in written:
+        print(f"✓ {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    print(f"\nUse with: INFERENCE_BACKEND={args.format}{' INFERENCE_INT8=1' if args.int8 else ''} "
+          f"EXPORT_DIR={args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
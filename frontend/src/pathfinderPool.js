@@ -0,0 +1,169 @@
+const fs = require("fs");
+const path = require("path");
+const readline = require("readline");
+const { spawn } = require("child_process");
+
+// Long-lived `pathfinder.py --serve` workers speaking JSON lines over stdin/stdout.
+// Interpreter start-up and imports are paid once per worker instead of once per request.
+const rootDir = path.resolve(__dirname, "..", ".."); // -> climBright
+const POOL_SIZE = Math.max(1, Number(process.env.PATHFINDER_POOL_SIZE || 2));
+const WORKER_THREADS = Math.max(1, Number(process.env.PATHFINDER_WORKER_THREADS || 2));
+const REQUEST_TIMEOUT_MS = Number(process.env.PATHFINDER_TIMEOUT_MS || 120000);
+
+function resolvePythonBin() {
+  const venvPyUnix = path.join(rootDir, "env", "bin", "python");
+  const venvPyWin = path.join(rootDir, "env", "Scripts", "python.exe");
+  const venvPyWinShim = path.join(rootDir, "env", "Scripts", "python");
+  let pythonBin = process.env.PYTHON_BIN;
+
+  // Prefer the repo venv if present (it has Pillow/google-genai, etc.).
+  // This prevents default configs like PYTHON_BIN=python3 from breaking.
+  if (
+    (!pythonBin || pythonBin === "python3" || pythonBin === "python") &&
+    (fs.existsSync(venvPyUnix) || fs.existsSync(venvPyWin) || fs.existsSync(venvPyWinShim))
+  ) {
+    pythonBin = fs.existsSync(venvPyUnix)
+      ? venvPyUnix
+      : fs.existsSync(venvPyWin)
+        ? venvPyWin
+        : venvPyWinShim;
+  }
+
+  if (!pythonBin) {
+    pythonBin = process.platform === "win32" ? "python" : "python3";
+  }
+  return pythonBin;
+}
+
+class PathfinderError extends Error {
+  constructor(message, details) {
+    super(message);
+    this.details = details;
+  }
+}
+
+class PathfinderWorker {
+  constructor(pythonBin, onExit) {
+    this.pythonBin = pythonBin;
+    this.pending = new Map();
+    this.stderr = "";
+    this.alive = true;
+
+    this.child = spawn(
+      pythonBin,
+      [path.join(rootDir, "pathfinder.py"), "--serve", "--workers", String(WORKER_THREADS)],
+      { env: process.env, cwd: rootDir, stdio: ["pipe", "pipe", "pipe"] }
+    );
+
+    readline.createInterface({ input: this.child.stdout }).on("line", (line) => this.onLine(line));
+    this.child.stderr.on("data", (d) => {
+      // Keep only the tail for error reports.
+      this.stderr = (this.stderr + d.toString()).slice(-4000);
+    });
+    this.child.stdin.on("error", () => {
+      // Surfaces through the "exit"/"error" handlers below.
+    });
+
+    const fail = (message) => {
+      if (!this.alive) return;
+      this.alive = false;
+      for (const { reject, timer } of this.pending.values()) {
+        clearTimeout(timer);
+        reject(new PathfinderError(message, this.stderr));
+      }
+      this.pending.clear();
+      onExit(this);
+    };
+    this.child.on("error", (spawnErr) => {
+      fail(
+        spawnErr.code === "ENOENT"
+          ? `Unable to execute python interpreter "${pythonBin}". Install Python or set PYTHON_BIN to a valid executable.`
+          : `Failed to launch pathfinder: ${spawnErr.message}`
+      );
+    });
+    this.child.on("exit", (code) => fail(`pathfinder worker exited (${code})`));
+  }
+
+  get load() {
+    return this.pending.size;
+  }
+
+  onLine(line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch {
+      return; // not part of the protocol
+    }
+    const entry = this.pending.get(message.id);
+    if (!entry) return;
+    this.pending.delete(message.id);
+    clearTimeout(entry.timer);
+    if (message.ok) {
+      entry.resolve(message.coach);
+    } else {
+      entry.reject(new PathfinderError("pathfinder failed", message.error));
+    }
+  }
+
+  send(id, request) {
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new PathfinderError(`pathfinder timed out after ${REQUEST_TIMEOUT_MS} ms`));
+      }, REQUEST_TIMEOUT_MS);
+      this.pending.set(id, { resolve, reject, timer });
+      this.child.stdin.write(`${JSON.stringify({ id, ...request })}\n`);
+    });
+  }
+
+  stop() {
+    this.alive = false;
+    this.child.kill();
+  }
+}
+
+class PathfinderPool {
+  constructor(size = POOL_SIZE) {
+    this.size = size;
+    this.workers = [];
+    this.nextId = 1;
+    this.pythonBin = null;
+  }
+
+  ensureWorkers() {
+    // Workers are started lazily and replaced when they die.
+    if (!this.pythonBin) this.pythonBin = resolvePythonBin();
+    while (this.workers.length < this.size) {
+      const worker = new PathfinderWorker(this.pythonBin, (dead) => {
+        this.workers = this.workers.filter((w) => w !== dead);
+      });
+      this.workers.push(worker);
+    }
+  }
+
+  /**
+   * Run one coach request on the least-loaded warm worker.
+   * request: { imageBase64, holds, model?, local? } -> resolves to the coach JSON.
+   */
+  analyze({ imageBase64, holds, model, local }) {
+    this.ensureWorkers();
+    const worker = this.workers.reduce((a, b) => (b.load < a.load ? b : a));
+    const id = this.nextId++;
+    return worker.send(id, {
+      image_base64: imageBase64,
+      holds: Array.isArray(holds) ? holds : [],
+      model,
+      local: Boolean(local),
+    });
+  }
+
+  close() {
+    for (const worker of this.workers) worker.stop();
+    this.workers = [];
+  }
+}
+
+const pool = new PathfinderPool();
+
+module.exports = { pool, PathfinderPool, PathfinderError };
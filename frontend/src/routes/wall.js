@@ -1,149 +1,30 @@
-const fs = require("fs");
-const path = require("path");
-const { spawn } = require("child_process");
-
 const express = require("express");
 
+const { pool } = require("../pathfinderPool");
+
 const router = express.Router();
 
-function ensureDir(dirPath) {
-  fs.mkdirSync(dirPath, { recursive: true });
-}
+const BASE64_RE = /^[A-Za-z0-9+/]+={0,2}$/;
 
-function decodeBase64Payload(base64) {
-  // Accept either pure base64 or data: URLs
-  const s = String(base64 || "");
-  const commaIdx = s.indexOf(",");
-  const payload = commaIdx >= 0 ? s.slice(commaIdx + 1) : s;
-  return Buffer.from(payload, "base64");
-}
-
-function parseJsonFromStdout(stdout) {
-  const text = String(stdout || "").trim();
-  if (!text) throw new Error("Pathfinder returned no output");
-
-  // In case there are extra log lines, try to parse the last JSON object.
-  const lines = text.split("\n").filter(Boolean);
-  for (let i = lines.length - 1; i >= 0; i -= 1) {
-    const candidate = lines[i].trim();
-    if (!candidate.startsWith("{") || !candidate.endsWith("}")) continue;
-    try {
-      return JSON.parse(candidate);
-    } catch {
-      // keep searching
-    }
-  }
-
-  // fallback: try whole string
-  return JSON.parse(text);
+function isBase64Payload(base64) {
+  // Accept either pure base64 or data: URLs; checked here so bad input stays a 400, not a worker error
+  const s = String(base64);
+  const payload = s.slice(s.indexOf(",") + 1).replace(/\s+/g, "");
+  return payload.length % 4 === 0 && BASE64_RE.test(payload);
 }
 
 router.post("/analyze", async (req, res) => {
-  const { imageBase64, filename, holds } = req.body || {};
+  const { imageBase64, holds } = req.body || {};
   if (!imageBase64) return res.status(400).json({ error: "imageBase64 is required" });
-
-  const rootDir = path.resolve(__dirname, "..", "..", ".."); // -> climBright
-  const uploadsDir = path.join(rootDir, "db", "uploads");
-  ensureDir(uploadsDir);
-
-  const safeName = String(filename || "wall.jpg").replace(/[^a-zA-Z0-9._-]/g, "_");
-  const ts = Date.now();
-  const imagePath = path.join(uploadsDir, `${ts}_${safeName}`);
+  if (!isBase64Payload(imageBase64)) return res.status(400).json({ error: "Invalid base64 image" });
 
   try {
-    const buf = decodeBase64Payload(imageBase64);
-    fs.writeFileSync(imagePath, buf);
-  } catch {
-    return res.status(400).json({ error: "Invalid base64 image" });
-  }
-
-  const safeHolds = Array.isArray(holds) ? holds : [];
-  const holdsJsonPath = path.join(uploadsDir, `${ts}_holds.json`);
-  fs.writeFileSync(holdsJsonPath, JSON.stringify({ holds: safeHolds }, null, 2));
-
-  const venvPyUnix = path.join(rootDir, "env", "bin", "python");
-  const venvPyWin = path.join(rootDir, "env", "Scripts", "python.exe");
-  const venvPyWinShim = path.join(rootDir, "env", "Scripts", "python");
-  let pythonBin = process.env.PYTHON_BIN;
-
-  // Prefer the repo venv if present (it has Pillow/google-genai, etc.).
-  // This prevents default configs like PYTHON_BIN=python3 from breaking.
-  if (
-    (!pythonBin || pythonBin === "python3" || pythonBin === "python") &&
-    (fs.existsSync(venvPyUnix) || fs.existsSync(venvPyWin) || fs.existsSync(venvPyWinShim))
-  ) {
-    pythonBin = fs.existsSync(venvPyUnix)
-      ? venvPyUnix
-      : fs.existsSync(venvPyWin)
-        ? venvPyWin
-        : venvPyWinShim;
-  }
-
-  if (!pythonBin) {
-    pythonBin = process.platform === "win32" ? "python" : "python3";
+    // Image and holds go straight to a warm pathfinder worker; nothing touches disk.
+    const coach = await pool.analyze({ imageBase64, holds });
+    return res.json({ ok: true, coach });
+  } catch (e) {
+    return res.status(502).json({ error: e.message, details: e.details });
   }
-  const pathfinderPath = path.join(rootDir, "pathfinder.py");
-
-  const args = [pathfinderPath, "--image", imagePath, "--json", holdsJsonPath];
-
-  const child = spawn(pythonBin, args, {
-    env: process.env,
-    cwd: rootDir,
-    stdio: ["ignore", "pipe", "pipe"],
-  });
-
-  let out = "";
-  let err = "";
-  let responded = false;
-
-  function reply(status, payload) {
-    if (responded) return;
-    responded = true;
-    if (status === "error") {
-      res.status(payload.status || 502).json(payload.body);
-    } else {
-      res.json(payload.body);
-    }
-  }
-
-  child.stdout.on("data", (d) => {
-    out += d.toString();
-  });
-  child.stderr.on("data", (d) => {
-    err += d.toString();
-  });
-
-  child.on("error", (spawnErr) => {
-    const message =
-      spawnErr.code === "ENOENT"
-        ? `Unable to execute python interpreter \"${pythonBin}\". Install Python or set PYTHON_BIN to a valid executable.`
-        : `Failed to launch pathfinder: ${spawnErr.message}`;
-    reply("error", {
-      status: 502,
-      body: { error: message },
-    });
-  });
-
-  child.on("close", (code) => {
-    if (responded) return;
-
-    if (code !== 0) {
-      return reply("error", {
-        status: 502,
-        body: { error: `pathfinder failed (${code})`, details: err || out },
-      });
-    }
-
-    try {
-      const coach = parseJsonFromStdout(out);
-      return reply("ok", { body: { ok: true, coach } });
-    } catch (e) {
-      return reply("error", {
-        status: 502,
-        body: { error: "Failed to parse pathfinder output", details: out || err },
-      });
-    }
-  });
 });
 
 module.exports = router;
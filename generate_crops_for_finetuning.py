@@ -1,14 +1,21 @@
 """
 Generate classifier training crops from raw images using YOLO detector.
 This creates a dataset for fine-tuning the ConvNeXt classifier on detector-generated crops.
+
+Images are decoded ahead of the detector by a thread pool, YOLO runs on
+batches of them, and crops are JPEG-encoded and written by a second pool.
+Every finished image is appended to a manifest in the output folder, so an
+interrupted run picks up where it stopped (same weights/conf/padding only).
 """
 import os
 import argparse
-import shutil
+import hashlib
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import cv2
-import numpy as np
-from PIL import Image
 from ultralytics import YOLO
 from tqdm import tqdm
 
@@ -20,6 +27,11 @@ YOLO_CONF_THRESHOLD = 0.3  # Higher threshold for cleaner training data
 BOX_PADDING = 0.15
 CLASS_NAMES = ["jug", "crimp", "pinch", "sloper", "pocket", "volume"]
 OUTPUT_DIR = "holds_cls_finetuned"
+PREDICT_BATCH_SIZE = 16    # images per YOLO call
+DECODE_WORKERS = 4         # threads decoding images ahead of the detector
+WRITE_WORKERS = 4          # threads encoding and saving crops
+MAX_PENDING_WRITES = 64    # images whose crops may be queued for writing (bounds memory)
+MANIFEST_NAME = "crops_manifest.jsonl"
 
 
 def pad_box(x1, y1, x2, y2, img_w, img_h, padding=0.15):
@@ -37,9 +49,107 @@ def pad_box(x1, y1, x2, y2, img_w, img_h, padding=0.15):
     return x1_new, y1_new, x2_new, y2_new
 
 
-def generate_crops_from_folder(detector, input_folder, output_base, split_name, conf_threshold, padding):
+def crop_settings(yolo_path, conf_threshold, padding):
+    """Fingerprint of everything that changes the crops; manifest entries only count if it matches."""
+    stat = os.stat(yolo_path) if os.path.exists(yolo_path) else None
+    weights = f"{os.path.abspath(yolo_path)}:{stat.st_size}:{stat.st_mtime_ns}" if stat else yolo_path
+    key = json.dumps({"weights": weights, "conf": conf_threshold, "padding": padding}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class CropManifest:
+    """Append-only JSON-lines record of processed images, one line per (split, source image)."""
+
+    def __init__(self, output_base, settings):
+        self.path = Path(output_base) / MANIFEST_NAME
+        self.settings = settings
+        self.done = set()
+        self.stale = 0
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line of an interrupted run
+                    if entry.get("settings") == settings:
+                        self.done.add((entry["split"], entry["source"]))
+                    else:
+                        self.stale += 1
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def is_done(self, split_name, source):
+        return (split_name, source) in self.done
+
+    def add(self, split_name, source, counts):
+        self.done.add((split_name, source))
+        entry = {"split": split_name, "source": source, "settings": self.settings, "crops": counts}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def prefetch(executor, fn, items, depth):
+    """Yield (item, fn(item)) in order while keeping up to depth calls running ahead."""
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= depth:
+            break
+    while pending:
+        item, future = pending.popleft()
+        nxt = next(items, None)
+        if nxt is not None:
+            pending.append((nxt, executor.submit(fn, nxt)))
+        yield item, future.result()
+
+
+def write_crops(crops):
+    """Encode and save one image's crops; returns the per-class counts written."""
+    counts = {}
+    for crop_path, class_name, crop in crops:
+        if cv2.imwrite(str(crop_path), crop):
+            counts[class_name] = counts.get(class_name, 0) + 1
+    return counts
+
+
+def image_crops(img_bgr, result, img_path, split_dir, padding):
+    """(path, class name, crop view) for every detection of one image."""
+    img_h, img_w = img_bgr.shape[:2]
+    boxes = result.boxes
+    xyxy = boxes.xyxy.cpu().numpy().astype(int)
+    confs = boxes.conf.cpu().numpy()
+    classes = boxes.cls.cpu().numpy().astype(int)
+    crops = []
+    for i, ((x1, y1, x2, y2), conf, cls_id) in enumerate(zip(xyxy.tolist(), confs.tolist(), classes.tolist())):
+        if cls_id >= len(CLASS_NAMES):
+            continue
+        class_name = CLASS_NAMES[cls_id]
+        
+        # Pad box
+        x1_pad, y1_pad, x2_pad, y2_pad = pad_box(x1, y1, x2, y2, img_w, img_h, padding)
+        
+        # Crop (a view; the writer pool encodes it)
+        crop = img_bgr[y1_pad:y2_pad, x1_pad:x2_pad]
+        if crop.size == 0:
+            continue
+        
+        crop_filename = f"{img_path.stem}_crop{i}_{conf:.2f}.jpg"
+        crops.append((split_dir / class_name / crop_filename, class_name, crop))
+    return crops
+
+
+def generate_crops_from_folder(detector, input_folder, output_base, split_name, conf_threshold, padding,
+                               manifest=None, batch_size=PREDICT_BATCH_SIZE, decode_workers=DECODE_WORKERS,
+                               write_workers=WRITE_WORKERS):
     """
     Run YOLO on all images in input_folder, generate crops, organize by class.
+    Images already recorded in manifest are skipped; an image is recorded once
+    all of its crops are on disk.
     """
     input_path = Path(input_folder)
     if not input_path.exists():
@@ -48,17 +158,24 @@ def generate_crops_from_folder(detector, input_folder, output_base, split_name,
     
     # Find all images
     image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
-    image_files = [
+    image_files = sorted(
         f for f in input_path.rglob('*')
         if f.suffix.lower() in image_extensions
-    ]
+    )
     
     if not image_files:
         print(f"⚠ No images found in {input_folder}")
         return 0
     
+    skipped = 0
+    if manifest is not None:
+        todo = [f for f in image_files if not manifest.is_done(split_name, str(f.resolve()))]
+        skipped = len(image_files) - len(todo)
+        image_files = todo
+    
     print(f"\n{'='*60}")
-    print(f"Processing {split_name}: {len(image_files)} images")
+    print(f"Processing {split_name}: {len(image_files)} images"
+          + (f" ({skipped} already done, skipped)" if skipped else ""))
     print(f"{'='*60}")
     
     # Create output directories
@@ -69,57 +186,60 @@ def generate_crops_from_folder(detector, input_folder, output_base, split_name,
     # Track crops per class
     crop_counts = {cls: 0 for cls in CLASS_NAMES}
     total_crops = 0
+    writes = deque()  # (source, future) in submission order
     
-    for img_path in tqdm(image_files, desc=f"Generating {split_name} crops"):
-        # Read image
-        img_bgr = cv2.imread(str(img_path))
-        if img_bgr is None:
-            continue
-        
-        img_h, img_w = img_bgr.shape[:2]
-        
-        # Run YOLO
+    def finish_write(source, future):
+        nonlocal total_crops
+        counts = future.result()
+        for class_name, count in counts.items():
+            crop_counts[class_name] += count
+            total_crops += count
+        if manifest is not None:
+            manifest.add(split_name, source, counts)
+    
+    def run_batch(batch, writer, progress):
         results = detector.predict(
-            source=img_bgr,
+            source=[img for _, img in batch],
             conf=conf_threshold,
             verbose=False
         )
-        
-        detections = results[0].boxes
-        if len(detections) == 0:
-            continue
-        
-        # Process each detection
-        for i, box in enumerate(detections):
-            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-            conf = box.conf[0].item()
-            cls_id = int(box.cls[0].item())
-            
-            if cls_id >= len(CLASS_NAMES):
-                continue
-            
-            class_name = CLASS_NAMES[cls_id]
-            
-            # Pad box
-            x1_pad, y1_pad, x2_pad, y2_pad = pad_box(x1, y1, x2, y2, img_w, img_h, padding)
-            
-            # Crop
-            crop = img_bgr[y1_pad:y2_pad, x1_pad:x2_pad]
-            if crop.size == 0:
+        for (img_path, img_bgr), result in zip(batch, results):
+            crops = image_crops(img_bgr, result, img_path, split_dir, padding)
+            writes.append((str(img_path.resolve()), writer.submit(write_crops, crops)))
+        while len(writes) > MAX_PENDING_WRITES:
+            finish_write(*writes.popleft())
+        progress.update(len(batch))
+        progress.set_postfix(crops=total_crops)
+    
+    start = time.perf_counter()
+    decode = lambda path: cv2.imread(str(path))
+    with ThreadPoolExecutor(decode_workers, thread_name_prefix="decode") as decoder, \
+            ThreadPoolExecutor(write_workers, thread_name_prefix="write") as writer, \
+            tqdm(total=len(image_files), desc=f"Generating {split_name} crops") as progress:
+        batch = []
+        for img_path, img_bgr in prefetch(decoder, decode, image_files, depth=2 * batch_size):
+            if img_bgr is None:
+                if manifest is not None:
+                    manifest.add(split_name, str(img_path.resolve()), {})
+                progress.update(1)
                 continue
-            
-            # Save crop
-            crop_filename = f"{img_path.stem}_crop{i}_{conf:.2f}.jpg"
-            crop_path = split_dir / class_name / crop_filename
-            cv2.imwrite(str(crop_path), crop)
-            
-            crop_counts[class_name] += 1
-            total_crops += 1
+            batch.append((img_path, img_bgr))
+            if len(batch) >= batch_size:
+                run_batch(batch, writer, progress)
+                batch = []
+        if batch:
+            run_batch(batch, writer, progress)
+        while writes:
+            finish_write(*writes.popleft())
+    elapsed = time.perf_counter() - start
     
     # Print summary
     print(f"\n✓ {split_name} crops generated: {total_crops}")
     for cls_name, count in crop_counts.items():
         print(f"  {cls_name}: {count}")
+    if image_files:
+        print(f"  {elapsed:.1f}s: {len(image_files) / max(elapsed, 1e-9):.1f} images/s, "
+              f"{total_crops / max(elapsed, 1e-9):.1f} crops/s")
     
     return total_crops
 
@@ -176,6 +296,29 @@ def main():
         default=None,
         help='Optional: add a folder of raw internet images to training set'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=PREDICT_BATCH_SIZE,
+        help='Images per YOLO predict call'
+    )
+    parser.add_argument(
+        '--decode-workers',
+        type=int,
+        default=DECODE_WORKERS,
+        help='Threads decoding images ahead of the detector'
+    )
+    parser.add_argument(
+        '--write-workers',
+        type=int,
+        default=WRITE_WORKERS,
+        help='Threads encoding and writing crops'
+    )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help=f'Reprocess every image even if {MANIFEST_NAME} lists it as done'
+    )
     
     args = parser.parse_args()
     
@@ -183,36 +326,43 @@ def main():
     detector = YOLO(args.yolo)
     print("✓ Detector loaded")
     
-    # Generate crops for each split
-    total = 0
-    
-    if os.path.exists(args.train):
-        total += generate_crops_from_folder(
-            detector, args.train, args.output, 'train',
-            args.conf, args.padding
-        )
+    manifest = CropManifest(args.output, crop_settings(args.yolo, args.conf, args.padding))
+    if args.no_resume:
+        manifest.done.clear()
+    elif manifest.done:
+        print(f"✓ Resuming: {len(manifest.done)} images already processed ({manifest.path})")
+    if manifest.stale:
+        print(f"⚠ {manifest.stale} manifest entries come from other weights/conf/padding; "
+              f"their crops in {args.output} are not regenerated or removed")
     
-    if os.path.exists(args.val):
-        total += generate_crops_from_folder(
-            detector, args.val, args.output, 'val',
-            args.conf, args.padding
+    def run(folder, split_name):
+        return generate_crops_from_folder(
+            detector, folder, args.output, split_name,
+            args.conf, args.padding, manifest=manifest, batch_size=args.batch_size,
+            decode_workers=args.decode_workers, write_workers=args.write_workers
         )
     
-    if os.path.exists(args.test):
-        total += generate_crops_from_folder(
-            detector, args.test, args.output, 'test',
-            args.conf, args.padding
-        )
+    # Generate crops for each split
+    total = 0
     
-    # Optional: add raw images to training set
-    if args.raw_folder and os.path.exists(args.raw_folder):
-        print("\n" + "="*60)
-        print("Adding raw images to training set...")
-        print("="*60)
-        total += generate_crops_from_folder(
-            detector, args.raw_folder, args.output, 'train',
-            args.conf, args.padding
-        )
+    try:
+        if os.path.exists(args.train):
+            total += run(args.train, 'train')
+        
+        if os.path.exists(args.val):
+            total += run(args.val, 'val')
+        
+        if os.path.exists(args.test):
+            total += run(args.test, 'test')
+        
+        # Optional: add raw images to training set
+        if args.raw_folder and os.path.exists(args.raw_folder):
+            print("\n" + "="*60)
+            print("Adding raw images to training set...")
+            print("="*60)
+            total += run(args.raw_folder, 'train')
+    finally:
+        manifest.close()
     
     print("\n" + "="*60)
     print("COMPLETE")
@@ -222,10 +372,7 @@ def main():
     print(f"\nNext steps:")
     print(f"1. Review the crops in {args.output}")
     print(f"2. Fine-tune your classifier:")
-    print(f"   - Update DATA_DIR in two_phase_train.py to '{args.output}'")
-    print(f"   - Reduce PHASE_B_EPOCHS to 5-10 (fine-tuning)")
-    print(f"   - Lower learning rate to 5e-5 or 1e-5")
-    print(f"   - Run: python two_phase_train.py")
+    print(f"   - Run: python two_phase_train.py --data-dir {args.output} --phase-b-epochs 10 --lr-b 5e-5")
     print("="*60 + "\n")
 
 
@@ -0,0 +1,116 @@
+"""
+Incremental local-coach recompute for hold edits (add / update / remove).
+The normalized hold set, reach graph and found routes of recently edited
+images are cached. An edit re-normalizes only the changed holds, carries
+over graph edges away from the edit, and keeps the previous routes when the
+edit cannot change them (see apply_edit); otherwise A* reruns on the warm graph.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from pathfinder import HoldArrays, format_local_coach
+from route_search import DEFAULT_ROUTES, ReachGraph, find_routes
+
+# =========================
+# CONFIGURATION
+# =========================
+HOLD_EDIT_CACHE_SIZE = int(os.environ.get("HOLD_EDIT_CACHE_SIZE", "64"))  # images kept warm, 0 disables
+
+
+class EditState:
+    """Holds, reach graph and routes of one image, plus the DB signature they were built from."""
+
+    def __init__(self, holds: HoldArrays, graph, found, signature=None):
+        self.holds = holds
+        self.graph = graph
+        self.found = found
+        self.signature = signature
+
+    @classmethod
+    def build(cls, holds: HoldArrays, num_routes: int = DEFAULT_ROUTES, signature=None) -> "EditState":
+        if not len(holds):
+            return cls(holds, None, [], signature)
+        graph, found = find_routes(holds.centers_norm, holds.type_codes, holds.img_w, holds.img_h, k=num_routes)
+        return cls(holds, graph, found, signature)
+
+    def coach(self) -> dict:
+        return format_local_coach(self.holds, self.graph, self.found)
+
+
+def apply_edit(state: EditState, remove_ids=(), upserts=(), num_routes: int = DEFAULT_ROUTES) -> tuple:
+    """
+    Return (new EditState, stats) for an edit. Routes are kept as they are when the
+    edit only removes holds that no route search touched and the start/top bands are
+    unchanged: removing unused holds cannot make any path cheaper.
+    """
+    holds, old_to_new = state.holds.with_changes(remove_ids, upserts)
+    stats = {"holds": len(holds), "reused_edges": 0, "reused_routes": False}
+    if not len(holds):
+        return EditState(holds, None, []), stats
+    old = state.graph
+    if old is None:
+        return EditState.build(holds, num_routes), stats
+
+    graph = ReachGraph(holds.centers_norm, holds.type_codes, aspect=holds.img_w / float(holds.img_h), reach=old.reach)
+
+    upsert_ids = {h.get("id") for h in upserts}
+    old_rows = [i for i, hid in enumerate(state.holds.ids) if hid in upsert_ids or old_to_new[i] < 0]
+    new_rows = [i for i, hid in enumerate(holds.ids) if hid in upsert_ids]
+    changed_points = np.concatenate([old.points[old_rows], graph.points[new_rows]])
+    stats["reused_edges"] = graph.reuse_edges(old, old_to_new, changed_points)
+
+    removed = set(np.flatnonzero(old_to_new < 0).tolist())
+    if (
+        not upserts
+        and not (removed & old.explored)
+        and {int(old_to_new[i]) for i in old.start_nodes()} == set(graph.start_nodes())
+        and old.top_threshold() == graph.top_threshold()
+    ):
+        found = [(cost, [int(old_to_new[i]) for i in path]) for cost, path in state.found]
+        graph.explored = {int(old_to_new[i]) for i in old.explored}
+        stats["reused_routes"] = True
+    else:
+        found = graph.k_routes(num_routes)
+    return EditState(holds, graph, found), stats
+
+
+class HoldEditCache:
+    """LRU of EditState by image id, with one lock per image so edits apply in order."""
+
+    def __init__(self, max_entries=HOLD_EDIT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def lock(self, image_id) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(image_id, threading.Lock())
+
+    def get(self, image_id, signature):
+        """Cached state if it was built from the same stored holds (signature), else None."""
+        with self._lock:
+            state = self._states.get(image_id)
+            if state is None or state.signature != signature:
+                return None
+            self._states.move_to_end(image_id)
+            return state
+
+    def put(self, image_id, state: EditState) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._states[image_id] = state
+            self._states.move_to_end(image_id)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._states), "max_entries": self.max_entries}
+
+
+edit_cache = HoldEditCache()
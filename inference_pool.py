@@ -0,0 +1,77 @@
+"""
+Bounded worker pool for blocking work (YOLO/ConvNeXt inference, SQLAlchemy
+commits, Gemini calls) so async endpoints never stall the event loop.
+Admission is capped at workers + queue slots; beyond that requests are
+rejected with 503 instead of piling up behind a slow wall photo.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+# =========================
+# CONFIGURATION
+# =========================
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))  # jobs allowed to wait for a worker
+RETRY_AFTER_SECONDS = int(os.environ.get("INFERENCE_RETRY_AFTER", "2"))
+
+
+class BoundedExecutor:
+    """Thread pool with a non-blocking admission limit."""
+
+    def __init__(self, max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be >= 1, got {max_workers}")
+        self.max_workers = max_workers
+        self.max_queue = max(0, max_queue)
+        self.capacity = self.max_workers + self.max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool, or raise 503 if the pool is saturated."""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy processing other images; retry shortly",
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+                )
+            self._in_flight += 1
+
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except Exception:
+            self._release()
+            raise
+        # Release on completion, not on await exit: a disconnected client must not
+        # free the slot while its job is still occupying a worker.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "workers": self.max_workers,
+            "queue_size": self.max_queue,
+            "in_flight": in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+pool = BoundedExecutor()
@@ -1,12 +1,25 @@
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import models
-from database import engine
+from database import add_missing_columns, engine
+from inference_pool import pool
+from model_registry import load_on_startup, registry
 from routers import classifier
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# Load + warm up models before serving so the first request after a deploy is not slow.
+	load_on_startup()
+	yield
+	pool.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow the browser frontend to call this API (different port => different origin).
 origins_env = os.environ.get("FRONTEND_ORIGINS")
@@ -29,6 +42,14 @@ app.add_middleware(
 )
 
 models.Base.metadata.create_all(bind=engine)
+add_missing_columns(engine, models.Base.metadata)
 
 #adding API routers 
-app.include_router(classifier.router)
\ No newline at end of file
+app.include_router(classifier.router)
+
+
+@app.get("/health")
+def health():
+	status = registry.status()
+	status["executor"] = pool.stats()
+	return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -0,0 +1,161 @@
+"""
+Request-coalescing scheduler for the two-stage pipeline.
+Images submitted by concurrent /classifier requests within a short window
+are run through YOLO as one batch, then all of their crops go through
+ConvNeXt together, and each caller gets back its own result list.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from detect_and_classify import CLASSIFY_BATCH_SIZE, decode_image, detect_and_classify_many
+from model_registry import registry
+
+# =========================
+# CONFIGURATION
+# =========================
+MICROBATCH_ENABLED = os.environ.get("MICROBATCH_ENABLED", "1").lower() not in ("0", "false", "no")
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", "8"))  # images per YOLO batch
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "10"))  # coalescing window
+
+# Upper bounds (ms) of the queue-wait histogram buckets; the last bucket is open-ended.
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class BatchMetrics:
+    """Batch-size distribution and queue-wait statistics for the batcher."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        self.batch_sizes = {}
+        self.wait_count = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.inference_total_ms = 0.0
+
+    def record(self, waits_ms, inference_ms):
+        with self._lock:
+            size = len(waits_ms)
+            self.batches += 1
+            self.images += size
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.inference_total_ms += inference_ms
+            for wait in waits_ms:
+                self.wait_count += 1
+                self.wait_total_ms += wait
+                self.wait_max_ms = max(self.wait_max_ms, wait)
+                for i, bound in enumerate(WAIT_BUCKETS_MS):
+                    if wait <= bound:
+                        self.wait_buckets[i] += 1
+                        break
+                else:
+                    self.wait_buckets[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+                "batch_size_distribution": dict(sorted(self.batch_sizes.items())),
+                "queue_wait_ms": {
+                    "mean": self.wait_total_ms / self.wait_count if self.wait_count else 0.0,
+                    "max": self.wait_max_ms,
+                    "histogram": dict(zip(labels, self.wait_buckets)),
+                },
+                "mean_inference_ms_per_batch": self.inference_total_ms / self.batches if self.batches else 0.0,
+            }
+
+
+class _Request:
+    __slots__ = ("image", "future", "enqueued")
+
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """Single background thread that drains the queue in time/size bounded batches."""
+
+    def __init__(self, registry, max_batch=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+                 classify_batch_size=CLASSIFY_BATCH_SIZE):
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be >= 1, got {max_batch}")
+        self.registry = registry
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.classify_batch_size = classify_batch_size
+        self.metrics = BatchMetrics()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="microbatcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image):
+        """Queue an image (path, ndarray or encoded bytes); returns a Future of its result list."""
+        # Decode on the caller's thread so a bad upload fails alone, not the whole batch.
+        request = _Request(decode_image(image))
+        self._ensure_started()
+        self._queue.put(request)
+        return request.future
+
+    def detect(self, image):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(image).result()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect(self._queue.get())
+            started = time.perf_counter()
+            waits_ms = [(started - r.enqueued) * 1000.0 for r in batch]
+            try:
+                detector, classifier = self.registry.get()
+                outputs = detect_and_classify_many(
+                    detector,
+                    classifier,
+                    [r.image for r in batch],
+                    self.registry.device,
+                    batch_size=self.classify_batch_size,
+                )
+            except Exception as exc:
+                for r in batch:
+                    r.future.set_exception(exc)
+                continue
+            finally:
+                # Drop references to decoded pixels as soon as the batch is done.
+                for r in batch:
+                    r.image = None
+            self.metrics.record(waits_ms, (time.perf_counter() - started) * 1000.0)
+            for r, result in zip(batch, outputs):
+                r.future.set_result(result)
+
+
+batcher = MicroBatcher(registry)
@@ -0,0 +1,150 @@
+"""
+Process-wide registry for the YOLO detector and ConvNeXt classifier.
+Loads both models exactly once (safe across threads), runs a configurable
+warm-up inference, and reports readiness for the /health endpoint.
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from detect_and_classify import (
+    DEVICE,
+    INFERENCE_BACKEND,
+    INFERENCE_INT8,
+    backend_model_paths,
+    classify_crops,
+    detect_and_classify,
+    load_classifier,
+    load_detector,
+    preprocess_crops,
+)
+
+# =========================
+# CONFIGURATION
+# =========================
+MODEL_EAGER_LOAD = os.environ.get("MODEL_EAGER_LOAD", "1").lower() not in ("0", "false", "no")
+MODEL_WARMUP_RUNS = int(os.environ.get("MODEL_WARMUP_RUNS", "1"))  # 0 disables warm-up
+MODEL_WARMUP_SIZE = int(os.environ.get("MODEL_WARMUP_SIZE", "640"))  # dummy image side in pixels
+
+
+def weights_fingerprint(*paths):
+    """Content hash of the given weight files; changes whenever any checkpoint changes."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class ModelRegistry:
+    """Holds the loaded detector/classifier pair and guarantees a single load."""
+
+    def __init__(self, yolo_path=None, convnext_path=None, device=DEVICE, backend=INFERENCE_BACKEND,
+                 int8=INFERENCE_INT8):
+        default_yolo, default_convnext = backend_model_paths(backend, int8)
+        self.backend = backend
+        self.int8 = int8
+        self.yolo_path = yolo_path or default_yolo
+        self.convnext_path = convnext_path or default_convnext
+        self.device = device
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._detector = None
+        self._classifier = None
+        self.error = None
+        self.fingerprint = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def load(self, warmup_runs=MODEL_WARMUP_RUNS):
+        """Load both models once; concurrent callers block until the first load finishes."""
+        if self._ready.is_set():
+            return
+        with self._lock:
+            if self._ready.is_set():
+                return
+            start = time.perf_counter()
+            try:
+                detector = load_detector(self.yolo_path)
+                classifier = load_classifier(self.convnext_path, self.device)
+            except Exception as exc:
+                self.error = str(exc)
+                raise
+            self._detector, self._classifier = detector, classifier
+            self.fingerprint = weights_fingerprint(self.yolo_path, self.convnext_path)
+            self.load_seconds = time.perf_counter() - start
+
+            self.warmup(warmup_runs)
+            self.error = None
+            self._ready.set()
+
+    def warmup(self, runs=MODEL_WARMUP_RUNS):
+        """Run dummy inference so the first real request hits warm kernels and allocators."""
+        if runs <= 0:
+            self.warmup_seconds = 0.0
+            return
+        start = time.perf_counter()
+        dummy = np.zeros((MODEL_WARMUP_SIZE, MODEL_WARMUP_SIZE, 3), dtype=np.uint8)
+        dummy_crops = preprocess_crops(dummy, [(0, 0, 64, 64)])
+        for _ in range(runs):
+            # A blank image yields no detections, so exercise the classifier directly as well.
+            detect_and_classify(self._detector, self._classifier, dummy, self.device, save_output=False)
+            classify_crops(self._classifier, dummy_crops, self.device)
+        self.warmup_seconds = time.perf_counter() - start
+        print(f"✓ Models warmed up ({runs} run(s), {self.warmup_seconds:.2f}s)")
+
+    def get(self):
+        """Return (detector, classifier), loading them first if needed."""
+        self.load()
+        return self._detector, self._classifier
+
+    def get_fingerprint(self):
+        """Identity of the loaded checkpoints (loads the models first if needed)."""
+        self.load()
+        return self.fingerprint
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "device": self.device,
+            "backend": self.backend + (" int8" if self.int8 and self.backend != "torch" else ""),
+            "yolo_model": self.yolo_path,
+            "convnext_model": self.convnext_path,
+            "fingerprint": self.fingerprint,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
+
+
+registry = ModelRegistry()
+
+
+def load_on_startup():
+    """Eagerly load models at app startup; failures are reported via /health instead of crashing."""
+    if not MODEL_EAGER_LOAD:
+        return
+    try:
+        registry.load()
+    except Exception as exc:
+        sys.stderr.write(f"Model load failed at startup; requests will retry. Error: {exc}\n")
+
+
+if __name__ == "__main__":
+    # Configuration check without loading any weights: python model_registry.py
+    expected = backend_model_paths(INFERENCE_BACKEND, INFERENCE_INT8)
+    resolved = (registry.yolo_path, registry.convnext_path)
+    print(f"backend={registry.status()['backend']} yolo={resolved[0]} convnext={resolved[1]}")
+    missing = [path for path in resolved if not os.path.exists(path)]
+    if resolved != expected:
+        sys.exit(f"✗ Registry paths {resolved} differ from the backend defaults {expected}")
+    print("✓ Default model paths resolved" + (f" (not found: {', '.join(missing)})" if missing else ""))
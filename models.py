@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, LargeBinary, String, DateTime, ForeignKey, Float, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 
 from database import Base
@@ -12,8 +12,13 @@ class Image(Base):
         filename (str): Unique filename assigned to the stored image.
         upload_time (datetime): Timestamp automatically set to the current UTC time via :func:`datetime.utcnow`.
         classifications (list[Classification]): Related classification results for the image.
-        data (bytes): Binary image content retained for processing or retrieval.
+        data (bytes): Legacy inline image content; empty for rows whose bytes live in the blob store.
+            Deferred, so it is only loaded when accessed.
         content_type (str): MIME type describing the nature of the image data.
+        blob_key (str): Content hash key of the image bytes in the blob store (see blob_store.py).
+        size (int): Size of the image in bytes.
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
     """
     __tablename__ = "images"
     
@@ -25,19 +30,44 @@ class Image(Base):
         back_populates="image",
         cascade="all, delete-orphan",
     )
-    data = Column(LargeBinary, nullable=False)
+    data = deferred(Column(LargeBinary, nullable=False, default=b""))
     content_type = Column(String, nullable=False)
     path_found = Column(JSON, nullable=True)
+    blob_key = Column(String, nullable=True, index=True)
+    size = Column(Integer, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
 
 
 class Classification(Base):
-    """Individual classification result linked to an uploaded image."""
+    """Individual classification result linked to an uploaded image.
+    Attributes:
+        hold_index (int): Position of the hold in the detection output (the hold "id" seen by clients).
+        label (str): Predicted hold type.
+        confidence (float): Classifier confidence for label.
+        bbox (list[int]): Unpadded detection box [x1, y1, x2, y2] in image pixels.
+        probs (dict[str, float]): Full class probability vector keyed by class name.
+    """
 
     __tablename__ = "classifications"
 
     id = Column(Integer, primary_key=True, index=True)
-    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), nullable=False)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), nullable=False, index=True)
+    hold_index = Column(Integer, nullable=True)
     label = Column(String, nullable=False)
     confidence = Column(Float)
+    bbox = Column(JSON, nullable=True)
+    probs = Column(JSON, nullable=True)
     image = relationship("Image", back_populates="classifications")
 
+
+class DetectionCache(Base):
+    """Persistent tier of the detection result cache, keyed by image + model + settings hash."""
+
+    __tablename__ = "detection_cache"
+
+    key = Column(String, primary_key=True)
+    model_fingerprint = Column(String, index=True, nullable=False)
+    holds = Column(JSON, nullable=False)
+    classifications = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
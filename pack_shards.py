@@ -0,0 +1,178 @@
+"""
+Pack ImageFolder crop datasets (holds_cls, holds_cls_finetuned, ...) into
+memory-mappable shards for training. Every split folder (train, val, test,
+real_val) becomes:
+    <out>/<split>/shard-00000.npy ...  flat uint8 arrays of RGB pixels
+    <out>/<split>/index.npy            [N, 5] int64 rows: shard, offset, height, width, label
+    <out>/<split>/meta.json            classes and the resize applied while packing
+Images are stored pre-resized (shorter side PACK_SIZE, as the eval transform's
+Resize(256)), so ShardDataset hands out memmap views instead of decoding JPEGs.
+
+    python pack_shards.py holds_cls -o holds_cls_packed
+then point DATA_DIR (two_phase_train.py) or DATA (training.py) at holds_cls_packed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# =========================
+# CONFIGURATION
+# =========================
+PACK_SIZE = 256                  # shorter side after packing; 0 keeps the original size
+SHARD_BYTES = 256 * 1024 * 1024  # target size of one shard file
+META_NAME = "meta.json"
+INDEX_NAME = "index.npy"
+FORMAT_VERSION = 1
+
+
+def resize_shorter(img, size):
+    """Resize so the shorter side is size, exactly like torchvision's Resize(size) on a PIL image."""
+    w, h = img.size
+    if size <= 0 or min(w, h) == size:
+        return img
+    if w <= h:
+        new_w, new_h = size, int(size * h / w)
+    else:
+        new_w, new_h = int(size * w / h), size
+    return img.resize((new_w, new_h), Image.BILINEAR)
+
+
+def load_resized(task):
+    """Worker: decode one image and return its resized RGB pixels as an HWC uint8 array."""
+    path, size = task
+    with Image.open(path) as img:
+        return np.asarray(resize_shorter(img.convert("RGB"), size), dtype=np.uint8)
+
+
+def pack_split(src, dst, size=PACK_SIZE, shard_bytes=SHARD_BYTES, workers=None):
+    """Pack one ImageFolder split into shards; returns the number of samples."""
+    from torchvision import datasets
+
+    folder = datasets.ImageFolder(src)
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(dst):
+        if name.startswith("shard-") or name in (INDEX_NAME, META_NAME):
+            os.remove(os.path.join(dst, name))
+
+    index = np.zeros((len(folder.samples), 5), dtype=np.int64)
+    parts, filled, shard = [], 0, 0
+
+    def flush():
+        nonlocal parts, filled, shard
+        if parts:
+            np.save(os.path.join(dst, f"shard-{shard:05d}.npy"), np.concatenate(parts))
+            parts, filled, shard = [], 0, shard + 1
+
+    tasks = [(path, size) for path, _ in folder.samples]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, (pixels, (_, label)) in enumerate(zip(pool.map(load_resized, tasks, chunksize=16), folder.samples)):
+            if filled and filled + pixels.size > shard_bytes:
+                flush()
+            index[i] = (shard, filled, pixels.shape[0], pixels.shape[1], label)
+            parts.append(pixels.reshape(-1))
+            filled += pixels.size
+    flush()
+
+    np.save(os.path.join(dst, INDEX_NAME), index)
+    meta = {"version": FORMAT_VERSION, "classes": folder.classes, "size": size, "shards": shard}
+    with open(os.path.join(dst, META_NAME), "w") as f:
+        json.dump(meta, f, indent=2)
+    return len(index)
+
+
+def is_packed(root):
+    return os.path.isfile(os.path.join(root, META_NAME))
+
+
+class ShardDataset:
+    """
+    Map-style dataset over a packed split with the ImageFolder surface (classes,
+    class_to_idx, targets, (image, label) items). Shards are opened as read-only
+    memmaps on first use in each worker; an item is a view into the shard wrapped
+    as a PIL image, so the usual torchvision transforms apply unchanged.
+    """
+
+    def __init__(self, root, transform=None):
+        with open(os.path.join(root, META_NAME)) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{root} was packed with format {meta.get('version')}; repack with pack_shards.py")
+        self.root = root
+        self.transform = transform
+        self.classes = meta["classes"]
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+        self.pack_size = meta["size"]
+        self.index = np.load(os.path.join(root, INDEX_NAME))
+        self.targets = self.index[:, 4].tolist()
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        # Memmaps are reopened in each DataLoader worker rather than pickled.
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _shard(self, shard):
+        array = self._shards.get(shard)
+        if array is None:
+            array = np.load(os.path.join(self.root, f"shard-{shard:05d}.npy"), mmap_mode="r")
+            self._shards[shard] = array
+        return array
+
+    def pixels(self, i):
+        """HWC uint8 view of sample i (no copy)."""
+        shard, offset, h, w, _ = self.index[i].tolist()
+        return self._shard(shard)[offset:offset + h * w * 3].reshape(h, w, 3)
+
+    def __getitem__(self, i):
+        img = Image.fromarray(self.pixels(i))
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.targets[i]
+
+
+def image_dataset(root, transform=None):
+    """ShardDataset for a packed split, else torchvision ImageFolder."""
+    if is_packed(root):
+        return ShardDataset(root, transform=transform)
+    from torchvision import datasets
+
+    return datasets.ImageFolder(root, transform=transform)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack ImageFolder splits into memory-mappable uint8 shards")
+    parser.add_argument('src', help='Dataset root with one ImageFolder per split (e.g. holds_cls)')
+    parser.add_argument('-o', '--out', required=True, help='Output root (e.g. holds_cls_packed)')
+    parser.add_argument('--splits', nargs='+', default=None,
+                        help='Splits to pack (default: every subfolder of src)')
+    parser.add_argument('--size', type=int, default=PACK_SIZE,
+                        help='Shorter side after packing (0 = keep original size)')
+    parser.add_argument('--shard-mb', type=int, default=SHARD_BYTES // (1024 * 1024), help='Target shard size in MB')
+    parser.add_argument('--workers', type=int, default=None, help='Decode processes (default: CPU count)')
+    args = parser.parse_args()
+
+    splits = args.splits or sorted(
+        d for d in os.listdir(args.src) if os.path.isdir(os.path.join(args.src, d)) and not d.startswith(".")
+    )
+    if not splits:
+        sys.exit(f"No split folders found in {args.src}")
+    for split in splits:
+        start = time.perf_counter()
+        count = pack_split(os.path.join(args.src, split), os.path.join(args.out, split), args.size,
+                           args.shard_mb * 1024 * 1024, args.workers)
+        print(f"✓ {split}: {count} images packed in {time.perf_counter() - start:.1f}s")
+    print(f"\nTrain on it with DATA_DIR = \"{args.out}\" in two_phase_train.py")
+
+
+if __name__ == "__main__":
+    main()
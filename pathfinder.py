@@ -1,11 +1,19 @@
 import argparse
+import base64
+import hashlib
 import json
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from typing import Any, Dict, Optional
 
+import numpy as np
 from PIL import Image
 
+from route_search import DEFAULT_ROUTES, HOLD_TYPES, find_routes, type_code
+
 
 SYSTEM_PROMPT = """
 You are an indoor rock climbing coach.
@@ -36,73 +44,221 @@ Task:
 
 Output in JSON with keys: routeA, routeB, difficulty, notes which includes each hold that is involved in the sequence followed by the coordinated of that hold normalized to a single point as well as the size of its bounding box to allow the web ui to properly outline the hold.
 """
+# Bump whenever SYSTEM_PROMPT (or the request built from it) changes: cached coach answers are keyed on it.
+PROMPT_VERSION = "1"
+
+
+# Difficulty contribution per type code (hard holds +1, easy holds -1, unknown 0)
+_HARD_TYPES = {"Crimp", "Pinch", "Sloper", "Pocket"}
+_EASY_TYPES = {"Jug", "Volume"}
+TYPE_SCORE_BY_CODE = np.array(
+    [1 if t in _HARD_TYPES else (-1 if t in _EASY_TYPES else 0) for t in HOLD_TYPES] + [0]
+)
+
+
+class HoldArrays:
+    """
+    Columnar hold set: bboxes, normalized centers/sizes and int-coded types as
+    NumPy arrays. ids, type strings and raw bboxes are kept as given so the
+    dict/JSON shape at the API boundary is unchanged.
+    """
+
+    def __init__(self, ids, types, raw_bboxes, bboxes, centers_norm, wh_norm, img_w, img_h, type_codes=None):
+        self.ids = list(ids)
+        self.types = list(types)
+        self.raw_bboxes = list(raw_bboxes)
+        self.bboxes = bboxes
+        self.centers_norm = centers_norm
+        self.wh_norm = wh_norm
+        self.img_w = img_w
+        self.img_h = img_h
+        if type_codes is None:
+            type_codes = np.fromiter((type_code(t) for t in self.types), dtype=np.int8, count=len(self.types))
+        self.type_codes = type_codes
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_hold_data(cls, hold_data: dict, img_w: int, img_h: int) -> "HoldArrays":
+        """Parse raw holds (top-level "holds" or "objects", each with bbox/box [x1,y1,x2,y2])."""
+        key = "holds" if "holds" in hold_data else ("objects" if "objects" in hold_data else None)
+        if key is None:
+            raise ValueError('JSON must have top-level key "holds" or "objects".')
+        items = hold_data[key]
+
+        # Support both "bbox" and "box" field names
+        raw_bboxes = [h.get("bbox") or h.get("box") for h in items]
+        for i, bbox in enumerate(raw_bboxes):
+            if not bbox or not isinstance(bbox, list) or len(bbox) != 4:
+                raise ValueError(f"Hold index {i} missing bbox/box: expected 'bbox':[x1,y1,x2,y2] or 'box':[x1,y1,x2,y2]")
+
+        bboxes = np.asarray(raw_bboxes, dtype=np.float64).reshape(-1, 4)
+        scale = np.array([img_w, img_h], dtype=np.float64)
+        centers_norm = (bboxes[:, 0:2] + bboxes[:, 2:4]) / 2.0 / scale
+        wh_norm = np.maximum(1.0, bboxes[:, 2:4] - bboxes[:, 0:2]) / scale
+
+        ids = [h.get("id", i) for i, h in enumerate(items)]
+        types = [h.get("type", h.get("class_name", h.get("label", "Unknown"))) for h in items]
+        return cls(ids, types, raw_bboxes, bboxes, centers_norm, wh_norm, img_w, img_h)
+
+    @classmethod
+    def from_normalized(cls, normalized: dict) -> "HoldArrays":
+        """Rebuild the columnar form from normalize_holds() output."""
+        holds = normalized.get("holds", [])
+        size = normalized.get("image_size") or {}
+        raw_bboxes = [h.get("bbox") for h in holds]
+        return cls(
+            [h["id"] for h in holds],
+            [h.get("type", "Unknown") for h in holds],
+            raw_bboxes,
+            np.asarray([b or [0, 0, 0, 0] for b in raw_bboxes], dtype=np.float64).reshape(-1, 4),
+            np.asarray([h["center_norm"] for h in holds], dtype=np.float64).reshape(-1, 2),
+            np.asarray([h["bbox_wh_norm"] for h in holds], dtype=np.float64).reshape(-1, 2),
+            size.get("w") or 1,
+            size.get("h") or 1,
+        )
+
+    def with_changes(self, remove_ids=(), upserts=()) -> tuple:
+        """
+        Apply a hold edit without re-normalizing untouched holds. upserts are hold
+        dicts with an "id": known ids are updated in place (missing fields keep their
+        old values), unknown ids are appended. Returns (new HoldArrays, old_to_new),
+        where old_to_new[i] is the new row of old row i or -1 if it was removed.
+        """
+        index_of = {hid: i for i, hid in enumerate(self.ids)}
+        merged = []
+        for h in upserts:
+            i = index_of.get(h.get("id"))
+            merged.append({
+                "id": h.get("id"),
+                "bbox": h.get("bbox") or h.get("box") or (self.raw_bboxes[i] if i is not None else None),
+                "type": h.get("type") or h.get("class_name") or h.get("label") or (self.types[i] if i is not None else "Unknown"),
+            })
+        changed = HoldArrays.from_hold_data({"holds": merged}, self.img_w, self.img_h)
+
+        ids, types, raw_bboxes = list(self.ids), list(self.types), list(self.raw_bboxes)
+        bboxes, centers_norm, wh_norm = self.bboxes.copy(), self.centers_norm.copy(), self.wh_norm.copy()
+        type_codes = self.type_codes.copy()
+        appended = []
+        for k, hid in enumerate(changed.ids):
+            i = index_of.get(hid)
+            if i is None:
+                appended.append(k)
+                continue
+            types[i], raw_bboxes[i], type_codes[i] = changed.types[k], changed.raw_bboxes[k], changed.type_codes[k]
+            bboxes[i], centers_norm[i], wh_norm[i] = changed.bboxes[k], changed.centers_norm[k], changed.wh_norm[k]
+
+        remove = set(remove_ids)
+        keep = np.fromiter((hid not in remove for hid in ids), dtype=bool, count=len(ids))
+        old_to_new = np.where(keep, np.cumsum(keep) - 1, -1)
+        rows = np.flatnonzero(keep).tolist()
+        return HoldArrays(
+            [ids[i] for i in rows] + [changed.ids[k] for k in appended],
+            [types[i] for i in rows] + [changed.types[k] for k in appended],
+            [raw_bboxes[i] for i in rows] + [changed.raw_bboxes[k] for k in appended],
+            np.concatenate([bboxes[keep], changed.bboxes[appended]]),
+            np.concatenate([centers_norm[keep], changed.centers_norm[appended]]),
+            np.concatenate([wh_norm[keep], changed.wh_norm[appended]]),
+            self.img_w,
+            self.img_h,
+            np.concatenate([type_codes[keep], changed.type_codes[appended]]),
+        ), old_to_new
+
+    def route_holds(self, indices) -> list:
+        """Route entries (id, type, center, size) for the given hold indices."""
+        indices = list(indices)
+        centers = self.centers_norm[indices].tolist()
+        sizes = self.wh_norm[indices].tolist()
+        return [
+            {"id": self.ids[i], "type": self.types[i], "center_norm": c, "bbox_wh_norm": wh}
+            for i, c, wh in zip(indices, centers, sizes)
+        ]
+
+    def to_normalized(self) -> dict:
+        """Dict/JSON shape used by the API, Gemini prompt and Node frontend."""
+        centers = self.centers_norm.tolist()
+        sizes = self.wh_norm.tolist()
+        return {
+            "image_size": {"w": self.img_w, "h": self.img_h},
+            "holds": [
+                {"id": hid, "type": t, "bbox": list(b), "center_norm": c, "bbox_wh_norm": wh}
+                for hid, t, b, c, wh in zip(self.ids, self.types, self.raw_bboxes, centers, sizes)
+            ],
+        }
+
+
+def _route_difficulty(type_codes: np.ndarray, move_lengths: np.ndarray) -> str:
+    type_score = int(TYPE_SCORE_BY_CODE[type_codes].sum())
+    avg_gap = float(move_lengths.mean()) if move_lengths.size else 0.0
 
+    if type_score >= 3 or avg_gap >= 0.15:
+        return "Hard"
+    if type_score >= 1 or avg_gap >= 0.08:
+        return "Moderate"
+    return "Easy"
+
+
+def build_local_coach(normalized, num_routes: int = DEFAULT_ROUTES) -> dict:
+    """
+    Heuristic coach without Gemini: searches the reach graph of the holds for
+    several distinct bottom-to-top routes (see route_search). routeA/routeB
+    mirror the two best routes for clients that only read those keys.
+    Accepts normalize_holds() output or a HoldArrays.
+    """
+    holds = normalized if isinstance(normalized, HoldArrays) else HoldArrays.from_normalized(normalized)
+    if not len(holds):
+        return format_local_coach(holds, None, [])
 
-def build_local_coach(normalized: dict) -> dict:
-    holds = normalized.get("holds", [])
-    if not holds:
+    graph, found = find_routes(holds.centers_norm, holds.type_codes, holds.img_w, holds.img_h, k=num_routes)
+    return format_local_coach(holds, graph, found)
+
+
+def format_local_coach(holds: HoldArrays, graph, found: list) -> dict:
+    """Coach JSON for routes already found on graph (list of (cost, [hold indices]))."""
+    if not len(holds):
         return {
+            "routes": [],
             "routeA": [],
             "routeB": [],
             "difficulty": "Easy",
             "notes": "No holds provided; unable to generate a route.",
         }
 
-    # Bottom-to-top: sort by vertical center (y), ascending
-    seq = sorted(holds, key=lambda h: h["center_norm"][1])
-    routeA = [
-        {
-            "id": h["id"],
-            "type": h.get("type", "Unknown"),
-            "center_norm": h["center_norm"],
-            "bbox_wh_norm": h["bbox_wh_norm"],
-        }
-        for h in seq
-    ]
-
-    # Alternate sequence skipping every other hold as a variation
-    routeB = [
-        {
-            "id": h["id"],
-            "type": h.get("type", "Unknown"),
-            "center_norm": h["center_norm"],
-            "bbox_wh_norm": h["bbox_wh_norm"],
-        }
-        for h in seq[::2]
-    ]
-
-    hard_types = {"Crimp", "Pinch", "Sloper", "Pocket"}
-    easy_types = {"Jug", "Volume"}
-    type_score = 0
-    for h in routeA:
-        t = (h.get("type") or "").title()
-        if t in hard_types:
-            type_score += 1
-        elif t in easy_types:
-            type_score -= 1
-
-    if len(seq) > 1:
-        gaps = [abs(seq[i + 1]["center_norm"][1] - seq[i]["center_norm"][1]) for i in range(len(seq) - 1)]
-        avg_gap = sum(gaps) / len(gaps)
-    else:
-        avg_gap = 0.0
+    routes = []
+    for n, (cost, path) in enumerate(found, 1):
+        routes.append({
+            "name": f"Route {n}",
+            "holds": holds.route_holds(path),
+            "cost": round(cost, 3),
+            "difficulty": _route_difficulty(holds.type_codes[path], graph.move_lengths(path)),
+        })
 
-    if type_score >= 3 or avg_gap >= 0.15:
-        difficulty = "Hard"
-    elif type_score >= 1 or avg_gap >= 0.08:
-        difficulty = "Moderate"
+    if routes:
+        notes = (
+            f"Local coach (no Gemini). Found {len(routes)} route(s) through holds within reach of each other, "
+            "preferring short moves on good holds. Verify on the wall and climb safely."
+        )
     else:
-        difficulty = "Easy"
-
-    notes = (
-        "Local coach (no Gemini). This route is generated from hold types + spacing heuristics. "
-        "Verify on the wall and climb safely."
-    )
+        # Holds are too far apart to link: fall back to every hold, bottom to top.
+        seq = np.argsort(-holds.centers_norm[:, 1], kind="stable")
+        gaps = np.abs(np.diff(holds.centers_norm[seq, 1]))
+        routes.append({
+            "name": "Route 1",
+            "holds": holds.route_holds(seq.tolist()),
+            "cost": None,
+            "difficulty": _route_difficulty(holds.type_codes[seq], gaps),
+        })
+        notes = (
+            "Local coach (no Gemini). Holds are too far apart for a connected route; "
+            "listing all holds bottom to top. Verify on the wall and climb safely."
+        )
 
     return {
-        "routeA": routeA,
-        "routeB": routeB,
-        "difficulty": difficulty,
+        "routes": routes,
+        "routeA": routes[0]["holds"],
+        "routeB": routes[1]["holds"] if len(routes) > 1 else [],
+        "difficulty": routes[0]["difficulty"],
         "notes": notes,
     }
 
@@ -123,97 +279,186 @@ def normalize_holds(hold_data: dict, img_w: int, img_h: int) -> dict:
     Adds center_norm and bbox_wh_norm to each hold using bbox [x1,y1,x2,y2]
     Accepts top-level "holds" or "objects".
     """
-    key = "holds" if "holds" in hold_data else ("objects" if "objects" in hold_data else None)
-    if key is None:
-        raise ValueError('JSON must have top-level key "holds" or "objects".')
+    return HoldArrays.from_hold_data(hold_data, img_w, img_h).to_normalized()
 
-    out = {"image_size": {"w": img_w, "h": img_h}, "holds": []}
 
-    for i, h in enumerate(hold_data[key]):
-        # Support both "bbox" and "box" field names
-        bbox = h.get("bbox") or h.get("box")
-        if not bbox or not isinstance(bbox, list) or len(bbox) != 4:
-            raise ValueError(f"Hold index {i} missing bbox/box: expected 'bbox':[x1,y1,x2,y2] or 'box':[x1,y1,x2,y2]")
-
-        x1, y1, x2, y2 = bbox
-        cx = (x1 + x2) / 2.0
-        cy = (y1 + y2) / 2.0
-        bw = max(1.0, (x2 - x1))
-        bh = max(1.0, (y2 - y1))
-
-        hold_id = h.get("id", i)
-        hold_type = h.get("type", h.get("class_name", h.get("label", "Unknown")))
-
-        out["holds"].append({
-            "id": hold_id,
-            "type": hold_type,
-            "bbox": [x1, y1, x2, y2],
-            "center_norm": [cx / img_w, cy / img_h],
-            "bbox_wh_norm": [bw / img_w, bh / img_h],
-        })
+def gemini_api_key() -> Optional[str]:
+    return os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
 
-    return out
 
+_genai_client = None
+_genai_client_lock = threading.Lock()
 
-def generate_gemini_coach(img: Image.Image, normalized: dict, model: str) -> Optional[Dict[str, Any]]:
-    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+
+def get_genai_client():
+    """
+    Shared google-genai client (its .aio namespace is the async client).
+    Returns (client, types) or (None, None) when no key is set or the SDK is missing.
+    """
+    global _genai_client
+    api_key = gemini_api_key()
     if not api_key:
-        return None
+        return None, None
 
     # Import lazily so local fallback works even if google-genai isn't installed.
     try:
         from google import genai  # type: ignore
         from google.genai import types  # type: ignore
 
-        genai_client = genai.Client(api_key=api_key)
+        client_factory = genai.Client
     except Exception:
         try:
             from google.genai import client, types  # type: ignore
 
-            genai_client = client.Client(api_key=api_key)
+            client_factory = client.Client
         except Exception as e:
             sys.stderr.write(f"Gemini import/init failed; falling back to local coach. Error: {e}\n")
-            return None
+            return None, None
+
+    with _genai_client_lock:
+        if _genai_client is None:
+            _genai_client = client_factory(api_key=api_key)
+    return _genai_client, types
+
+
+def gemini_request(img: Image.Image, normalized: dict, types) -> dict:
+    """Keyword arguments for models.generate_content (sync and aio)."""
+    return dict(
+        config=types.GenerateContentConfig(
+            system_instruction=SYSTEM_PROMPT,
+            response_mime_type="application/json",
+        ),
+        contents=[
+            img,
+            "Here is the hold data JSON (this is the only reliable hold info):",
+            json.dumps(normalized, ensure_ascii=False),
+        ],
+    )
 
-    holds_json_str = json.dumps(normalized, ensure_ascii=False)
 
+def parse_coach_response(response) -> Optional[Dict[str, Any]]:
+    """Coach JSON from a Gemini response, or None if the text is not a JSON object."""
+    text = (getattr(response, "text", None) or "").strip()
+    if text.startswith("```"):
+        # Tolerate fenced output even though JSON mime type was requested.
+        text = text.strip("`").removeprefix("json").strip()
     try:
-        response = genai_client.models.generate_content(
-            model=model,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_PROMPT,
-                response_mime_type="application/json",
-            ),
-            contents=[
-                img,
-                "Here is the hold data JSON (this is the only reliable hold info):",
-                holds_json_str,
-            ],
-        )
-        text = getattr(response, "text", None) or ""
-        return response.json()
+        coach = json.loads(text)
+    except ValueError:
+        sys.stderr.write("Gemini returned non-JSON output; falling back to local coach.\n")
+        return None
+    return coach if isinstance(coach, dict) else None
+
+
+def generate_gemini_coach(img: Image.Image, normalized: dict, model: str) -> Optional[Dict[str, Any]]:
+    genai_client, types = get_genai_client()
+    if genai_client is None:
+        return None
+
+    try:
+        response = genai_client.models.generate_content(model=model, **gemini_request(img, normalized, types))
+        return parse_coach_response(response)
     except Exception as e:
         sys.stderr.write(f"Gemini request failed; falling back to local coach. Error: {e}\n")
         return None
 
 
+def coach_request(request: dict) -> Dict[str, Any]:
+    """
+    Handle one serve-mode request:
+    {"image_base64" | "image_path", "holds": [...], "model": str, "local": bool}.
+    Only the image header is read unless the LLM coach actually needs the pixels.
+    """
+    if request.get("image_path"):
+        with open(request["image_path"], "rb") as f:
+            image_bytes = f.read()
+    elif request.get("image_base64"):
+        # Accept either pure base64 or data: URLs
+        payload = str(request["image_base64"])
+        image_bytes = base64.b64decode(payload.split(",", 1)[-1])
+    else:
+        raise ValueError("image_base64 or image_path is required")
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        img_w, img_h = img.size
+    holds = HoldArrays.from_hold_data({"holds": request.get("holds") or []}, img_w, img_h)
+    if request.get("local"):
+        return build_local_coach(holds)
+
+    # Imported here: coach_service builds on this module. Under --serve this file is
+    # __main__, so its HoldArrays is not the class coach_service checks; hand over plain data.
+    from coach_service import coach_service
+
+    return coach_service.coach(
+        hashlib.sha256(image_bytes).hexdigest(),
+        lambda: Image.open(BytesIO(image_bytes)).convert("RGB"),
+        holds.to_normalized(),
+        request.get("model") or "models/gemini-2.5-flash",
+    )
+
+
+def serve(workers: int = 2) -> None:
+    """
+    Long-lived mode for the Node server: one JSON request per stdin line, one
+    JSON response per stdout line ({"id", "ok", "coach"} or {"id", "ok": false, "error"}).
+    Requests run on a small thread pool, so responses may arrive out of order.
+    """
+    out = sys.stdout
+    # Anything else that prints (library warnings, etc.) must not corrupt the protocol.
+    sys.stdout = sys.stderr
+    out_lock = threading.Lock()
+
+    def respond(message: dict) -> None:
+        line = json.dumps(message)
+        with out_lock:
+            out.write(line + "\n")
+            out.flush()
+
+    def handle(line: str) -> None:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            respond({"id": None, "ok": False, "error": f"Invalid JSON request: {e}"})
+            return
+        request_id = request.get("id")
+        try:
+            respond({"id": request_id, "ok": True, "coach": coach_request(request)})
+        except Exception as e:
+            respond({"id": request_id, "ok": False, "error": str(e)})
+
+    respond({"id": None, "ok": True, "ready": True})
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                executor.submit(handle, line)
+
+
 def run() -> None:
     parser = argparse.ArgumentParser(description="Generate climbing routes from holds JSON (Gemini or local fallback).")
-    parser.add_argument("--image", required=True, help="Path to wall image")
-    parser.add_argument("--json", required=True, help="Path to holds JSON (must include top-level 'holds')")
+    parser.add_argument("--image", help="Path to wall image")
+    parser.add_argument("--json", help="Path to holds JSON (must include top-level 'holds')")
     parser.add_argument("--model", default="models/gemini-2.5-flash", help="Gemini model name")
     parser.add_argument("--local", action="store_true", help="Force local coach (skip Gemini)")
+    parser.add_argument("--serve", action="store_true", help="Serve JSON-lines requests on stdin/stdout until EOF")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent requests in --serve mode")
     args = parser.parse_args()
 
+    if args.serve:
+        serve(args.workers)
+        return None
+    if not args.image or not args.json:
+        parser.error("--image and --json are required unless --serve is given")
+
     img, hold_data = load_files(args.image, args.json)
     img_w, img_h = img.size
-    normalized = normalize_holds(hold_data, img_w, img_h)
+    holds = HoldArrays.from_hold_data(hold_data, img_w, img_h)
 
     result: Optional[Dict[str, Any]] = None
     if not args.local:
-        result = generate_gemini_coach(img, normalized, model=args.model)
+        result = generate_gemini_coach(img, holds.to_normalized(), model=args.model)
     if result is None:
-        result = build_local_coach(normalized)
+        result = build_local_coach(holds)
 
     # IMPORTANT: stdout must be JSON-only for the Node server parser
     print(json.dumps(result))
@@ -0,0 +1,154 @@
+"""
+Content-hash cache for detection + classification results.
+Keys combine the image bytes, the loaded checkpoints' fingerprint and the
+detection settings, so changing weights or thresholds never serves stale
+holds. Entries live in an in-memory LRU with an optional SQLite tier.
+"""
+import copy
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import classifier_optim
+import detect_and_classify
+import models
+from database import SessionLocal
+
+# =========================
+# CONFIGURATION
+# =========================
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))  # in-memory entries, 0 disables
+RESULT_CACHE_PERSIST = os.environ.get("RESULT_CACHE_PERSIST", "1").lower() not in ("0", "false", "no")
+
+
+def detection_settings(tile_size=None):
+    """Settings that change detection output; read at call time since the CLI may override them."""
+    settings = {
+        "conf": detect_and_classify.YOLO_CONF_THRESHOLD,
+        "padding": detect_and_classify.BOX_PADDING,
+    }
+    if classifier_optim.applied_settings_tag():
+        # Reduced-precision classifiers can shift probabilities slightly.
+        settings["classifier"] = classifier_optim.applied_settings_tag()
+    tile_size = detect_and_classify.TILE_SIZE if tile_size is None else tile_size
+    if tile_size:
+        # Only present when tiling is on, so untiled keys stay the same.
+        settings["tile_size"] = tile_size
+        settings["tile_overlap"] = detect_and_classify.TILE_OVERLAP
+    return settings
+
+
+class ResultCache:
+    """In-memory LRU in front of an optional persistent DetectionCache table."""
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, persist=RESULT_CACHE_PERSIST, session_factory=SessionLocal):
+        self.max_entries = max_entries
+        self.persist = persist
+        self.session_factory = session_factory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._active_fingerprint = None
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_bytes, fingerprint, tile_size=None):
+        digest = hashlib.sha256()
+        digest.update(memoryview(image_bytes))
+        settings = detection_settings(tile_size)
+        params = "|".join(f"{k}={settings[k]}" for k in sorted(settings))
+        digest.update(f"|{fingerprint}|{params}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _on_fingerprint(self, fingerprint):
+        """Drop entries from other checkpoints the first time a new fingerprint is seen."""
+        if fingerprint == self._active_fingerprint:
+            return
+        with self._lock:
+            if fingerprint == self._active_fingerprint:
+                return
+            self._entries.clear()
+            self._active_fingerprint = fingerprint
+        if not self.persist:
+            return
+        try:
+            with self.session_factory() as db:
+                db.query(models.DetectionCache).filter(
+                    models.DetectionCache.model_fingerprint != fingerprint
+                ).delete(synchronize_session=False)
+                db.commit()
+        except Exception as exc:
+            sys.stderr.write(f"Detection cache invalidation failed: {exc}\n")
+
+    def get(self, image_bytes, fingerprint, tile_size=None):
+        """Return (key, cached value or None). Values are {"holds": [...], "classifications": [...]}."""
+        self._on_fingerprint(fingerprint)
+        key = self.make_key(image_bytes, fingerprint, tile_size)
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return key, copy.deepcopy(value)
+
+        if self.persist:
+            try:
+                with self.session_factory() as db:
+                    row = db.get(models.DetectionCache, key)
+                    if row is not None:
+                        value = {"holds": row.holds, "classifications": row.classifications}
+            except Exception as exc:
+                sys.stderr.write(f"Detection cache read failed: {exc}\n")
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.persistent_hits += 1
+                return key, copy.deepcopy(value)
+
+        with self._lock:
+            self.misses += 1
+        return key, None
+
+    def put(self, key, fingerprint, holds, classifications):
+        value = {"holds": copy.deepcopy(holds), "classifications": copy.deepcopy(classifications)}
+        self._remember(key, value)
+        if not self.persist:
+            return
+        try:
+            with self.session_factory() as db:
+                db.merge(models.DetectionCache(
+                    key=key,
+                    model_fingerprint=fingerprint,
+                    holds=value["holds"],
+                    classifications=value["classifications"],
+                ))
+                db.commit()
+        except Exception as exc:
+            sys.stderr.write(f"Detection cache write failed: {exc}\n")
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persist": self.persist,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+            }
+
+
+cache = ResultCache()
@@ -0,0 +1,214 @@
+"""
+Reach-graph route search over normalized holds.
+Holds within reach of each other are linked (found through a y-sorted
+sweep index with vectorized distance checks), moves are costed by distance
+and the type of hold landed on, and A* finds the cheapest start-to-top
+sequences. Repeated searches with penalties on already-used holds yield
+several distinct routes.
+"""
+import heapq
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# =========================
+# CONFIGURATION
+# =========================
+REACH_RADIUS = 0.25        # max move length, in units of image height (or calibrated units)
+START_BAND = 0.15          # holds this close to the lowest hold can start a route
+TOP_BAND = 0.15            # holds this close to the highest hold can finish a route
+DOWN_TOLERANCE = 0.05      # how far a move may go downwards (matches/shuffles)
+MOVE_WEIGHT = 1.5          # cost of a full-reach move relative to the hold cost
+REUSE_PENALTY = 4.0        # extra cost on holds already used by earlier routes
+MAX_SHARED_FRACTION = 0.6  # routes sharing more of their holds than this are not "distinct"
+DEFAULT_ROUTES = 3
+
+# Hold types are int-coded in the columnar representation; UNKNOWN_TYPE covers anything else.
+HOLD_TYPES = ("Jug", "Crimp", "Pinch", "Pocket", "Sloper", "Volume")
+TYPE_CODES = {t: i for i, t in enumerate(HOLD_TYPES)}
+UNKNOWN_TYPE = len(HOLD_TYPES)
+
+# Cost of standing/pulling on each hold type (lower = easier)
+HOLD_COST = {
+    "Jug": 1.0,
+    "Volume": 1.2,
+    "Pinch": 1.8,
+    "Crimp": 2.0,
+    "Pocket": 2.2,
+    "Sloper": 2.4,
+}
+UNKNOWN_HOLD_COST = 1.6
+COST_BY_CODE = np.array([HOLD_COST[t] for t in HOLD_TYPES] + [UNKNOWN_HOLD_COST])
+
+
+def type_code(hold_type: Optional[str]) -> int:
+    return TYPE_CODES.get((hold_type or "").title(), UNKNOWN_TYPE)
+
+
+def hold_cost(hold_type: Optional[str]) -> float:
+    return float(COST_BY_CODE[type_code(hold_type)])
+
+
+class ReachGraph:
+    """Directed reach graph over hold centers; neighbors come from a y-sorted sweep index."""
+
+    def __init__(self, centers_norm, type_codes, aspect: float = 1.0, reach: float = REACH_RADIUS,
+                 down_tolerance: float = DOWN_TOLERANCE):
+        # Positions in height units: x is scaled by the image aspect ratio (w / h) so
+        # distances are isotropic on the wall regardless of the photo shape.
+        self.reach = reach
+        self.down_tolerance = down_tolerance
+        self.points = np.asarray(centers_norm, dtype=np.float64).reshape(-1, 2) * np.array([aspect, 1.0])
+        self.cost_array = COST_BY_CODE[np.asarray(type_codes, dtype=np.intp)]
+        self._order = np.argsort(self.points[:, 1], kind="stable")
+        self._sorted_y = self.points[self._order, 1]
+        # Plain lists for the scalar lookups in the A* inner loop.
+        self.xs = self.points[:, 0].tolist()
+        self.ys = self.points[:, 1].tolist()
+        self.costs = self.cost_array.tolist()
+        # Edges are computed lazily: A* only expands a small part of the wall.
+        self._edges: Dict[int, List[tuple]] = {}
+        # Every hold on a path found by k_routes, kept or discarded (they all add penalties).
+        self.explored: set = set()
+
+    def __len__(self) -> int:
+        return len(self.ys)
+
+    def neighbors(self, i: int) -> List[tuple]:
+        """(j, move_cost) for every hold reachable from hold i; move_cost includes landing on j."""
+        edges = self._edges.get(i)
+        if edges is None:
+            edges = self._edges[i] = self._compute_neighbors(i)
+        return edges
+
+    def _compute_neighbors(self, i: int) -> List[tuple]:
+        x, y = self.xs[i], self.ys[i]
+        # y grows downwards in image space: candidates lie between one reach above
+        # and down_tolerance below the hold.
+        lo = np.searchsorted(self._sorted_y, y - self.reach, side="left")
+        hi = np.searchsorted(self._sorted_y, y + self.down_tolerance, side="right")
+        cand = self._order[lo:hi]
+        dist = np.hypot(self.points[cand, 0] - x, self.points[cand, 1] - y)
+        keep = (dist <= self.reach) & (cand != i)
+        cand = cand[keep]
+        steps = (MOVE_WEIGHT / self.reach) * dist[keep] + self.cost_array[cand]
+        return list(zip(cand.tolist(), steps.tolist()))
+
+    def reuse_edges(self, old: "ReachGraph", old_to_new: np.ndarray, changed_points) -> int:
+        """
+        Copy old's cached edges for holds that still exist and have no changed
+        position (removed, moved or added hold, in this graph's units) within
+        reach. old_to_new maps old indices to new ones (-1 = removed); both
+        graphs must share aspect and reach. Returns the number of holds reused.
+        """
+        cached = [i for i in old._edges if old_to_new[i] >= 0]
+        if not cached:
+            return 0
+        changed = np.asarray(changed_points, dtype=np.float64).reshape(-1, 2)
+        if len(changed):
+            pts = old.points[cached]
+            dist = np.hypot(pts[:, None, 0] - changed[None, :, 0], pts[:, None, 1] - changed[None, :, 1])
+            cached = [i for i, near in zip(cached, (dist <= old.reach).any(axis=1)) if not near]
+        remap = old_to_new.tolist()
+        for i in cached:
+            self._edges[remap[i]] = [(remap[j], step) for j, step in old._edges[i]]
+        return len(cached)
+
+    def start_nodes(self, band: float = START_BAND) -> List[int]:
+        if not len(self):
+            return []
+        y = self.points[:, 1]
+        return np.flatnonzero(y >= y.max() - band).tolist()
+
+    def top_threshold(self, band: float = TOP_BAND) -> float:
+        return float(self.points[:, 1].min()) + band
+
+    def heuristic(self, top_y: float) -> List[float]:
+        """Admissible A* estimate for every hold, computed in one vectorized pass."""
+        # Each move climbs at most `reach`, so at least ceil(dy / reach) more moves are
+        # needed, each paying its distance plus at least the cheapest hold.
+        moves = np.maximum(0.0, self.points[:, 1] - top_y) / self.reach
+        return (MOVE_WEIGHT * moves + np.ceil(moves) * self.cost_array.min()).tolist()
+
+    def shortest_path(self, starts: Sequence[int], top_y: float,
+                      penalties: Optional[List[float]] = None) -> Optional[tuple]:
+        """A* from any start hold to any hold with y <= top_y. Returns (cost, [indices]) or None."""
+        n = len(self)
+        if penalties is None:
+            penalties = [0.0] * n
+        h = self.heuristic(top_y)
+        ys = self.ys
+        inf = math.inf
+        best = [inf] * n
+        parent = [-1] * n
+        heap = []
+        for s in starts:
+            g = self.costs[s] + penalties[s]
+            if g < best[s]:
+                best[s] = g
+                heapq.heappush(heap, (g + h[s], g, s))
+
+        while heap:
+            _, g, i = heapq.heappop(heap)
+            if g > best[i]:
+                continue
+            if ys[i] <= top_y:
+                path = [i]
+                while parent[path[-1]] >= 0:
+                    path.append(parent[path[-1]])
+                return g, path[::-1]
+            for j, step in self.neighbors(i):
+                ng = g + step + penalties[j]
+                if ng < best[j]:
+                    best[j] = ng
+                    parent[j] = i
+                    heapq.heappush(heap, (ng + h[j], ng, j))
+        return None
+
+    def k_routes(self, k: int = DEFAULT_ROUTES) -> List[tuple]:
+        """Up to k distinct (cost, [indices]) routes, cheapest first."""
+        if not len(self):
+            return []
+        starts = self.start_nodes()
+        top_y = self.top_threshold()
+        penalties = [0.0] * len(self)
+        routes: List[tuple] = []
+        # A few extra attempts: a penalized search can rediscover a near-duplicate.
+        for _ in range(k * 3):
+            if len(routes) >= k:
+                break
+            found = self.shortest_path(starts, top_y, penalties)
+            if found is None:
+                break
+            _, path = found
+            self.explored.update(path)
+            for i in path:
+                penalties[i] += REUSE_PENALTY
+            path_set = set(path)
+            if any(len(path_set & set(p)) / len(path_set) > MAX_SHARED_FRACTION for _, p in routes):
+                continue
+            routes.append((self.path_cost(path), path))
+        return routes
+
+    def move_lengths(self, path: Sequence[int]) -> np.ndarray:
+        """Length of every move along a route, in height units."""
+        return np.hypot(*np.diff(self.points[list(path)], axis=0).T) if len(path) > 1 else np.zeros(0)
+
+    def path_cost(self, path: Sequence[int]) -> float:
+        """Unpenalized cost of a route."""
+        moves = self.move_lengths(path)
+        return float(self.cost_array[list(path)].sum() + (MOVE_WEIGHT / self.reach) * moves.sum())
+
+
+def find_routes(centers_norm, type_codes, img_w: int, img_h: int, k: int = DEFAULT_ROUTES,
+                reach: float = REACH_RADIUS, px_per_unit: Optional[float] = None) -> tuple:
+    """
+    Build the reach graph for normalized hold centers and return (graph, routes).
+    reach is in image-height units, or in calibrated units (e.g. meters) when
+    px_per_unit is given.
+    """
+    if px_per_unit:
+        reach = reach * px_per_unit / float(img_h)
+    graph = ReachGraph(centers_norm, type_codes, aspect=img_w / float(img_h), reach=reach)
+    return graph, graph.k_routes(k)
@@ -1,36 +1,56 @@
+import asyncio
 import base64
 import binascii
 import json
 import os
 import sys
-import tempfile
+from contextlib import contextmanager
 from io import BytesIO
 from typing import Any, Dict, List, Optional
 
 sys.path.append("..")
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+from sqlalchemy import func
 
 import models
+from blob_store import content_key, get_blob_store
+from coach_jobs import PENDING, jobs
+from coach_service import DEFAULT_MODEL as DEFAULT_COACH_MODEL, coach_service
 from database import SessionLocal
+from hold_edits import EditState, apply_edit, edit_cache
 from detect_and_classify import (
+    CLASSIFY_BATCH_SIZE,
     DEVICE,
-    CONVNEXT_MODEL,
-    YOLO_MODEL,
     CLASS_NAMES,
+    MIN_TILE_SIZE,
     detect_and_classify,
-    load_classifier,
-    load_detector,
 )
-from pathfinder import build_local_coach, generate_gemini_coach, normalize_holds
+from inference_pool import pool
+from microbatch import MICROBATCH_ENABLED, batcher
+from model_registry import registry
+from result_cache import cache
+from pathfinder import HoldArrays, build_local_coach
 from PIL import Image
 
 
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+COACH_JOB_MAX_WAIT_S = 30.0  # long-poll cap
+SSE_KEEPALIVE_S = 15.0
+
+
 class ImagePayload(BaseModel):
     filename: str = Field(..., description="Original file name provided by the client")
     content_type: str = Field(..., description="MIME type of the image")
     data: str = Field(..., description="Base64-encoded image content")
+    tile_size: Optional[int] = Field(
+        None, ge=0,
+        description=f"Detect in overlapping tiles of this size for large panoramas "
+                    f"(0 = off, else >= {MIN_TILE_SIZE}; default: server setting)"
+    )
 
 
 class ImageResponse(BaseModel):
@@ -59,11 +79,22 @@ class PathfinderPayload(BaseModel):
     holds: Optional[List[HoldPayload]] = Field(None, description="Detection holds with bounding boxes")
     model: Optional[str] = Field(None, description="Gemini model to use when available")
     local_only: bool = Field(False, description="Skip Gemini and use heuristic pathfinder")
+    background: bool = Field(
+        False,
+        description="Return the heuristic coach at once and refine it with Gemini in the background (see job_id)",
+    )
+
+
+class HoldEditPayload(BaseModel):
+    add: List[HoldPayload] = Field(default_factory=list, description="New holds; ids are assigned when missing")
+    update: List[HoldPayload] = Field(default_factory=list, description="Changed holds matched by id (bbox and/or type)")
+    remove: List[int] = Field(default_factory=list, description="Ids of holds to delete")
 
 
 class PathfinderResponse(BaseModel):
     image_id: int
     coach: Dict[str, Any]
+    job_id: Optional[str] = None
     
 router = APIRouter(
     prefix="/classifier",
@@ -78,26 +109,46 @@ def get_db():
     finally:
         db.close()
 
-def detect_results(detector, classifier, image_bytes: bytes, device: str):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        tmp.write(image_bytes)
-        tmp_path = tmp.name
-
+def with_session(fn, *args, **kwargs):
+    """
+    Pool job: call fn(*args, **kwargs, db_session=...) with a session the job owns. A
+    request-scoped get_db session is closed on client disconnect while the job
+    may still be using it.
+    """
+    db_session = SessionLocal()
     try:
-        results = detect_and_classify(
-            detector,
-            classifier,
-            tmp_path,
-            device,
-            save_output=False,
-        )
+        return fn(*args, db_session=db_session, **kwargs)
     finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+        db_session.close()
+
+def check_tile_size(tile_size: Optional[int]) -> None:
+    """Reject client tile sizes that would split an image into an unbounded number of tiles."""
+    if tile_size is not None and tile_size != 0 and tile_size < MIN_TILE_SIZE:
+        raise HTTPException(status_code=422, detail=f"tile_size must be 0 or at least {MIN_TILE_SIZE}")
+
+
+def detect_results(detector, classifier, image_bytes: bytes, device: str, tile_size: Optional[int] = None):
+    # Decode straight from the request buffer; nothing touches the filesystem.
+    return detect_and_classify(
+        detector,
+        classifier,
+        memoryview(image_bytes),
+        device,
+        save_output=False,
+        batch_size=CLASSIFY_BATCH_SIZE,
+        tile_size=tile_size,
+    )
+
 
-    return results
+def run_detection(image_bytes: bytes, tile_size: Optional[int] = None) -> list:
+    """
+    Detect + classify one image, coalescing with concurrent requests when micro-batching is on.
+    A per-request tile_size bypasses the batcher, which uses the server-wide setting.
+    """
+    if MICROBATCH_ENABLED and tile_size is None:
+        return batcher.detect(memoryview(image_bytes))
+    detector, classifier = registry.get()
+    return detect_results(detector, classifier, image_bytes, device=DEVICE, tile_size=tile_size)
 
 
 def build_classifications(results: list) -> List[Dict[str, float]]:
@@ -125,41 +176,131 @@ def build_holds(results: list) -> List[Dict[str, object]]:
     return holds
 
 
-@router.post("/upload", response_model=ImageResponse)
-async def upload_image(payload: ImagePayload, db_session=Depends(get_db)):
+def detect_holds(image_bytes: bytes, tile_size: Optional[int] = None):
+    """Return (holds, classifications) for an image, served from the result cache when possible."""
+    fingerprint = registry.get_fingerprint()
+    key, cached = cache.get(image_bytes, fingerprint, tile_size)
+    if cached is not None:
+        return cached["holds"], cached["classifications"]
+
+    results = run_detection(image_bytes, tile_size)
+    holds = build_holds(results)
+    classifications = build_classifications(results)
+    cache.put(key, fingerprint, holds, classifications)
+    return holds, classifications
+
+
+@contextmanager
+def image_buffer(image: models.Image):
+    """Read-only buffer over a stored image's bytes, memory-mapped from the blob store when possible."""
+    if image.blob_key:
+        with get_blob_store().buffer(image.blob_key) as buf:
+            yield buf
+    else:
+        yield memoryview(image.data)
+
+
+def open_stored_image(image: models.Image) -> Image.Image:
+    """Lazily open a stored image with PIL; pixels are decoded only on first access."""
+    if image.blob_key:
+        return Image.open(get_blob_store().open(image.blob_key))
+    return Image.open(BytesIO(image.data))
+
+
+def image_content_key(image: models.Image) -> str:
+    return image.blob_key or content_key(image.data)
+
+
+def stored_image_loader(image: models.Image):
+    """Callable decoding the stored image to RGB later, without touching the DB session."""
+    blob_key = image.blob_key
+    data = None if blob_key else bytes(image.data)
+
+    def load() -> Image.Image:
+        with (get_blob_store().open(blob_key) if blob_key else BytesIO(data)) as f, Image.open(f) as img:
+            return img.convert("RGB")
+
+    return load
+
+
+def image_dimensions(image: models.Image):
+    if image.width and image.height:
+        return image.width, image.height
+    with open_stored_image(image) as img:
+        return img.size
+
+
+def save_holds(db_session, image_id: int, holds: List[Dict[str, object]],
+               classifications: List[Dict[str, float]]) -> None:
+    """Persist detected holds as Classification rows with a single bulk insert (caller commits)."""
+    rows = [
+        {
+            "image_id": image_id,
+            "hold_index": hold["id"],
+            "label": hold["type"],
+            "confidence": hold["confidence"],
+            "bbox": hold["bbox"],
+            "probs": probs,
+        }
+        for hold, probs in zip(holds, classifications)
+    ]
+    if rows:
+        db_session.bulk_insert_mappings(models.Classification, rows)
+
+
+def load_holds(db_session, image_id: int, include_probs: bool = False) -> List[Dict[str, object]]:
+    """Read an image's stored holds from the classifications table (never touches the image blob)."""
+    rows = (
+        db_session.query(models.Classification)
+        .filter(models.Classification.image_id == image_id)
+        .order_by(models.Classification.hold_index, models.Classification.id)
+        .all()
+    )
+    holds: List[Dict[str, object]] = []
+    for row in rows:
+        if row.bbox is None:
+            continue
+        hold = {
+            "id": row.hold_index if row.hold_index is not None else row.id,
+            "bbox": row.bbox,
+            "type": row.label,
+            "confidence": row.confidence,
+        }
+        if include_probs:
+            hold["probs"] = row.probs
+        holds.append(hold)
+    return holds
+
+
+def store_and_detect(db_session, filename: str, content_type: str, binary_content,
+                     tile_size: Optional[int] = None) -> ImageResponse:
+    """Persist the image bytes, run detection and store its holds. binary_content may be any buffer."""
+    store = get_blob_store()
+    blob_key = store.put(binary_content)
 
-    # upload and decode image step
     try:
-        binary_content = base64.b64decode(payload.data, validate=True)
-    except binascii.Error as exc:
-        raise HTTPException(status_code=400, detail="Invalid base64 payload") from exc
+        # Header-only parse from the stored blob; no pixel decode, no extra in-memory copy.
+        with Image.open(store.open(blob_key)) as header:
+            width, height = header.size
+    except Exception:
+        width = height = None
 
     image = models.Image(
-        filename=payload.filename,
-        content_type=payload.content_type,
-        data=binary_content,
+        filename=filename,
+        content_type=content_type,
+        blob_key=blob_key,
+        size=len(binary_content),
+        width=width,
+        height=height,
     )
 
     # Persist image if desired
     db_session.add(image)
     db_session.commit()
 
-    global DETECTOR_INSTANCE, CLASSIFIER_INSTANCE
-    if "DETECTOR_INSTANCE" not in globals():
-        DETECTOR_INSTANCE = load_detector(YOLO_MODEL)
-    if "CLASSIFIER_INSTANCE" not in globals():
-        CLASSIFIER_INSTANCE = load_classifier(CONVNEXT_MODEL, DEVICE)
-
-    results = detect_results(
-        DETECTOR_INSTANCE,
-        CLASSIFIER_INSTANCE,
-        binary_content,
-        device=DEVICE,
-    )
-
-    classifications = build_classifications(results)
-    holds = build_holds(results)
-
+    holds, classifications = detect_holds(binary_content, tile_size)
+    save_holds(db_session, image.id, holds, classifications)
+    db_session.commit()
 
     # Return classification results, last step
     return ImageResponse(
@@ -172,8 +313,90 @@ async def upload_image(payload: ImagePayload, db_session=Depends(get_db)):
         holds=holds,
     )
 
-@router.post("/pathfinder")
-async def pathfinder(payload: PathfinderPayload, db_session=Depends(get_db)):
+
+def process_upload(payload: ImagePayload, db_session) -> ImageResponse:
+    """Blocking part of /upload (decode, DB commit, inference); runs on the inference pool."""
+
+    # upload and decode image step
+    try:
+        binary_content = base64.b64decode(payload.data, validate=True)
+    except binascii.Error as exc:
+        raise HTTPException(status_code=400, detail="Invalid base64 payload") from exc
+
+    return store_and_detect(db_session, payload.filename, payload.content_type, binary_content, payload.tile_size)
+
+
+@router.post("/upload", response_model=ImageResponse)
+async def upload_image(payload: ImagePayload):
+    check_tile_size(payload.tile_size)
+    return await pool.run(with_session, process_upload, payload)
+
+
+def _check_upload_size(size: int) -> None:
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+
+
+async def read_bounded(chunks, declared_size: Optional[int] = None) -> bytearray:
+    """Accumulate an async byte-chunk stream into one buffer, rejecting bodies over UPLOAD_MAX_BYTES."""
+    if declared_size is not None:
+        _check_upload_size(declared_size)
+    buf = bytearray()
+    async for chunk in chunks:
+        if len(buf) + len(chunk) > UPLOAD_MAX_BYTES:
+            _check_upload_size(len(buf) + len(chunk))
+        buf += chunk
+    if not buf:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return buf
+
+
+async def _upload_file_chunks(upload):
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+@router.post("/upload/binary", response_model=ImageResponse)
+async def upload_image_binary(request: Request, filename: Optional[str] = None,
+                              tile_size: Optional[int] = Query(None, ge=0)):
+    """
+    Upload without base64: either a multipart form with a "file" field, or the raw
+    image bytes as the request body (Content-Type = the image MIME type, ?filename=...).
+    The body is streamed in chunks into a single bounded buffer. ?tile_size=N enables
+    tiled detection for this upload.
+    """
+    check_tile_size(tile_size)
+    header_type = request.headers.get("content-type", "application/octet-stream")
+    declared = request.headers.get("content-length")
+    declared_size = int(declared) if declared and declared.isdigit() else None
+
+    if header_type.startswith("multipart/form-data"):
+        if declared_size is not None:
+            _check_upload_size(declared_size)
+        form = await request.form(max_files=1)
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail='Multipart upload needs a "file" field')
+        try:
+            binary_content = await read_bounded(_upload_file_chunks(upload))
+        finally:
+            await upload.close()
+        filename = filename or upload.filename or "upload.jpg"
+        content_type = upload.content_type or "application/octet-stream"
+    else:
+        binary_content = await read_bounded(request.stream(), declared_size)
+        filename = filename or "upload.jpg"
+        content_type = header_type.split(";", 1)[0].strip()
+
+    return await pool.run(with_session, store_and_detect, filename=filename, content_type=content_type,
+                          binary_content=binary_content, tile_size=tile_size)
+
+
+def process_pathfinder(payload: PathfinderPayload, db_session) -> PathfinderResponse:
+    """Blocking part of /pathfinder (DB, inference, Gemini); runs on the inference pool."""
     image = db_session.get(models.Image, payload.image_id)
     if image is None:
         raise HTTPException(status_code=404, detail="Image not found")
@@ -181,19 +404,14 @@ async def pathfinder(payload: PathfinderPayload, db_session=Depends(get_db)):
     hold_items = [h.dict(exclude_unset=True) for h in payload.holds] if payload.holds else None
 
     if not hold_items:
-        global DETECTOR_INSTANCE, CLASSIFIER_INSTANCE
-        if "DETECTOR_INSTANCE" not in globals():
-            DETECTOR_INSTANCE = load_detector(YOLO_MODEL)
-        if "CLASSIFIER_INSTANCE" not in globals():
-            CLASSIFIER_INSTANCE = load_classifier(CONVNEXT_MODEL, DEVICE)
-
-        detection_results = detect_results(
-            DETECTOR_INSTANCE,
-            CLASSIFIER_INSTANCE,
-            image.data,
-            device=DEVICE,
-        )
-        hold_items = build_holds(detection_results)
+        # Holds computed at upload time are reused; only legacy images are detected here.
+        hold_items = load_holds(db_session, image.id)
+
+    if not hold_items:
+        with image_buffer(image) as buf:
+            hold_items, classifications = detect_holds(buf)
+        save_holds(db_session, image.id, hold_items, classifications)
+        db_session.commit()
 
         if not hold_items:
             if image.path_found is None:
@@ -201,29 +419,197 @@ async def pathfinder(payload: PathfinderPayload, db_session=Depends(get_db)):
             return PathfinderResponse(image_id=image.id, coach=image.path_found)
 
     try:
-        img = Image.open(BytesIO(image.data)).convert("RGB")
+        img_w, img_h = image_dimensions(image)
     except Exception as exc:
         raise HTTPException(status_code=500, detail="Failed to load stored image") from exc
-    
-    img_w, img_h = img.size
 
     try:
-        normalized = normalize_holds({"holds": hold_items}, img_w, img_h)
+        holds = HoldArrays.from_hold_data({"holds": hold_items}, img_w, img_h)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     
-    coach: Optional[Dict[str, Any]] = None
-    if not payload.local_only:
-        try:
-            coach = generate_gemini_coach(img, normalized, payload.model or "models/gemini-2.5-flash")
-        except Exception:
-            coach = None
-
-    if coach is None:
-        coach = build_local_coach(normalized)
-
+    model = payload.model or DEFAULT_COACH_MODEL
+    if payload.local_only or payload.background:
+        coach = build_local_coach(holds)
+    else:
+        # Pixels are only decoded on a coach-cache miss; past the deadline the local coach answers.
+        coach = coach_service.coach(image_content_key(image), stored_image_loader(image), holds, model)
+
+    # Pending background jobs were computed for older holds and must not overwrite this.
+    jobs.invalidate(image.id)
     image.path_found = coach
     db_session.add(image)
     db_session.commit()
 
-    return PathfinderResponse(image_id=image.id, coach=coach)
\ No newline at end of file
+    job_id = None
+    if payload.background and not payload.local_only:
+        # Started after the commit so the local coach can never overwrite the Gemini result.
+        job_id = jobs.start(
+            image.id, image_content_key(image), stored_image_loader(image), holds.to_normalized(), model, coach
+        ).id
+
+    return PathfinderResponse(image_id=image.id, coach=coach, job_id=job_id)
+
+
+@router.post("/pathfinder")
+async def pathfinder(payload: PathfinderPayload):
+    return await pool.run(with_session, process_pathfinder, payload)
+
+
+async def wait_for_job(job, timeout: float) -> None:
+    try:
+        # shield: timing out must not cancel the job's own future.
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.finished)), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+@router.get("/pathfinder/jobs/{job_id}")
+async def pathfinder_job(job_id: str, wait: float = 0.0):
+    """Background coach job status; with wait > 0 the request long-polls for the result."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0 and job.status == PENDING:
+        await wait_for_job(job, min(wait, COACH_JOB_MAX_WAIT_S))
+    return job.to_dict()
+
+
+@router.get("/pathfinder/jobs/{job_id}/events")
+async def pathfinder_job_events(job_id: str):
+    """Server-sent events: the current status, then the final result once the job finishes."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+        while job.status == PENDING:
+            await wait_for_job(job, SSE_KEEPALIVE_S)
+            if job.status == PENDING:
+                yield ": keep-alive\n\n"
+        yield f"event: result\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/images/{image_id}/holds")
+def image_holds(image_id: int, db_session=Depends(get_db)):
+    # Existence check selects only the id so the image blob is never loaded.
+    exists = db_session.query(models.Image.id).filter(models.Image.id == image_id).first()
+    if exists is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return {"image_id": image_id, "holds": load_holds(db_session, image_id, include_probs=True)}
+
+
+def holds_signature(db_session, image_id: int) -> tuple:
+    """(row count, max row id) of an image's stored holds; every edit below changes it."""
+    return tuple(
+        db_session.query(func.count(models.Classification.id), func.max(models.Classification.id))
+        .filter(models.Classification.image_id == image_id)
+        .one()
+    )
+
+
+def process_hold_edit(image_id: int, payload: HoldEditPayload, db_session) -> PathfinderResponse:
+    """Apply a hold delta to the stored holds and recompute the local coach incrementally."""
+    image = db_session.get(models.Image, image_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    with edit_cache.lock(image_id):
+        # Legacy rows without hold_index are served with their row id as hold id (see load_holds);
+        # store that id so the edit below can find and replace them like any other row.
+        db_session.query(models.Classification).filter(
+            models.Classification.image_id == image_id,
+            models.Classification.hold_index.is_(None),
+        ).update({models.Classification.hold_index: models.Classification.id}, synchronize_session=False)
+
+        state = edit_cache.get(image_id, holds_signature(db_session, image_id))
+        if state is None:
+            try:
+                img_w, img_h = image_dimensions(image)
+            except Exception as exc:
+                raise HTTPException(status_code=500, detail="Failed to load stored image") from exc
+            holds = HoldArrays.from_hold_data({"holds": load_holds(db_session, image_id)}, img_w, img_h)
+            state = EditState.build(holds)
+
+        existing = set(state.holds.ids)
+        updates = [h.dict(exclude_unset=True) for h in payload.update]
+        unknown = sorted({h.get("id") for h in updates} - existing, key=str) + sorted(set(payload.remove) - existing)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown hold id(s): {unknown}")
+        if {h["id"] for h in updates} & set(payload.remove):
+            raise HTTPException(status_code=400, detail="A hold cannot be updated and removed in the same edit")
+
+        additions = [h.dict(exclude_unset=True) for h in payload.add]
+        next_id = max(existing, default=-1) + 1
+        for hold in additions:
+            if hold.get("id") is None or hold["id"] in existing:
+                hold["id"] = next_id
+            existing.add(hold["id"])
+            next_id = max(next_id, hold["id"] + 1)
+
+        try:
+            state, _ = apply_edit(state, payload.remove, updates + additions)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+        # Updated holds are rewritten as new rows (their class probabilities no longer apply).
+        changed_ids = list(payload.remove) + [h["id"] for h in updates]
+        old_rows = {}
+        if changed_ids:
+            query = db_session.query(models.Classification).filter(
+                models.Classification.image_id == image_id,
+                models.Classification.hold_index.in_(changed_ids),
+            )
+            old_rows = {row.hold_index: row for row in query}
+            query.delete(synchronize_session=False)
+        rows = []
+        index_of = {hid: i for i, hid in enumerate(state.holds.ids)}
+        for hold in updates + additions:
+            i = index_of[hold["id"]]
+            old = old_rows.get(hold["id"])
+            label = state.holds.types[i]
+            confidence = hold.get("confidence")
+            if confidence is None and old is not None and old.label == label:
+                confidence = old.confidence
+            rows.append({
+                "image_id": image_id,
+                "hold_index": hold["id"],
+                "label": label,
+                "confidence": confidence,
+                "bbox": [int(v) for v in state.holds.raw_bboxes[i]],
+                "probs": None,
+            })
+        if rows:
+            db_session.bulk_insert_mappings(models.Classification, rows)
+
+        coach = state.coach()
+        # A pending background coach job was computed for the holds before this edit.
+        jobs.invalidate(image_id)
+        image.path_found = coach
+        db_session.add(image)
+        db_session.commit()
+
+        state.signature = holds_signature(db_session, image_id)
+        edit_cache.put(image_id, state)
+
+    return PathfinderResponse(image_id=image_id, coach=coach)
+
+
+@router.patch("/images/{image_id}/holds", response_model=PathfinderResponse)
+async def edit_image_holds(image_id: int, payload: HoldEditPayload):
+    return await pool.run(with_session, process_hold_edit, image_id, payload)
+
+
+@router.get("/metrics")
+def metrics():
+    return {
+        "microbatch": batcher.metrics.snapshot(),
+        "executor": pool.stats(),
+        "result_cache": cache.stats(),
+        "coach": coach_service.stats(),
+        "coach_jobs": jobs.stats(),
+        "hold_edits": edit_cache.stats(),
+    }
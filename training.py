@@ -3,11 +3,13 @@ from pathlib import Path
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, Subset
-from torchvision import datasets, transforms
+from torchvision import transforms
 import timm
 from tqdm import tqdm
 
-DATA = "holds_cls"      # change if needed
+from pack_shards import image_dataset
+
+DATA = "holds_cls"      # change if needed (ImageFolder or pack_shards.py output)
 NUM_CLASSES = 6
 BATCH = 30
 EPOCHS = 10            # short on purpose
@@ -39,8 +41,8 @@ def main():
         transforms.Normalize((0.485,0.456,0.406), (0.229,0.224,0.225)),
     ])
 
-    train_ds_full = datasets.ImageFolder(os.path.join(DATA, "train"), transform=train_tf)
-    val_ds_full   = datasets.ImageFolder(os.path.join(DATA, "val"),   transform=eval_tf)
+    train_ds_full = image_dataset(os.path.join(DATA, "train"), transform=train_tf)
+    val_ds_full   = image_dataset(os.path.join(DATA, "val"),   transform=eval_tf)
 
     print("Class mapping:", train_ds_full.class_to_idx)
 
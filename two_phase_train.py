@@ -1,32 +1,110 @@
+import argparse
+import json
 import os
+import random
+import time
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
+from torchvision import transforms
 import timm
 from timm.data import Mixup
 from timm.loss import SoftTargetCrossEntropy
 from tqdm import tqdm
 
+from eval_cache import cached_eval_loader
+from pack_shards import image_dataset
+
 # =========================
 # SETTINGS (EDIT THESE)
 # =========================
-DATA_DIR = "holds_cls"   # <-- change if your folder name is different
+DATA_DIR = "holds_cls"   # <-- change if your folder name is different (or a pack_shards.py output)
 NUM_CLASSES = 6
 BATCH_SIZE = 64
-NUM_WORKERS = 0          # Windows safe. After it works, try 2.
+NUM_WORKERS = 0          # Windows safe. After it works, try 2, or "auto" to size from the CPU count.
 PHASE_A_EPOCHS = 2
 PHASE_B_EPOCHS = 20
+LR_A = 3e-4              # head-only phase
+LR_B = 1e-4              # full fine-tune (use 5e-5 or lower when fine-tuning on generated crops)
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 MODEL_NAME = "convnext_tiny.in12k_ft_in1k"
 BEST_PATH = "best_convnext_two_phase.pt"
+CHECKPOINT_PATH = "two_phase_checkpoint.pt"  # full training state; training resumes from it automatically
+CHECKPOINT_EVERY = 1     # epochs between checkpoints
 # Regularization knobs
 MIXUP_ALPHA = 0.2        # 0.0 disables mixup
 CUTMIX_ALPHA = 1.0       # 0.0 disables cutmix
 RANDOM_ERASE_P = 0.25    # 0.0 disables random erasing
 DROP_PATH_RATE = 0.1     # stochastic depth for ConvNeXt
+# Eval sets are decoded and resized once, then reused by every epoch (see eval_cache.py)
+EVAL_CACHE = True
+EVAL_CACHE_DIR = None    # None = DATA_DIR/.eval_cache
+EVAL_CACHE_RAM_MB = 2048  # larger caches are memory-mapped
+EVAL_CACHE_MAX_MB = 8192  # larger eval sets are read from files every epoch
 # =========================
 
+# Settings that can be set from a JSON config file (lowercase keys) or the command line
+CLI_SETTINGS = {
+    "DATA_DIR": str,
+    "BATCH_SIZE": int,
+    "NUM_WORKERS": lambda v: v if v == "auto" else int(v),
+    "PHASE_A_EPOCHS": int,
+    "PHASE_B_EPOCHS": int,
+    "LR_A": float,
+    "LR_B": float,
+    "MODEL_NAME": str,
+    "BEST_PATH": str,
+    "CHECKPOINT_PATH": str,
+    "CHECKPOINT_EVERY": int,
+    "MIXUP_ALPHA": float,
+    "CUTMIX_ALPHA": float,
+    "RANDOM_ERASE_P": float,
+    "DROP_PATH_RATE": float,
+    "EVAL_CACHE": lambda v: str(v).lower() not in ("0", "false", "no"),
+    "EVAL_CACHE_DIR": str,
+}
+# A checkpoint taken under different values of these cannot continue the same run faithfully
+RESUME_SETTINGS = ("DATA_DIR", "BATCH_SIZE", "PHASE_B_EPOCHS", "MODEL_NAME", "LR_A", "LR_B")
+
+def parse_settings(argv=None):
+    """Settings from --config and CLI flags (CLI wins), plus whether to resume."""
+    parser = argparse.ArgumentParser(description="Two-phase ConvNeXt training: head only, then all layers")
+    parser.add_argument("--config", help='JSON file of settings, e.g. {"data_dir": "holds_cls_packed", "batch_size": 32}')
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing checkpoint and start from scratch")
+    for name, kind in CLI_SETTINGS.items():
+        flags = ["--" + name.lower().replace("_", "-")] + (["--workers"] if name == "NUM_WORKERS" else [])
+        parser.add_argument(*flags, dest=name.lower(), type=kind, default=None,
+                            help=f"default: {globals()[name]!r}")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = sorted(set(config) - {name.lower() for name in CLI_SETTINGS})
+        if unknown:
+            parser.error(f"Unknown settings in {args.config}: {unknown}")
+        settings.update({key.upper(): CLI_SETTINGS[key.upper()](value) for key, value in config.items()})
+    for name in CLI_SETTINGS:
+        value = getattr(args, name.lower())
+        if value is not None:
+            settings[name] = value
+    return settings, not args.no_resume
+
+def loader_kwargs():
+    """DataLoader worker options; NUM_WORKERS="auto" sizes them from the CPUs available."""
+    workers = NUM_WORKERS
+    if workers == "auto":
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        # On CPU the forward/backward pass needs the cores too; on GPU keep one for the main process.
+        workers = min(8, cpus // 2 if DEVICE == "cpu" else cpus - 1)
+    kwargs = {"num_workers": max(0, int(workers)), "pin_memory": (DEVICE == "cuda")}
+    if kwargs["num_workers"] > 0:
+        # Keep workers (and their dataset handles) alive across epochs; fewer workers prefetch deeper.
+        kwargs.update(persistent_workers=True, prefetch_factor=4 if kwargs["num_workers"] <= 2 else 2)
+    return kwargs
+
 def get_transforms():
     # Good default transforms for your task
     mean = (0.485, 0.456, 0.406)
@@ -51,20 +129,25 @@ def get_transforms():
 
     return train_tf, eval_tf
 
+def make_eval_loader(root, eval_tf):
+    if EVAL_CACHE:
+        loader = cached_eval_loader(
+            root, eval_tf, BATCH_SIZE, EVAL_CACHE_DIR or os.path.join(DATA_DIR, ".eval_cache"),
+            ram_mb=EVAL_CACHE_RAM_MB, max_mb=EVAL_CACHE_MAX_MB, num_workers=loader_kwargs()["num_workers"]
+        )
+        if loader is not None:
+            return loader
+
+    ds = image_dataset(root, transform=eval_tf)
+    return DataLoader(ds, batch_size=BATCH_SIZE, shuffle=False, **loader_kwargs())
+
 def make_loaders():
     train_tf, eval_tf = get_transforms()
 
-    train_ds = datasets.ImageFolder(os.path.join(DATA_DIR, "train"), transform=train_tf)
-    val_ds   = datasets.ImageFolder(os.path.join(DATA_DIR, "val"),   transform=eval_tf)
+    train_ds = image_dataset(os.path.join(DATA_DIR, "train"), transform=train_tf)
 
-    train_loader = DataLoader(
-        train_ds, batch_size=BATCH_SIZE, shuffle=True,
-        num_workers=NUM_WORKERS, pin_memory=(DEVICE == "cuda")
-    )
-    val_loader = DataLoader(
-        val_ds, batch_size=BATCH_SIZE, shuffle=False,
-        num_workers=NUM_WORKERS, pin_memory=(DEVICE == "cuda")
-    )
+    train_loader = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True, **loader_kwargs())
+    val_loader = make_eval_loader(os.path.join(DATA_DIR, "val"), eval_tf)
     return train_ds, train_loader, val_loader
 
 def make_real_val_loader():
@@ -75,12 +158,8 @@ def make_real_val_loader():
     if not os.path.isdir(real_val_dir):
         return None
 
-    real_val_ds = datasets.ImageFolder(real_val_dir, transform=eval_tf)
-    real_val_loader = DataLoader(
-        real_val_ds, batch_size=BATCH_SIZE, shuffle=False,
-        num_workers=NUM_WORKERS, pin_memory=(DEVICE == "cuda")
-    )
-    return real_val_ds, real_val_loader
+    real_val_loader = make_eval_loader(real_val_dir, eval_tf)
+    return real_val_loader.dataset, real_val_loader
 
 @torch.no_grad()
 def evaluate(model, loader, criterion):
@@ -148,9 +227,49 @@ def unfreeze_all(model):
     for p in model.parameters():
         p.requires_grad = True
 
-def main():
+def rng_state():
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def save_checkpoint(phase, epoch, model, optimizer, scheduler, scaler, best_val_acc):
+    """Write the full training state after `epoch` completed epochs of `phase` ("A" or "B")."""
+    state = {
+        "phase": phase,
+        "epoch": epoch,
+        "best_val_acc": best_val_acc,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict() if scheduler is not None else None,
+        "scaler": scaler.state_dict(),
+        "rng": rng_state(),
+        "settings": {name: globals()[name] for name in CLI_SETTINGS},
+    }
+    # Write then rename, so a crash mid-save never leaves a truncated checkpoint.
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def checkpoint_due(epoch, num_epochs):
+    return (epoch + 1) % max(1, CHECKPOINT_EVERY) == 0 or epoch + 1 == num_epochs
+
+def main(argv=None):
+    settings, resume = parse_settings(argv)
+    globals().update(settings)
+
     train_ds, train_loader, val_loader = make_loaders()
     print("Class mapping:", train_ds.class_to_idx)
+    print("DataLoader:", {k: v for k, v in loader_kwargs().items() if k != "pin_memory"})
 
     model = timm.create_model(
         MODEL_NAME,
@@ -177,6 +296,20 @@ def main():
 
     best_val_acc = 0.0
 
+    ckpt = None
+    if resume and os.path.isfile(CHECKPOINT_PATH):
+        ckpt = torch.load(CHECKPOINT_PATH, map_location=DEVICE, weights_only=False)
+        changed = [name for name in RESUME_SETTINGS if ckpt["settings"].get(name) != globals()[name]]
+        if changed:
+            print(f"⚠ {', '.join(changed)} differ from the checkpoint run; use --no-resume to start over")
+        model.load_state_dict(ckpt["model"])
+        scaler.load_state_dict(ckpt["scaler"])
+        best_val_acc = ckpt["best_val_acc"]
+        print(f"Resuming from {CHECKPOINT_PATH}: phase {ckpt['phase']}, {ckpt['epoch']} epoch(s) done, "
+              f"best val acc={best_val_acc:.3f}")
+    start_a = 0 if ckpt is None else (ckpt["epoch"] if ckpt["phase"] == "A" else PHASE_A_EPOCHS)
+    start_b = ckpt["epoch"] if ckpt is not None and ckpt["phase"] == "B" else 0
+
     # =========================
     # PHASE A: head-only
     # =========================
@@ -185,19 +318,26 @@ def main():
 
     optA = torch.optim.AdamW(
         filter(lambda p: p.requires_grad, model.parameters()),
-        lr=3e-4,
+        lr=LR_A,
         weight_decay=0.05
     )
+    if ckpt is not None and ckpt["phase"] == "A":
+        optA.load_state_dict(ckpt["optimizer"])
+        set_rng_state(ckpt["rng"])
 
-    for epoch in range(PHASE_A_EPOCHS):
+    for epoch in range(start_a, PHASE_A_EPOCHS):
+        start = time.perf_counter()
         tr_loss, tr_acc = train_one_epoch(model, train_loader, optA, criterion_train, scaler, scheduler=None, mixup_fn=mixup_fn)
+        samples_per_s = len(train_loader.dataset) / (time.perf_counter() - start)
         va_loss, va_acc = evaluate(model, val_loader, criterion_eval)
-        print(f"[A {epoch+1}/{PHASE_A_EPOCHS}] train acc={tr_acc:.3f} loss={tr_loss:.4f} | val acc={va_acc:.3f} loss={va_loss:.4f}")
+        print(f"[A {epoch+1}/{PHASE_A_EPOCHS}] train acc={tr_acc:.3f} loss={tr_loss:.4f} | val acc={va_acc:.3f} loss={va_loss:.4f} | {samples_per_s:.1f} samples/s")
 
         if va_acc > best_val_acc:
             best_val_acc = va_acc
             torch.save(model.state_dict(), BEST_PATH)
             print(f"Saved best so far (val acc={best_val_acc:.3f})")
+        if checkpoint_due(epoch, PHASE_A_EPOCHS):
+            save_checkpoint("A", epoch + 1, model, optA, None, scaler, best_val_acc)
 
     # =========================
     # PHASE B: fine-tune all
@@ -207,25 +347,35 @@ def main():
 
     optB = torch.optim.AdamW(
         model.parameters(),
-        lr=1e-4,
+        lr=LR_B,
         weight_decay=0.05
     )
 
     # Cosine decay over ALL training steps in Phase B
     total_steps = PHASE_B_EPOCHS * len(train_loader)
     scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optB, T_max=total_steps)
-
-    for epoch in range(PHASE_B_EPOCHS):
+    if ckpt is not None and ckpt["phase"] == "B":
+        optB.load_state_dict(ckpt["optimizer"])
+        scheduler.load_state_dict(ckpt["scheduler"])
+        set_rng_state(ckpt["rng"])
+    if start_b >= PHASE_B_EPOCHS:
+        print(f"Checkpoint {CHECKPOINT_PATH} already finished training; use --no-resume to train again.")
+
+    for epoch in range(start_b, PHASE_B_EPOCHS):
+        start = time.perf_counter()
         tr_loss, tr_acc = train_one_epoch(model, train_loader, optB, criterion_train, scaler, scheduler=scheduler, mixup_fn=mixup_fn)
+        samples_per_s = len(train_loader.dataset) / (time.perf_counter() - start)
         va_loss, va_acc = evaluate(model, val_loader, criterion_eval)
         lr_now = optB.param_groups[0]["lr"]
 
-        print(f"[B {epoch+1}/{PHASE_B_EPOCHS}] train acc={tr_acc:.3f} loss={tr_loss:.4f} | val acc={va_acc:.3f} loss={va_loss:.4f} | lr={lr_now:.2e}")
+        print(f"[B {epoch+1}/{PHASE_B_EPOCHS}] train acc={tr_acc:.3f} loss={tr_loss:.4f} | val acc={va_acc:.3f} loss={va_loss:.4f} | lr={lr_now:.2e} | {samples_per_s:.1f} samples/s")
 
         if va_acc > best_val_acc:
             best_val_acc = va_acc
             torch.save(model.state_dict(), BEST_PATH)
             print(f"Saved best so far (val acc={best_val_acc:.3f})")
+        if checkpoint_due(epoch, PHASE_B_EPOCHS):
+            save_checkpoint("B", epoch + 1, model, optB, scheduler, scaler, best_val_acc)
 
     # =========================
     # VERIFICATION: unseen images (real_val)